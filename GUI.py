@@ -1,3 +1,6 @@
+import os
+import queue
+import threading
 import tkinter as tk
 from tkinter import font as tkFont
 from tkinter import filedialog
@@ -5,6 +8,8 @@ from tkinter import ttk
 from PIL import Image, ImageTk
 
 from utils import *
+from preview import PreviewGallery
+import generate
 
 # Hardcoded GUI settings
 GUI_WIDTH = 1200
@@ -43,11 +48,24 @@ output_directory = None
 mnist_ready = False
 last_corner_coordinates = None
 X, Y = [], []
+bbox_table = None
+digit_atlas = None
+resize_cache = ResizeCache()
+# Random source of the previews, only used on the gallery thread, so previews never
+# draw from the global state a generation in this process seeds per image
+preview_rng = np.random.RandomState()
+generation_stats = None
+generation_control = None
+# Set when the shown preview is requested before the gallery has rendered it
+waiting_for_preview = False
+# Messages of the background worker thread, handled on the Tk thread by poll_queue
+ui_queue = queue.Queue()
 
 # Function to update the dictionary whenever the user changes the value
 def update_value(key, var):
     input_dict[key] = var.get()  # Update the dictionary with the new value
     generate_dataset_button.config(state='disabled')
+    gallery.invalidate()
 
 def update_dataset_size(key, str):
     try:
@@ -60,10 +78,12 @@ def update_dataset_size(key, str):
 # Functions to make checkboxes mutually exclusive
 def update_checkbox1():
     generate_dataset_button.config(state='disabled')
+    gallery.invalidate()
     if cb1_var.get() == 1:
         cb2_var.set(0)
 def update_checkbox2():
     generate_dataset_button.config(state='disabled')
+    gallery.invalidate()
     if cb2_var.get() == 1:
         cb1_var.set(0)
 
@@ -98,172 +118,278 @@ def check_inputs(input_dict):
         error_label.grid_forget()
         return True
     else:
-        error_label.grid(row = (RIGHT_GRID_ROWS // 2 - 1) + (RIGHT_GRID_ROWS % 2), column = 0, rowspan= 2 - (RIGHT_GRID_ROWS % 2))
+        show_error_label()
         return False
 
-# Function to update progress bar to 100% when generating previews
+def show_error_label():
+    error_label.grid(row = (RIGHT_GRID_ROWS // 2 - 1) + (RIGHT_GRID_ROWS % 2), column = 0, rowspan= 2 - (RIGHT_GRID_ROWS % 2))
+
+# Runs task() on a background thread, on_done(result) is then called on the Tk thread
+def run_in_background(task, on_done=None):
+    def worker():
+        try:
+            result = task()
+        except generate.GenerationCancelled:
+            ui_queue.put(('cancelled', None))
+        except Exception as error:
+            ui_queue.put(('error', error))
+        else:
+            ui_queue.put(('done', (on_done, result)))
+
+    threading.Thread(target=worker, daemon=True).start()
+
+# Applies the messages of the background thread to the widgets, polled with root.after
+def poll_queue():
+    global waiting_for_preview
+    try:
+        while True:
+            kind, value = ui_queue.get_nowait()
+            if kind == 'progress':
+                percent, text = value
+                progress_var.set(percent)
+                progress_str.set(text)
+            elif kind == 'done':
+                on_done, result = value
+                if on_done is not None:
+                    on_done(result)
+            elif kind == 'cancelled':
+                set_running(None)
+                progress_str.set("Generating Dataset --> Cancelled")
+            elif kind == 'error':
+                set_running(None)
+                progress_str.set("Failed: {}".format(value))
+            elif kind == 'preview_error':
+                # Inputs create_image rejects (or a failing render), a generation keeps running
+                waiting_for_preview = False
+                error_str.set("Preview failed: {}".format(value))
+                show_error_label()
+    except queue.Empty:
+        pass
+
+    root.after(100, poll_queue)
+
+# Enables the buttons of what can be done while task ('preprocess', 'generate' or None) runs
+def set_running(task):
+    preview_button.config(state='disabled' if task == 'preprocess' else 'normal')
+    pause_button.config(state='normal' if task == 'generate' else 'disabled', text='Pause')
+    cancel_button.config(state='normal' if task == 'generate' else 'disabled')
+    if task is None:
+        generate_dataset_button.config(state='active' if mnist_ready else 'disabled')
+    else:
+        generate_dataset_button.config(state='disabled')
+
+def toggle_pause():
+    if generation_control.paused:
+        generation_control.resume()
+        pause_button.config(text='Pause')
+    else:
+        generation_control.pause()
+        pause_button.config(text='Resume')
+        progress_str.set("Pausing after the images in progress")
+
+def cancel_generation():
+    generation_control.cancel()
+    pause_button.config(state='disabled')
+    cancel_button.config(state='disabled')
+    progress_str.set("Cancelling after the images in progress")
+
+def close_window():
+    if generation_control is not None:
+        generation_control.cancel()
+    gallery.close()
+    root.destroy()
+
+# Renders one preview on the gallery thread, the PhotoImage is only made by show_preview
+def render_preview(params):
+    settings, corner_coordinates = dict(params[0]), params[1]
+
+    image, added_objects = create_image(X,
+                                        Y,
+                                        image_size=(int(settings["Image Height"]), int(settings["Image Width"])),
+                                        noise_intensity=int(settings["Noise Intensity (0-256)"]),
+                                        grid_rows=int(settings["Image Grid Rows"]),
+                                        grid_cols=int(settings["Image Grid Cols"]),
+                                        max_objects=int(settings["Max Number of Objects"]),
+                                        max_scaling=float(settings['Max Object Scaling']),
+                                        add_gridlines=True,
+                                        allow_overlap=False,
+                                        corner_coordinates=corner_coordinates,
+                                        atlas=digit_atlas,
+                                        resize_cache=resize_cache,
+                                        rng=preview_rng)
+    
+    image = add_bboxes_to_image(image, 
+                                added_objects, 
+                                cmap,
+                                corner_coordinates=corner_coordinates)
+
+    image_box_dim = 512
+    m, n, _ = image.shape
+
+    scaler = image_box_dim / max(m, n)
+
+    # Convert NumPy array to PIL Image
+    img = Image.fromarray(image)
+
+    img = img.resize((int(n * scaler), int(m * scaler)), Image.NEAREST)
+
+    objects_text = "Added Numbers:\n"
+
+    if corner_coordinates:
+        header = ['Class', 'X Min', 'Y Min', 'X Max', 'Y Max']
+    else:
+        header = ['Class', 'X Center', 'Y Center', 'Width', 'Height']
+
+    header = ['{: ^10}'.format(string) for string in header]
+    objects_text += '|'.join(header) + '\n'
+
+    return img, objects_text + added_objects_txt(added_objects)
+
+def show_preview(preview):
+    img, objects_text = preview
+
+    right_content_frame.config(bg='light gray')
+
+    # Convert the PIL Image to ImageTk object
+    imgtk = ImageTk.PhotoImage(image=img)
+
+    img_frame.grid(row=0, column=0, rowspan=RIGHT_GRID_ROWS-1, padx=10, pady=10)
+
+    img_label.config(image=imgtk)
+    img_label.image = imgtk
+    img_label.pack()
+
+    objects_str.set(objects_text)
+    objects_label.grid(row=RIGHT_GRID_ROWS-1, column=0, rowspan=1, padx=20, sticky='n')
+
+    previous_button.config(state='normal')
+    generate_dataset_button.config(state='active')
+    dataset_size_entry.config(state='normal')
+    generate_dataset_button.pack()
+
+# Called on the Tk thread whenever the gallery has rendered a preview
+def preview_ready(result=None):
+    global waiting_for_preview
+    if waiting_for_preview:
+        waiting_for_preview = False
+        generate_previews()
+
+# Shows the next preview of the gallery, rendered ahead of time for the current inputs
 def generate_previews():
-    global mnist_ready, X, Y, input_dict, last_corner_coordinates
+    global Y, last_corner_coordinates, waiting_for_preview
     
     corner_coordinates = bool(cb1_var.get())
-
-    img_label.pack_forget()
-    img_frame.grid_forget()
-    objects_label.grid_forget()
     
     inputs_ready = check_inputs(input_dict)
 
     if inputs_ready:
 
+        if not mnist_ready:
+            # The preview continues once MNIST is loaded in the background
+            preprocess_mnist(on_done=generate_previews)
+            return
+
         if corner_coordinates != last_corner_coordinates:
-            preprocess_mnist(corner_coordinates=corner_coordinates)
+            Y = bbox_table_to_labels(bbox_table,
+                                     corner_coordinates=corner_coordinates)
             last_corner_coordinates = corner_coordinates
 
-        right_content_frame.config(bg='light gray')
-
-        image, added_objects = create_image(X,
-                                            Y,
-                                            image_size=(int(input_dict["Image Height"]), int(input_dict["Image Width"])),
-                                            noise_intensity=int(input_dict["Noise Intensity (0-256)"]),
-                                            grid_rows=int(input_dict["Image Grid Rows"]),
-                                            grid_cols=int(input_dict["Image Grid Cols"]),
-                                            max_objects=int(input_dict["Max Number of Objects"]),
-                                            max_scaling=float(input_dict['Max Object Scaling']),
-                                            add_gridlines=True,
-                                            allow_overlap=False,
-                                            corner_coordinates=corner_coordinates)
-        
-        image = add_bboxes_to_image(image, 
-                                    added_objects, 
-                                    cmap,
-                                    corner_coordinates=corner_coordinates)
-
-        image_box_dim = 512
-        m, n, _ = image.shape
-
-        scaler = image_box_dim / max(m, n)
-
-        # Convert NumPy array to PIL Image
-        img = Image.fromarray(image)
-    
-        img = img.resize((int(n * scaler), int(m * scaler)), Image.NEAREST)
-        # Convert the PIL Image to ImageTk object
-        imgtk = ImageTk.PhotoImage(image=img)
-
-        img_frame.grid(row=0, column=0, rowspan=RIGHT_GRID_ROWS-1, padx=10, pady=10)
+        gallery.set_params((tuple(input_dict.items()), corner_coordinates))
+        preview = gallery.next()
 
-        img_label.config(image=imgtk)
-        img_label.image = imgtk
-        img_label.pack()
-
-        objects_text = "Added Numbers:\n"
-
-        if last_corner_coordinates:
-            header = ['Class', 'X Min', 'Y Min', 'X Max', 'Y Max']
+        if preview is None:
+            # Shown by preview_ready once the gallery thread has rendered it
+            waiting_for_preview = True
         else:
-            header = ['Class', 'X Center', 'Y Center', 'Width', 'Height']
-
-        header = ['{: ^10}'.format(string) for string in header]
-        objects_text += '|'.join(header) + '\n'
-
-        objects_str.set(objects_text + added_objects_txt(added_objects))
-        objects_label.grid(row=RIGHT_GRID_ROWS-1, column=0, rowspan=1, padx=20, sticky='n')
-
-        generate_dataset_button.config(state='active')
-        dataset_size_entry.config(state='normal')
-        generate_dataset_button.pack()
+            show_preview(preview)
     
     else:
+        img_label.pack_forget()
+        img_frame.grid_forget()
+        objects_label.grid_forget()
+        previous_button.config(state='disabled')
         generate_dataset_button.config(state='disabled')
         dataset_size_entry.config(state='disabled')
 
-def preprocess_mnist(corner_coordinates):
-    global X, Y, mnist_ready
+def previous_preview():
+    preview = gallery.previous()
+    if preview is not None:
+        show_preview(preview)
 
+def preprocess_mnist(on_done=None):
     progress_str.set("Preprocessing MNIST Dataset")
     progress_var.set(0)
-    root.update_idletasks()
-
-    X, Y = load_mnist()
-
-    X_bboxes = []
-    n = X.shape[0]    
-    update_iter = n // 100
-
-    for i in range(n):
-        X_bboxes.append(find_bbox(X[i], 
-                                  corner_coordinates=corner_coordinates))
-        if i % update_iter == 0:
-            progress_var.set(100 * i / n)
-            root.update_idletasks()
-
-    X_bboxes = np.array(X_bboxes)
-    Y = np.hstack([Y, X_bboxes])
-
-    progress_var.set(100)  # Set progress to 100%
-    progress_str.set("Preprocessing MNIST Dataset --> Done")
+    set_running('preprocess')
+
+    # The bbox table holds both coordinate systems, so it is only built once
+    def preprocess():
+        objects, classes = load_mnist()
+        table = load_bbox_table(objects, classes)
+        return objects, table, load_digit_atlas(objects, table)
+
+    def preprocessed(result):
+        global X, bbox_table, digit_atlas, mnist_ready
+        X, bbox_table, digit_atlas = result
+        mnist_ready = True
+
+        progress_var.set(100)  # Set progress to 100%
+        progress_str.set("Preprocessing MNIST Dataset --> Done")
+        set_running(None)
+        if on_done is not None:
+            on_done()
+
+    run_in_background(preprocess, preprocessed)
     
-    del X_bboxes
+def update_generation_progress(done, total):
+    # Called on the generation thread, the widgets are updated by poll_queue
+    ui_queue.put(('progress', (100 * done / total, generation_stats.progress_line())))
 
-    mnist_ready = True
-    
 def generate_dataset():
-    global X, Y
+    global generation_stats, generation_control
 
     corner_coordinates = bool(cb1_var.get())
 
     if output_directory:
 
         progress_str.set("{: <36}".format("Generating Dataset"))
-
-        image_output_dir = os.path.join(output_directory, r"images")
-        label_output_dir = os.path.join(output_directory, r"labels")
-        dirs = [image_output_dir, label_output_dir]
-
-        for dir in dirs:
-            if not os.path.exists(dir):
-                os.makedirs(dir)
-
-        n = min(dataset_size['size'], 99999999)
-        update_iter = n // 100
-        
-        for i in range(n):
-            image_id = f"{i:08d}"
-            
-            image, added_objects = create_image(X,
-                                                Y,
-                                                image_size=(int(input_dict["Image Height"]), int(input_dict["Image Width"])),
-                                                noise_intensity=int(input_dict["Noise Intensity (0-256)"]),
-                                                grid_rows=int(input_dict["Image Grid Rows"]),
-                                                grid_cols=int(input_dict["Image Grid Cols"]),
-                                                max_objects=int(input_dict["Max Number of Objects"]),
-                                                max_scaling=float(input_dict['Max Object Scaling']),
-                                                add_gridlines=False,
-                                                allow_overlap=False,
-                                                corner_coordinates=corner_coordinates)
-            
-            image_filename = f"{image_id}.jpg"
-            image_path = os.path.join(image_output_dir, image_filename)
-            cv2.imwrite(image_path, image)
-
-            labels_list = []
-            for added_object in added_objects.values():
-                class_id = added_object['class']
-                a, b, c, d = added_object['bbox_norm']
-                labels_list.append(f"{class_id} {a:.6f} {b:.6f} {c:.6f} {d:.6f}")
-
-            # Write the YOLO annotation text file
-            label_filename = f"{image_id}.txt"
-            label_path = os.path.join(label_output_dir, label_filename)
-            with open(label_path, 'w') as f:
-                f.write("\n".join(labels_list))
-
-            if i % update_iter == 0:
-                progress_var.set(100 * i / n)
-                root.update_idletasks()
-
-        progress_var.set(100)
-        progress_str.set("Generating Dataset --> Done")
+        progress_var.set(0)
+
+        config = {'image_size'         : (int(input_dict["Image Height"]), int(input_dict["Image Width"])),
+                  'noise_intensity'    : int(input_dict["Noise Intensity (0-256)"]),
+                  'grid_rows'          : int(input_dict["Image Grid Rows"]),
+                  'grid_cols'          : int(input_dict["Image Grid Cols"]),
+                  'max_objects'        : int(input_dict["Max Number of Objects"]),
+                  'max_scaling'        : float(input_dict['Max Object Scaling']),
+                  'add_gridlines'      : False,
+                  'allow_overlap'      : False,
+                  'corner_coordinates' : corner_coordinates,
+                  'dataset_size'       : dataset_size['size'],
+                  'output_directory'   : output_directory,
+                  # One core is left to the UI, and workers are spawned rather than forked
+                  # from this process, whose Tk and gallery threads are running
+                  'num_workers'        : max(1, (os.cpu_count() or 1) - 1),
+                  'start_method'       : 'spawn'}
+
+        generation_stats = GenerationStats()
+        generation_control = generate.GenerationControl()
+        objects, labels, atlas, stats = X, Y, digit_atlas, generation_stats
+
+        def generate_in_background():
+            return generate.generate_dataset(config,
+                                             objects=objects,
+                                             labels=labels,
+                                             atlas=atlas,
+                                             progress=update_generation_progress,
+                                             placement_stats=stats,
+                                             control=generation_control)
+
+        def generated(config):
+            set_running(None)
+            progress_var.set(100)
+            progress_str.set("Generating Dataset --> Done ({:.1f} images/s)".format(stats.images_per_second))
+
+        set_running('generate')
+        run_in_background(generate_in_background, generated)
 
     else:
         generate_dataset_button.config(text="Select an output directory", state='disabled')
@@ -348,6 +474,9 @@ if __name__ == "__main__":
     folder_str = tk.StringVar(value="No folder location chosen\n" + '-' * 60 )
 
     # Create the "Generate Image Previews" button
+    previous_button = tk.Button(buttons_frame, text="Previous", font=gui_font, state='disabled', command=previous_preview)
+    previous_button.pack(side=tk.LEFT, padx=[10, 0])
+
     preview_button = tk.Button(buttons_frame, text="Generate Image Preview", font=gui_font, command=generate_previews)
     preview_button.pack(side=tk.LEFT, padx=10)  # Add padding below the button
 
@@ -366,6 +495,16 @@ if __name__ == "__main__":
     progress_bar = ttk.Progressbar(left_content_frame, orient="horizontal", length=450, mode="determinate", variable=progress_var)
     progress_bar.pack(pady=0)
 
+    # Pause and cancel buttons of a running generation
+    control_frame = tk.Frame(left_content_frame)
+    control_frame.pack(pady=5)
+
+    pause_button = tk.Button(control_frame, text="Pause", font=gui_font, width=10, state='disabled', command=toggle_pause)
+    pause_button.pack(side=tk.LEFT, padx=10)
+
+    cancel_button = tk.Button(control_frame, text="Cancel", font=gui_font, width=10, state='disabled', command=cancel_generation)
+    cancel_button.pack(side=tk.LEFT, padx=10)
+
     # Create a frame for each row, centered horizontally
     row_frame = tk.Frame(left_content_frame)
     row_frame.pack(pady=[30,5])  # Add vertical space between rows
@@ -396,5 +535,14 @@ if __name__ == "__main__":
     # Create a label to progress bar information
     objects_str = tk.StringVar(value='')
     objects_label = tk.Label(right_content_frame, textvariable=objects_str, justify='left', font=input_font, bg='light gray')
+    # Previews are rendered ahead on a background thread, invalidated by any input change
+    gallery = PreviewGallery(render_preview,
+                             on_ready=lambda: ui_queue.put(('done', (preview_ready, None))),
+                             on_error=lambda error: ui_queue.put(('preview_error', error)))
+
+    # Handle the messages of background work and cancel a running generation on exit
+    root.after(100, poll_queue)
+    root.protocol("WM_DELETE_WINDOW", close_window)
+
     # Run the application
     root.mainloop()
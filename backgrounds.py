@@ -0,0 +1,320 @@
+import math
+
+import numpy as np
+
+# Background noise of the created images. Every family fills whole arrays in bulk
+# from a np.random.Generator (raw bytes where possible) and returns uint8 values in
+# [0, noise_intensity). Statistics for an intensity I, against the per-pixel
+# np.random.randint(0, I) noise of generate_noisy_image:
+#
+#   family       mean          std               pixels
+#   randint      (I - 1) / 2   ~0.289 I (I/√12)  independent
+#   uniform      (I - 1) / 2   ~0.289 I          independent, value frequencies
+#                                                within I / 65536 of uniform
+#   gaussian     ~I / 2        ~0.167 I (I/6)    independent, N(I/2, I/6) rounded,
+#                                                0.27% clipped to [0, I - 1]
+#   salt_pepper  ~I / 2        ~√density I / 2   independent, I // 2 except 0 and
+#                                                I - 1 with probability density / 2 each
+#   perlin       ~I / 2        ~0.14 I           smooth, correlated over ~cell_size pixels
+#
+# A NoiseBank holds a precomputed block of one family and cuts every background
+# from random windows of it (see NoiseBank for the statistics of bank backgrounds).
+
+# Families whose neighbouring pixels are correlated, bank backgrounds of them are
+# single windows so no seams are cut into them
+SMOOTH_NOISE_TYPES = ('perlin',)
+# Lattice spacing in pixels of the first perlin octave and the number of octaves
+PERLIN_CELL_SIZE = 16
+PERLIN_OCTAVES = 3
+
+def _uniform16(size,
+               rng):
+    """Independent uniform uint16 values from the raw bytes of rng"""
+    return np.frombuffer(rng.bytes(2 * size), dtype=np.uint16)
+
+def uniform_noise(shape,
+                  noise_intensity,
+                  rng):
+    """
+    Definition:
+    Uniform noise from raw random bytes: 16 random bits per pixel are scaled to
+    [0, noise_intensity) with a multiply and shift.
+
+    Parameters:
+    shape ((int , int))     : height and width of the noise
+    noise_intensity (int)   : exclusive upper bound of the values, at most 256
+    rng (np.random.Generator) : random source
+
+    Returns:
+    noise (np.array) : uint8 array of shape
+    """
+    values = _uniform16(math.prod(shape), rng).astype(np.uint32)
+    return ((values * noise_intensity) >> 16).astype(np.uint8).reshape(shape)
+
+def gaussian_noise(shape,
+                   noise_intensity,
+                   rng):
+    """
+    Definition:
+    Gaussian noise N(noise_intensity / 2, noise_intensity / 6), rounded and clipped
+    to [0, noise_intensity).
+
+    Parameters:
+    shape ((int , int))     : height and width of the noise
+    noise_intensity (int)   : exclusive upper bound of the values, at most 256
+    rng (np.random.Generator) : random source
+
+    Returns:
+    noise (np.array) : uint8 array of shape
+    """
+    noise = rng.standard_normal(shape, dtype=np.float32)
+    noise *= noise_intensity / 6
+    noise += noise_intensity / 2
+    return np.clip(np.rint(noise), 0, noise_intensity - 1).astype(np.uint8)
+
+def salt_pepper_noise(shape,
+                      noise_intensity,
+                      rng,
+                      density = 0.1):
+    """
+    Definition:
+    Salt and pepper noise on a background of noise_intensity // 2: a fraction
+    density / 2 of the pixels each is 0 (pepper) and noise_intensity - 1 (salt).
+
+    Parameters:
+    shape ((int , int))     : height and width of the noise
+    noise_intensity (int)   : exclusive upper bound of the values, at most 256
+    rng (np.random.Generator) : random source
+    density (float)         : fraction of salt and pepper pixels
+
+    Returns:
+    noise (np.array) : uint8 array of shape
+    """
+    values = _uniform16(math.prod(shape), rng).reshape(shape)
+    threshold = int(density / 2 * 65536)
+
+    noise = np.full(shape, noise_intensity // 2, dtype=np.uint8)
+    noise[values < threshold] = 0
+    noise[values >= 65536 - threshold] = noise_intensity - 1
+    return noise
+
+def _value_noise_lattices(shape,
+                          cell_sizes,
+                          rng):
+    """Random lattice values of every octave of perlin noise over shape"""
+    return [rng.random((shape[0] // cell + 2, shape[1] // cell + 2), dtype=np.float32)
+            for cell in cell_sizes]
+
+def _value_noise_rows(lattices,
+                      cell_sizes,
+                      row_start,
+                      row_stop,
+                      width):
+    """Rows [row_start, row_stop) of the octave sum of the lattices, in [0, 1)"""
+    noise = np.zeros((row_stop - row_start, width), dtype=np.float32)
+    amplitudes = 0.5 ** np.arange(len(cell_sizes))
+
+    for lattice, cell, amplitude in zip(lattices, cell_sizes, amplitudes):
+        # Lattice cell and smoothstep weight of every row and column
+        y = np.arange(row_start, row_stop, dtype=np.float32) / cell
+        x = np.arange(width, dtype=np.float32) / cell
+        iy, ix = y.astype(int), x.astype(int)
+        wy, wx = y - iy, x - ix
+        wy, wx = wy * wy * (3 - 2 * wy), wx * wx * (3 - 2 * wx)
+
+        # Interpolate between lattice columns on the lattice rows in use, then between rows
+        lattice = lattice[iy[0]:iy[-1] + 2]
+        cols = lattice[:, ix] * (1 - wx) + lattice[:, ix + 1] * wx
+        iy -= iy[0]
+        noise += amplitude * (cols[iy] * (1 - wy)[:, None] + cols[iy + 1] * wy[:, None])
+
+    return noise / amplitudes.sum()
+
+def _cell_sizes(cell_size,
+                octaves):
+    """Lattice cell size of every octave, halved per octave down to 2 pixels"""
+    return [max(cell_size >> octave, 2) for octave in range(octaves)]
+
+def perlin_noise(shape,
+                 noise_intensity,
+                 rng,
+                 cell_size = PERLIN_CELL_SIZE,
+                 octaves = PERLIN_OCTAVES):
+    """
+    Definition:
+    Smooth Perlin style value noise: random lattice values every cell_size pixels
+    are interpolated with a smoothstep, and octaves of halving cell size and
+    amplitude are summed.
+
+    Parameters:
+    shape ((int , int))     : height and width of the noise
+    noise_intensity (int)   : exclusive upper bound of the values, at most 256
+    rng (np.random.Generator) : random source
+    cell_size (int)         : lattice spacing of the first octave in pixels
+    octaves (int)           : number of summed octaves
+
+    Returns:
+    noise (np.array) : uint8 array of shape
+    """
+    cell_sizes = _cell_sizes(cell_size, octaves)
+    lattices = _value_noise_lattices(shape, cell_sizes, rng)
+    noise = _value_noise_rows(lattices, cell_sizes, 0, shape[0], shape[1])
+
+    return (noise * noise_intensity).astype(np.uint8)
+
+NOISE_FAMILIES = {
+    'uniform'     : uniform_noise,
+    'gaussian'    : gaussian_noise,
+    'salt_pepper' : salt_pepper_noise,
+    'perlin'      : perlin_noise,
+}
+
+NOISE_TYPES = tuple(NOISE_FAMILIES)
+
+def generate_noise(shape,
+                   noise_intensity = 180,
+                   noise_type = 'uniform',
+                   rng = None):
+    """
+    Definition:
+    Creates noise of one family in bulk.
+
+    Parameters:
+    shape ((int , int))     : height and width of the noise
+    noise_intensity (int)   : exclusive upper bound of the values, at most 256
+    noise_type (str)        : family of the noise, one of NOISE_TYPES
+    rng (np.random.Generator) : random source, seeded from the global np.random state when None
+
+    Returns:
+    noise (np.array) : uint8 array of shape
+    """
+    if noise_type not in NOISE_FAMILIES:
+        raise ValueError(f"Unknown noise type '{noise_type}'")
+    if rng is None:
+        rng = np.random.default_rng(np.random.randint(0, 2**31))
+
+    return NOISE_FAMILIES[noise_type](tuple(shape), noise_intensity, rng)
+
+class NoiseBank:
+    """
+    Definition:
+    Background engine cutting backgrounds from a precomputed bank of noise. The bank
+    is a block of noise of one family, memory_mb in size and twice the image width.
+    Every background is built from horizontal strips of strip_height rows, each a
+    random window of the bank (any row, any of width + 1 column offsets) flipped
+    at random vertically and horizontally; backgrounds of smooth families are one
+    window. Window positions are drawn from the rng of draw (the global np.random
+    state by default), so seeding it per image keeps backgrounds reproducible for a
+    given bank seed.
+
+    Every pixel of a bank background has the distribution of its family and pixels
+    within a strip keep the independence of the family. Strips are cut from the same
+    bank, so two strips share (shifted, flipped) pixels with probability about
+    2 * strip_height / bank rows; a larger memory_mb makes repeats rarer. Without a
+    bank (memory_mb of 0) every background is generated fresh.
+
+    Parameters:
+    image_size ((int , int)) : height and width of the backgrounds
+    noise_intensity (int)    : exclusive upper bound of the values, at most 256
+    noise_type (str)         : family of the noise, one of NOISE_TYPES
+    memory_mb (float)        : size of the bank in MiB, never less than one strip
+    strip_height (int)       : rows per window, 64 (whole image for smooth families) when None
+    seed (int)               : seed of the bank
+    bank (np.array)          : bank built before, e.g. attached from shared memory, instead of
+                               generating one
+    """
+    # Pixels generated at once while filling the bank, bounds the temporary arrays
+    CHUNK_PIXELS = 1 << 22
+
+    def __init__(self,
+                 image_size,
+                 noise_intensity = 180,
+                 noise_type = 'uniform',
+                 memory_mb = 64,
+                 strip_height = None,
+                 seed = None,
+                 bank = None):
+        if noise_type not in NOISE_FAMILIES:
+            raise ValueError(f"Unknown noise type '{noise_type}'")
+        if not 0 < noise_intensity <= 256:
+            raise ValueError("noise_intensity must be in [1, 256]")
+
+        self.image_size = tuple(image_size[:2])
+        self.noise_intensity = noise_intensity
+        self.noise_type = noise_type
+        height, width = self.image_size
+        if strip_height is None:
+            strip_height = height if noise_type in SMOOTH_NOISE_TYPES else 64
+        self.strip_height = min(strip_height, height)
+
+        self.bank = bank
+        if bank is None and memory_mb > 0:
+            bank_width = 2 * width
+            bank_rows = max(int(memory_mb * 2**20) // bank_width, self.strip_height)
+            self.bank = self._fill((bank_rows, bank_width), np.random.default_rng(seed))
+
+    def _fill(self,
+              shape,
+              rng):
+        """Generates the bank in chunks of rows"""
+        bank = np.empty(shape, dtype=np.uint8)
+        chunk_rows = max(self.CHUNK_PIXELS // shape[1], 1)
+
+        if self.noise_type == 'perlin':
+            # One lattice over the whole bank so windows across chunks stay smooth
+            cell_sizes = _cell_sizes(PERLIN_CELL_SIZE, PERLIN_OCTAVES)
+            lattices = _value_noise_lattices(shape, cell_sizes, rng)
+            for start in range(0, shape[0], chunk_rows):
+                stop = min(start + chunk_rows, shape[0])
+                noise = _value_noise_rows(lattices, cell_sizes, start, stop, shape[1])
+                bank[start:stop] = noise * self.noise_intensity
+        else:
+            for start in range(0, shape[0], chunk_rows):
+                stop = min(start + chunk_rows, shape[0])
+                bank[start:stop] = NOISE_FAMILIES[self.noise_type]((stop - start, shape[1]),
+                                                                   self.noise_intensity,
+                                                                   rng)
+        return bank
+
+    @property
+    def nbytes(self):
+        """Bytes held by the bank"""
+        return 0 if self.bank is None else self.bank.nbytes
+
+    def draw(self,
+             image_size = None,
+             rng = None):
+        """
+        Definition:
+        Creates one background.
+
+        Parameters:
+        image_size ((int , int))    : height and width of the background, the bank image size when None
+        rng (np.random.RandomState) : random source of the windows (of the noise without a bank),
+                                      the global np.random when None
+
+        Returns:
+        background (np.array) : new writable uint8 array of image_size
+        """
+        rng = np.random if rng is None else rng
+        height, width = self.image_size if image_size is None else tuple(image_size[:2])
+        if self.bank is None:
+            return generate_noise((height, width), self.noise_intensity, self.noise_type,
+                                  rng=np.random.default_rng(rng.randint(0, 2**31)))
+        if width > self.image_size[1] or min(height, self.strip_height) > self.bank.shape[0]:
+            raise ValueError(f"Background of {(height, width)} does not fit a bank for {self.image_size}")
+
+        strip_height = min(self.strip_height, height)
+        num_strips = -(-height // strip_height)
+        rows = rng.randint(0, self.bank.shape[0] - strip_height + 1, num_strips)
+        cols = rng.randint(0, self.bank.shape[1] - width + 1, num_strips)
+        flips = rng.randint(0, 4, num_strips)
+
+        background = np.empty((height, width), dtype=np.uint8)
+        for strip, (row, col, flip) in enumerate(zip(rows.tolist(), cols.tolist(), flips.tolist())):
+            start = strip * strip_height
+            stop = min(start + strip_height, height)
+            window = self.bank[row:row + stop - start, col:col + width]
+            background[start:stop] = window[::-1 if flip & 1 else 1, ::-1 if flip & 2 else 1]
+
+        return background
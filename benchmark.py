@@ -0,0 +1,458 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import itertools
+import tempfile
+
+import numpy as np
+
+from utils import *
+from writers import encode_image
+from backgrounds import NoiseBank, NOISE_TYPES, generate_noise
+from blend import BLEND_MODES
+import generate
+
+# Parameter matrices of the end-to-end benchmarks, the quick matrices are a subset
+CREATE_IMAGE_MATRIX = {'image_size'  : [(128, 128), (256, 256), (512, 512)],
+                       'grid'        : [4, 8],
+                       'max_objects' : [5, 10, 20],
+                       'max_scaling' : [2.0, 4.0]}
+QUICK_CREATE_IMAGE_MATRIX = {'image_size'  : [(128, 128), (256, 256)],
+                             'grid'        : [4, 8],
+                             'max_objects' : [10],
+                             'max_scaling' : [4.0]}
+GENERATE_MATRIX = {'image_size'  : [(256, 256), (512, 512)],
+                   'grid'        : [8],
+                   'max_objects' : [10],
+                   'max_scaling' : [4.0]}
+QUICK_GENERATE_MATRIX = {'image_size'  : [(256, 256)],
+                         'grid'        : [8],
+                         'max_objects' : [10],
+                         'max_scaling' : [4.0]}
+# Relative slowdown over the baseline reported as a regression
+DEFAULT_TOLERANCE = 0.20
+# Wider tolerances of benchmarks of a few microseconds, whose best times move between
+# runs with caches, memory layout and the timer by far more than DEFAULT_TOLERANCE
+TOLERANCES = {'stage/crop_label'        : 0.50,
+              'stage/crop_atlas'        : 0.50,
+              'stage/resize_cached'     : 0.50,
+              'stage/composite'         : 0.50,
+              'stage/composite_max'     : 0.50,
+              'stage/composite_alpha'   : 0.50,
+              'stage/composite_add'     : 0.50,
+              'stage/overlap_check'     : 0.50,
+              'stage/overlap_occupancy' : 0.50,
+              'stage/noise_bank'        : 0.50}
+# Benchmarks reported but not gated, they time the disk and page cache more than the code
+UNGATED = ('stage/mnist_load', 'stage/mnist_load_mmap', 'stage/label_write')
+# Name prefix of the benchmarks of every suite
+SUITE_PREFIXES = {'stages'           : 'stage/',
+                  'create_image'     : 'create_image/',
+                  'generate_dataset' : 'generate_dataset/'}
+# Times the suites of flagged benchmarks are run again before a regression is reported
+DEFAULT_RETRIES = 2
+
+def time_call(function,
+              repeat = 5,
+              number = None,
+              min_time = 0.2,
+              warmup = True):
+    """
+    Definition:
+    Times a function like timeit: every repeat calls it number times and the time
+    per call is kept. number is picked so one repeat takes about min_time when None.
+
+    Parameters:
+    function (callable) : function without arguments to time
+    repeat (int)        : number of timed repeats
+    number (int)        : calls per repeat
+    min_time (float)    : target seconds of one repeat when number is None
+    warmup (bool)       : make an untimed first call (imports, JIT compilation, cold caches)
+
+    Returns:
+    result (dict) : 'seconds' (median per call), 'min', 'max', 'calls' and 'per_second'
+    """
+    if warmup:
+        function()
+    if number is None:
+        number, elapsed = 1, 0.0
+        while True:
+            start = time.perf_counter()
+            for _ in range(number):
+                function()
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time / 4 or number >= 1 << 20:
+                break
+            number *= 4
+        number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        times.append((time.perf_counter() - start) / number)
+
+    seconds = float(np.median(times))
+    return {'seconds'    : seconds,
+            'min'        : float(min(times)),
+            'max'        : float(max(times)),
+            'calls'      : number * repeat,
+            'per_second' : 1 / seconds if seconds > 0 else float('inf')}
+
+def _matrix(matrix):
+    """
+    Definition:
+    Iterates over every combination of a parameter matrix
+
+    Returns:
+    combinations (iterator) : (name, create_image kwargs) tuples
+    """
+    for image_size, grid, max_objects, max_scaling in itertools.product(*matrix.values()):
+        name = f"{image_size[0]}x{image_size[1]}/grid{grid}/objects{max_objects}/scaling{max_scaling:g}"
+        yield name, {'image_size'  : image_size,
+                     'grid_rows'   : grid,
+                     'grid_cols'   : grid,
+                     'max_objects' : max_objects,
+                     'max_scaling' : max_scaling}
+
+def benchmark_stages(objects,
+                     labels,
+                     mnist_path = None,
+                     time_load = False,
+                     image_size = (256, 256),
+                     repeat = 5):
+    """
+    Definition:
+    Times every stage of creating and writing an image in isolation
+
+    Parameters:
+    objects (np.array)        : all images of MNIST dataset
+    labels (np.array)         : all classes of MNIST dataset
+    mnist_path (str)          : MNIST location of the load stage, searched for when None
+    time_load (bool)          : time loading MNIST, read from disk or a cache
+    image_size ((int , int))  : image size of the image stages
+    repeat (int)              : number of timed repeats
+
+    Returns:
+    results (dict) : stage name -> time_call result
+    """
+    results = {}
+    if time_load:
+        results['mnist_load'] = time_call(lambda: load_mnist(mnist_path), repeat=repeat, number=1)
+        results['mnist_load_mmap'] = time_call(lambda: load_mnist(mnist_path, mmap=True), repeat=repeat, number=1)
+
+    results['bbox_table'] = time_call(lambda: build_bbox_table(objects, labels), repeat=repeat)
+    table = build_bbox_table(objects, labels)
+    corner_labels = bbox_table_to_labels(table, corner_coordinates=True)
+    results['digit_atlas'] = time_call(lambda: build_digit_atlas(objects, table), repeat=repeat)
+    atlas = build_digit_atlas(objects, table)
+
+    results['noise'] = time_call(lambda: generate_noisy_image(image_size, 180), repeat=repeat)
+    for noise_type in NOISE_TYPES:
+        results[f'noise_{noise_type}'] = time_call(lambda: generate_noise(image_size, 180, noise_type), repeat=repeat)
+    noise_bank = NoiseBank(image_size, 180, memory_mb=16, seed=0)
+    results['noise_bank'] = time_call(noise_bank.draw, repeat=repeat)
+
+    index = int(np.argmax(table['corner'][:, 2] - table['corner'][:, 0]))
+    results['crop_label'] = time_call(lambda: grab_x_bbox_region(objects[index], corner_labels[index]), repeat=repeat)
+    results['crop_atlas'] = time_call(lambda: atlas_crop(atlas, index), repeat=repeat)
+
+    crop = atlas_crop(atlas, index)
+    results['resize'] = time_call(lambda: resize_object(crop, 2.5), repeat=repeat)
+    resize_cache = ResizeCache()
+    results['resize_cached'] = time_call(lambda: resize_cache.resize(index, crop, 2.5), repeat=repeat)
+
+    image = generate_noisy_image(image_size, 180)
+    scaled = resize_object(crop, 2.5)
+    region = (slice(10, 10 + scaled.shape[0]), slice(10, 10 + scaled.shape[1]))
+    results['composite'] = time_call(lambda: composite_object(image, scaled, region), repeat=repeat)
+    scaled = scaled.astype(np.uint8)
+    for blend_mode in BLEND_MODES:
+        results[f'composite_{blend_mode}'] = time_call(lambda: composite_object(image, scaled, region, blend_mode=blend_mode),
+                                                       repeat=repeat)
+
+    bbox1, bbox2 = [10, 10, 40, 40], [30, 30, 60, 60]
+    results['overlap_check'] = time_call(lambda: check_overlap(bbox1, bbox2), repeat=repeat)
+    occupancy = OccupancyGrid(image_size)
+    occupancy.occupy(region)
+    results['overlap_occupancy'] = time_call(lambda: occupancy.overlaps(region), repeat=repeat)
+
+    np.random.seed(0)
+    image, added_objects = create_image(objects, corner_labels, image_size=image_size, max_objects=10,
+                                        atlas=atlas, resize_cache=resize_cache)
+    results['jpeg_encode'] = time_call(lambda: encode_image(image), repeat=repeat)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'label.txt')
+        def write_label():
+            with open(path, 'w') as f:
+                f.write(added_objects_yolo(added_objects))
+        results['label_write'] = time_call(write_label, repeat=repeat)
+
+    return results
+
+def benchmark_create_image(objects,
+                           labels,
+                           matrix = CREATE_IMAGE_MATRIX,
+                           num_images = 50,
+                           repeat = 3):
+    """
+    Definition:
+    Times end-to-end create_image (with the digit atlas and a resize cache, as in
+    generate_dataset) over a parameter matrix
+
+    Parameters:
+    objects (np.array) : all images of MNIST dataset
+    labels (np.array)  : all classes of MNIST dataset
+    matrix (dict)      : lists of 'image_size', 'grid', 'max_objects' and 'max_scaling'
+    num_images (int)   : images created per repeat
+    repeat (int)       : number of timed repeats
+
+    Returns:
+    results (dict) : 'create_image/<parameters>' -> time_call result, per image
+    """
+    table = build_bbox_table(objects, labels)
+    corner_labels = bbox_table_to_labels(table, corner_coordinates=True)
+    atlas = build_digit_atlas(objects, table)
+    resize_cache = ResizeCache()
+
+    results = {}
+    for name, kwargs in _matrix(matrix):
+        seeds = itertools.count()
+        def create():
+            np.random.seed(next(seeds) % num_images)
+            create_image(objects, corner_labels, atlas=atlas, resize_cache=resize_cache, **kwargs)
+
+        # Warm the resize cache so every repeat sees the same hits
+        for _ in range(num_images):
+            create()
+        results[f"create_image/{name}"] = time_call(create, repeat=repeat, number=num_images)
+
+    return results
+
+def benchmark_generate_dataset(objects,
+                               labels,
+                               matrix = GENERATE_MATRIX,
+                               dataset_size = 500,
+                               num_workers = None,
+                               output_format = 'yolo',
+                               repeat = 1):
+    """
+    Definition:
+    Times generate_dataset into a temporary directory over a parameter matrix
+
+    Parameters:
+    objects (np.array)  : all images of MNIST dataset
+    labels (np.array)   : all classes of MNIST dataset
+    matrix (dict)       : lists of 'image_size', 'grid', 'max_objects' and 'max_scaling'
+    dataset_size (int)  : images per run
+    num_workers (int)   : worker processes, all cores when None
+    output_format (str) : dataset layout written
+    repeat (int)        : number of timed runs
+
+    Returns:
+    results (dict) : 'generate_dataset/<parameters>' -> time_call result, per image
+    """
+    table = build_bbox_table(objects, labels)
+    corner_labels = bbox_table_to_labels(table, corner_coordinates=True)
+    atlas = build_digit_atlas(objects, table)
+
+    results = {}
+    for name, kwargs in _matrix(matrix):
+        with tempfile.TemporaryDirectory() as directory:
+            config = {**kwargs,
+                      'dataset_size'     : dataset_size,
+                      'output_directory' : directory,
+                      'output_format'    : output_format,
+                      'num_workers'      : num_workers,
+                      'seed'             : 0}
+            run = lambda: generate.generate_dataset(config, objects=objects, labels=corner_labels, atlas=atlas)
+            result = time_call(run, repeat=repeat, number=1, warmup=False)
+
+        # Report per image, like the create_image benchmarks
+        for key in ('seconds', 'min', 'max'):
+            result[key] /= dataset_size
+        result['per_second'] *= dataset_size
+        results[f"generate_dataset/{name}"] = result
+
+    return results
+
+def run_benchmarks(objects = None,
+                   labels = None,
+                   mnist_path = None,
+                   quick = False,
+                   suites = ('stages', 'create_image', 'generate_dataset'),
+                   num_workers = None):
+    """
+    Definition:
+    Runs the benchmark suites and collects their results with the environment they
+    were measured in
+
+    Parameters:
+    objects (np.array) : all images of MNIST dataset, loaded from mnist_path when None
+    labels (np.array)  : all classes of MNIST dataset
+    mnist_path (str)   : MNIST location, searched for as in load_mnist when None
+    quick (bool)       : smaller matrices and fewer repeats
+    suites (tuple)     : suites to run
+    num_workers (int)  : worker processes of the generate_dataset suite
+
+    Returns:
+    report (dict) : 'environment' and 'results' (benchmark name -> time_call result)
+    """
+    time_load = objects is None
+    if objects is None:
+        objects, labels = load_mnist(mnist_path)
+
+    repeat = 7 if quick else 11
+    results = {}
+    if 'stages' in suites:
+        results.update({f"stage/{name}" : result for name, result in
+                        benchmark_stages(objects, labels, mnist_path, time_load, repeat=repeat).items()})
+    if 'create_image' in suites:
+        results.update(benchmark_create_image(objects, labels,
+                                              matrix = QUICK_CREATE_IMAGE_MATRIX if quick else CREATE_IMAGE_MATRIX,
+                                              num_images = 20 if quick else 50,
+                                              repeat = repeat))
+    if 'generate_dataset' in suites:
+        results.update(benchmark_generate_dataset(objects, labels,
+                                                  matrix = QUICK_GENERATE_MATRIX if quick else GENERATE_MATRIX,
+                                                  dataset_size = 200 if quick else 1000,
+                                                  num_workers = num_workers))
+
+    return {'environment' : {'python'    : platform.python_version(),
+                             'numpy'     : np.__version__,
+                             'platform'  : platform.platform(),
+                             'processor' : platform.processor(),
+                             'cpu_count' : os.cpu_count(),
+                             'time'      : time.strftime('%Y-%m-%dT%H:%M:%S'),
+                             'quick'     : quick},
+            'results'     : results}
+
+def compare(report,
+            baseline,
+            tolerance = DEFAULT_TOLERANCE,
+            tolerances = TOLERANCES,
+            ungated = UNGATED):
+    """
+    Definition:
+    Compares benchmark results against a baseline report, benchmark by benchmark.
+    Best times are compared, the least noisy estimate of the cost of the code.
+
+    Parameters:
+    report (dict)     : report of run_benchmarks
+    baseline (dict)   : saved report to compare against
+    tolerance (float) : relative slowdown tolerated before flagging a regression
+    tolerances (dict) : benchmark name -> wider tolerance of that benchmark
+    ungated (tuple)   : benchmarks compared but never flagged
+
+    Returns:
+    comparison (list) : one dict per common benchmark with 'name', 'seconds',
+                        'baseline', 'ratio', 'tolerance' and 'regression', slowest
+                        ratio first
+    """
+    comparison = []
+    for name, result in report['results'].items():
+        if name not in baseline['results']:
+            continue
+        # Baselines of older reports only have the median
+        base = baseline['results'][name].get('min', baseline['results'][name]['seconds'])
+        seconds = result.get('min', result['seconds'])
+        ratio = seconds / base if base > 0 else float('inf')
+        limit = max(tolerance, tolerances.get(name, tolerance))
+        comparison.append({'name'       : name,
+                           'seconds'    : seconds,
+                           'baseline'   : base,
+                           'ratio'      : ratio,
+                           'tolerance'  : limit,
+                           'regression' : name not in ungated and ratio > 1 + limit})
+
+    return sorted(comparison, key=lambda entry: -entry['ratio'])
+
+def merge_best(report,
+               rerun):
+    """
+    Definition:
+    Keeps the result with the better best time of every benchmark of two runs
+
+    Parameters:
+    report (dict) : report of run_benchmarks, updated in place
+    rerun (dict)  : report of a later run of some of its suites
+
+    Returns:
+    report (dict) : the updated report
+    """
+    for name, result in rerun['results'].items():
+        if name not in report['results'] or result['min'] < report['results'][name]['min']:
+            report['results'][name] = result
+
+    return report
+
+def format_report(report,
+                  comparison = None):
+    """
+    Definition:
+    Formats benchmark results, and their comparison to a baseline, as a text table
+
+    Returns:
+    table (str) : one line per benchmark
+    """
+    ratios = {entry['name'] : entry for entry in comparison or []}
+    lines = []
+    for name, result in report['results'].items():
+        line = f"{name:<56} {result['seconds'] * 1e3:12.4f} ms {result['per_second']:14.1f} /s"
+        if name in ratios:
+            entry = ratios[name]
+            line += f" {entry['ratio']:7.2f}x" + ("  REGRESSION" if entry['regression'] else "")
+        lines.append(line)
+
+    return '\n'.join(lines)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Benchmark the MNIST object detection dataset generator")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    parser.add_argument('--baseline', help="JSON results to compare against, exits with 1 on a regression")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help="relative slowdown flagged as regression")
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES, help="times the suites of flagged benchmarks are run again")
+    parser.add_argument('--quick', action='store_true', help="smaller matrices and fewer repeats")
+    parser.add_argument('--suites', nargs='+', choices=['stages', 'create_image', 'generate_dataset'],
+                        default=['stages', 'create_image', 'generate_dataset'])
+    parser.add_argument('--workers', dest='num_workers', type=int, help="worker processes of generate_dataset, all cores when omitted")
+    parser.add_argument('--mnist-path', help="mnist.npz or directory with MNIST")
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(mnist_path=args.mnist_path, quick=args.quick, suites=args.suites, num_workers=args.num_workers)
+
+    comparison = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        comparison = compare(report, baseline, tolerance=args.tolerance)
+        for _ in range(args.retries):
+            # A slowdown only counts when it survives timing its suite again: the noise of
+            # a shared machine passes, a regression of the code stays
+            flagged = [entry['name'] for entry in comparison if entry['regression']]
+            suites = [suite for suite, prefix in SUITE_PREFIXES.items()
+                      if any(name.startswith(prefix) for name in flagged)]
+            if not suites:
+                break
+            rerun = run_benchmarks(mnist_path=args.mnist_path, quick=args.quick, suites=suites,
+                                   num_workers=args.num_workers)
+            comparison = compare(merge_best(report, rerun), baseline, tolerance=args.tolerance)
+        report['comparison'] = comparison
+
+    print(format_report(report, comparison))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if comparison and any(entry['regression'] for entry in comparison):
+        print(f"{sum(entry['regression'] for entry in comparison)} regression(s) over {args.tolerance:.0%}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+import functools
+
+import numpy as np
+
+# Compositing of uint8 digit crops onto the uint8 canvas. Every mode works on
+# integers only and writes into the destination (a view of the canvas region):
+#   max   : max(dst, src), the original composite
+#   alpha : the digit as white with coverage src / 255 laid over the canvas,
+#           src + round(dst * (255 - src) / 255)
+#   add   : min(dst + src, 255), additive with saturation
+# Where Numba is installed the kernels are compiled loops; the NumPy kernels give
+# identical results.
+
+BLEND_MODES = ('max', 'alpha', 'add')
+# Modes using the Numba kernels by default. max is a single in-place ufunc in NumPy,
+# so it does not pay for importing Numba in every worker.
+NUMBA_MODES = ('alpha', 'add')
+
+def _div255(values):
+    """round(values / 255) for integer values in [0, 255 * 255], without a division"""
+    values = values + 128
+    return (values + (values >> 8)) >> 8
+
+def _max_numpy(dst, src):
+    np.maximum(dst, src, out=dst)
+
+def _alpha_numpy(dst, src):
+    covered = _div255(dst.astype(np.uint16) * (255 - src))
+    np.add(src, covered, out=dst, casting='unsafe')
+
+def _add_numpy(dst, src):
+    # dst + min(src, 255 - dst) never exceeds 255
+    np.add(dst, np.minimum(src, 255 - dst), out=dst)
+
+NUMPY_KERNELS = {'max'   : _max_numpy,
+                 'alpha' : _alpha_numpy,
+                 'add'   : _add_numpy}
+
+@functools.lru_cache(maxsize=None)
+def numba_kernels():
+    """
+    Definition:
+    Compiles the Numba kernels on first use (cached on disk by Numba).
+
+    Returns:
+    kernels (dict) : mode -> kernel(dst, src), None when Numba is not installed
+    """
+    try:
+        import numba
+    except ImportError:
+        return None
+
+    @numba.njit(cache=True, nogil=True)
+    def max_kernel(dst, src):
+        for i in range(dst.shape[0]):
+            for j in range(dst.shape[1]):
+                if src[i, j] > dst[i, j]:
+                    dst[i, j] = src[i, j]
+
+    @numba.njit(cache=True, nogil=True)
+    def alpha_kernel(dst, src):
+        for i in range(dst.shape[0]):
+            for j in range(dst.shape[1]):
+                value = np.int32(dst[i, j]) * (255 - np.int32(src[i, j])) + 128
+                dst[i, j] = np.int32(src[i, j]) + ((value + (value >> 8)) >> 8)
+
+    @numba.njit(cache=True, nogil=True)
+    def add_kernel(dst, src):
+        for i in range(dst.shape[0]):
+            for j in range(dst.shape[1]):
+                value = np.int32(dst[i, j]) + np.int32(src[i, j])
+                dst[i, j] = value if value < 255 else 255
+
+    return {'max'   : max_kernel,
+            'alpha' : alpha_kernel,
+            'add'   : add_kernel}
+
+def blend(dst,
+          src,
+          mode = 'max',
+          use_numba = None):
+    """
+    Definition:
+    Composites src onto dst in place.
+
+    Parameters:
+    dst (np.array)   : 2D uint8 destination, usually a view of the canvas region
+    src (np.array)   : 2D uint8 object of the same shape
+    mode (str)       : blend mode, one of BLEND_MODES
+    use_numba (bool) : use the Numba kernels, for NUMBA_MODES when Numba is installed when None
+
+    Returns:
+    dst (np.array) : the destination
+    """
+    if mode not in NUMPY_KERNELS:
+        raise ValueError(f"Unknown blend mode '{mode}'")
+
+    if use_numba or (use_numba is None and mode in NUMBA_MODES):
+        kernels = numba_kernels()
+    else:
+        kernels = None
+    if kernels is None:
+        if use_numba:
+            raise ImportError("use_numba requires numba")
+        kernels = NUMPY_KERNELS
+
+    kernels[mode](dst, src)
+    return dst
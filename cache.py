@@ -0,0 +1,252 @@
+import os
+import io
+import json
+import hashlib
+
+import numpy as np
+
+# Bumped whenever a change to the generator alters the images of a config, so
+# entries of older code are never reused
+CACHE_VERSION = 1
+# Memory budget of the images of one cache chunk, bounds the chunk size for large images
+CHUNK_BYTES = 16 * 2**20
+# Upper bound of the images per cache chunk, chunks are the unit of work of cached runs
+# so they stay small enough to spread a dataset over the workers
+MAX_CHUNK_SIZE = 256
+
+def cache_key(content,
+              objects,
+              labels):
+    """
+    Definition:
+    Content address of a dataset: a hash of the config values its images depend on,
+    MNIST and its labels. Every image is determined by (config, seed, image id), so
+    two jobs with the same key create identical images.
+
+    Parameters:
+    content (dict)     : config values that determine the images and annotations
+    objects (np.array) : all images of MNIST dataset
+    labels (np.array)  : all associated classes and bbox labels of MNIST dataset
+
+    Returns:
+    key (str) : hex digest
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps({**content, 'version' : CACHE_VERSION}, sort_keys=True).encode())
+    digest.update(np.ascontiguousarray(objects).data)
+    digest.update(np.ascontiguousarray(labels).data)
+    return digest.hexdigest()
+
+def chunk_size(image_size):
+    """
+    Definition:
+    Number of images per cache chunk for an image size
+
+    Parameters:
+    image_size ((int , int)) : height and width of the images
+
+    Returns:
+    size (int) : images per chunk
+    """
+    return int(max(1, min(MAX_CHUNK_SIZE, CHUNK_BYTES // (image_size[0] * image_size[1]))))
+
+class GenerationCache:
+    """
+    Definition:
+    Content-addressed cache of created images. Entries live in cache_dir/<key>/, key
+    being cache_key of the config, and hold the images and annotations of chunks of
+    chunk_size consecutive image ids as chunk-%08d.npz (the first id of the chunk).
+    A chunk holds a prefix of its ids: a job over fewer images caches what it made
+    and a later, larger job reuses it and extends the chunk. Chunks are written to a
+    temporary file and renamed, so readers never see a partial chunk and several
+    jobs (or machines sharing the directory) can fill one cache. Reading a chunk
+    refreshes its modification time, the recency evict goes by.
+
+    Parameters:
+    cache_dir (str) : root directory of the cache
+    key (str)       : cache_key of the dataset
+    content (dict)  : config values the key was computed from, saved as config.json
+    """
+    def __init__(self, cache_dir, key, content):
+        self.cache_dir = cache_dir
+        self.directory = os.path.join(cache_dir, key)
+        self.chunk_size = chunk_size(content['image_size'])
+        self.hits = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        config_path = os.path.join(self.directory, 'config.json')
+        if not os.path.exists(config_path):
+            _write_atomic(config_path, json.dumps(content, indent=2).encode())
+
+    def _path(self, chunk_start):
+        return os.path.join(self.directory, f"chunk-{chunk_start:08d}.npz")
+
+    def load(self, chunk_start):
+        """
+        Definition:
+        Reads the cached prefix of a chunk.
+
+        Parameters:
+        chunk_start (int) : first image id of the chunk
+
+        Returns:
+        images (list)        : images of the first cached ids of the chunk, empty on a miss
+        added_objects (list) : added objects dict of every cached image
+        """
+        path = self._path(chunk_start)
+        try:
+            with np.load(path) as chunk:
+                images = chunk['images']
+                objects = json.loads(chunk['objects'].tobytes())
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            # Missing, evicted meanwhile or unreadable: the chunk is created again
+            return [], []
+
+        added_objects = [{int(object_num) : added_object for object_num, added_object in image_objects.items()}
+                         for image_objects in objects]
+        return list(images), added_objects
+
+    def save(self, chunk_start, images, added_objects):
+        """
+        Definition:
+        Stores the images of the first len(images) ids of a chunk, replacing a shorter entry.
+
+        Parameters:
+        chunk_start (int)    : first image id of the chunk
+        images (list)        : images of the ids from chunk_start on
+        added_objects (list) : added objects dict of every image
+        """
+        buffer = io.BytesIO()
+        objects = json.dumps([{str(object_num) : added_object for object_num, added_object in image_objects.items()}
+                              for image_objects in added_objects]).encode()
+        np.savez(buffer, images=np.stack(images), objects=np.frombuffer(objects, dtype=np.uint8))
+        try:
+            _write_atomic(self._path(chunk_start), buffer.getvalue())
+        except OSError:
+            # A full or read-only cache only costs a recompute next time
+            pass
+
+    def images(self,
+               start,
+               stop,
+               create):
+        """
+        Definition:
+        Iterates over the images of the ids in [start, stop), read from the cache where
+        cached and created otherwise. Created images that continue the cached prefix
+        of their chunk are added to the cache.
+
+        Parameters:
+        start (int)       : first image id
+        stop (int)        : end of the image ids
+        create (callable) : create(image_id) returns (image, added_objects)
+
+        Returns:
+        iterator of (image_id, image, added_objects)
+        """
+        for chunk_start in range(start - start % self.chunk_size, stop, self.chunk_size):
+            first, last = max(start, chunk_start), min(stop, chunk_start + self.chunk_size)
+            images, added_objects = self.load(chunk_start)
+            cached = len(images)
+            contiguous = first <= chunk_start + cached
+
+            for image_id in range(first, last):
+                offset = image_id - chunk_start
+                if offset < cached:
+                    self.hits += 1
+                    yield image_id, images[offset], added_objects[offset]
+                    continue
+
+                image, image_objects = create(image_id)
+                if contiguous:
+                    images.append(image)
+                    added_objects.append(image_objects)
+                yield image_id, image, image_objects
+
+            if contiguous and len(images) > cached:
+                self.save(chunk_start, images, added_objects)
+
+def _write_atomic(path, data):
+    """Writes data to a temporary file next to path and renames it into place"""
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def cache_size(cache_dir):
+    """
+    Definition:
+    Total size of the chunks of a cache directory
+
+    Parameters:
+    cache_dir (str) : root directory of the cache
+
+    Returns:
+    nbytes (int) : bytes of all chunk files
+    """
+    return sum(size for _, _, size in _chunk_files(cache_dir))
+
+def _chunk_files(cache_dir):
+    """(path, modification time, size) of every chunk of every key of a cache directory"""
+    files = []
+    for root, _, names in os.walk(cache_dir):
+        for name in names:
+            if name.startswith('chunk-') and name.endswith('.npz'):
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    # Evicted by another job meanwhile
+                    continue
+                files.append((path, stat.st_mtime, stat.st_size))
+    return files
+
+def evict(cache_dir,
+          max_bytes):
+    """
+    Definition:
+    Deletes the least recently used chunks, across every key, until the cache
+    directory holds at most max_bytes. Key directories this eviction emptied are
+    removed unless another job is writing to them. Temporary files of other jobs
+    are never touched.
+
+    Parameters:
+    cache_dir (str) : root directory of the cache
+    max_bytes (int) : size budget of the cache
+
+    Returns:
+    evicted (int) : number of chunks deleted
+    """
+    files = sorted(_chunk_files(cache_dir), key=lambda item: item[1])
+    total = sum(size for _, _, size in files)
+
+    evicted = 0
+    emptied = set()
+    for path, _, size in files:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        evicted += 1
+        emptied.add(os.path.dirname(path))
+
+    for directory in emptied:
+        try:
+            # Only config.json left: no chunks and no chunk of another job in progress
+            if os.listdir(directory) != ['config.json']:
+                continue
+            os.remove(os.path.join(directory, 'config.json'))
+            os.rmdir(directory)
+        except OSError:
+            # Removed by another evictor, or a job started writing to the key meanwhile
+            continue
+
+    return evicted
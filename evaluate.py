@@ -0,0 +1,509 @@
+import os
+import json
+import argparse
+
+import numpy as np
+
+import geometry
+from manifest import Manifest
+
+# Number of digit classes
+NUM_CLASSES = 10
+# IoU thresholds of mAP@[.5:.95]
+IOU_THRESHOLDS = np.round(np.arange(0.5, 0.951, 0.05), 2)
+# Recall points of the interpolated precision-recall curve (COCO style)
+RECALL_POINTS = np.linspace(0, 1, 101)
+# Edges of the digit scale factor bins recall is reported for
+SCALE_BINS = (1.0, 1.5, 2.0, 3.0, np.inf)
+# Longer side in pixels of the atlas crop of an MNIST digit at scale 1: digits are size
+# normalized to fit a 20x20 box and crops end at the last digit pixel, exclusive
+DIGIT_SIZE = 19
+# Step of the scale values create_image draws, estimates are snapped to it
+SCALE_STEP = 0.125
+# Keys of the per-box arrays of a box table
+BOX_KEYS = ('image_ids', 'classes', 'boxes', 'scores', 'scales')
+
+def box_table(image_ids,
+              classes,
+              boxes,
+              scores = None,
+              scales = None,
+              corner_coordinates = True,
+              images = None):
+    """
+    Definition:
+    Packs ground truth or prediction boxes into the flat arrays the evaluation works
+    on, one row per box. Boxes are converted to normalized corner coordinates.
+
+    Parameters:
+    image_ids (np.array)      : (K,) image id of every box
+    classes (np.array)        : (K,) class of every box
+    boxes (np.array)          : (K, 4) normalized boxes
+    scores (np.array)         : (K,) confidence of every box, 1 when None (ground truth)
+    scales (np.array)         : (K,) digit scale factor of every box, NaN when unknown
+    corner_coordinates (bool) : defines what bbox coordinate system boxes are in
+    images (np.array)         : id of every image the boxes are of, images without boxes
+                                included, the ids of image_ids when None
+
+    Returns:
+    table (dict) : 'image_ids', 'classes', 'boxes', 'scores' and 'scales' arrays of
+                   the boxes (BOX_KEYS) and the sorted unique 'images'
+    """
+    n = len(image_ids)
+    images = image_ids if images is None else images
+    return {'image_ids' : np.asarray(image_ids, dtype=np.int64).reshape(n),
+            'classes'   : np.asarray(classes, dtype=np.int64).reshape(n),
+            'boxes'     : geometry.as_corner(np.asarray(boxes, dtype=float).reshape(n, 4), corner_coordinates),
+            'scores'    : np.ones(n) if scores is None else np.asarray(scores, dtype=float).reshape(n),
+            'scales'    : np.full(n, np.nan) if scales is None else np.asarray(scales, dtype=float).reshape(n),
+            'images'    : np.unique(np.asarray(images, dtype=np.int64))}
+
+def estimate_scales(table,
+                    image_size):
+    """
+    Definition:
+    Fills the unknown scales of a box table with the scale factor estimated from the
+    box size: the longer side of the box in pixels over DIGIT_SIZE, snapped to
+    SCALE_STEP and at least 1. Boxes are tight around the resized digit crop, so
+    this recovers the scale of label files that carry none.
+
+    Parameters:
+    table (dict)          : box table, see box_table, updated in place
+    image_size (np.array) : (height, width) of the images, or (K, 2) of the image of every box
+
+    Returns:
+    table (dict) : the updated table
+    """
+    unknown = np.isnan(table['scales'])
+    size = np.broadcast_to(np.asarray(image_size, dtype=float), (len(unknown), 2))[unknown]
+    boxes = table['boxes'][unknown]
+    sides = np.maximum((boxes[:, 2] - boxes[:, 0]) * size[:, 1], (boxes[:, 3] - boxes[:, 1]) * size[:, 0])
+    # Snapping absorbs the rounding of the resized shape, under half a pixel; digits are
+    # never scaled down, smaller estimates are digits narrower than DIGIT_SIZE
+    table['scales'][unknown] = np.maximum(np.round(sides / DIGIT_SIZE / SCALE_STEP) * SCALE_STEP, 1)
+    return table
+
+def load_label_directory(directory,
+                         corner_coordinates = True,
+                         scores = False):
+    """
+    Definition:
+    Reads every %08d.txt file of a directory of "class a b c d" label lines (the
+    labels/ of a generated dataset, or detector output with a trailing score column)
+    into a box table in one pass.
+
+    Parameters:
+    directory (str)           : directory of the label files
+    corner_coordinates (bool) : defines what bbox coordinate system the labels are in
+    scores (bool)             : lines end with a confidence score
+
+    Returns:
+    table (dict) : box table, see box_table
+    """
+    num_columns = 6 if scores else 5
+    names = sorted(name for name in os.listdir(directory) if name.endswith('.txt'))
+
+    texts, counts = [], []
+    for name in names:
+        with open(os.path.join(directory, name)) as f:
+            text = f.read()
+        count, remainder = divmod(len(text.split()), num_columns)
+        if remainder:
+            raise ValueError(f"{name} does not hold {num_columns} values per line")
+        texts.append(text)
+        counts.append(count)
+
+    values = np.array(' '.join(texts).split(), dtype=float).reshape(-1, num_columns)
+    image_ids = np.repeat([int(name[:-len('.txt')]) for name in names], counts)
+
+    return box_table(image_ids,
+                     values[:, 0],
+                     values[:, 1:5],
+                     scores = values[:, 5] if scores else None,
+                     corner_coordinates = corner_coordinates,
+                     images = [int(name[:-len('.txt')]) for name in names])
+
+def load_coco_ground_truth(path):
+    """
+    Definition:
+    Reads a COCO annotations.json (e.g. written by CocoAnnotationWriter) into a box
+    table. The "scale" of every annotation is kept when present and estimated from
+    the box size otherwise.
+
+    Parameters:
+    path (str) : path of the annotations file
+
+    Returns:
+    table (dict) : box table, see box_table
+    """
+    with open(path) as f:
+        coco = json.load(f)
+
+    sizes = {image['id'] : (image['width'], image['height']) for image in coco['images']}
+    annotations = coco['annotations']
+
+    image_ids = np.array([annotation['image_id'] for annotation in annotations], dtype=np.int64)
+    boxes = np.array([annotation['bbox'] for annotation in annotations], dtype=float).reshape(-1, 4)
+    boxes[:, 2:] += boxes[:, :2]
+    size = np.array([sizes[image_id] for image_id in image_ids.tolist()], dtype=float).reshape(-1, 2)
+
+    table = box_table(image_ids,
+                      [annotation['category_id'] for annotation in annotations],
+                      boxes / np.tile(size, 2),
+                      scales = [annotation.get('scale', np.nan) for annotation in annotations],
+                      images = list(sizes))
+    return estimate_scales(table, size[:, ::-1])
+
+def load_raw_ground_truth(directory):
+    """
+    Definition:
+    Reads the boxes of a dataset written by RawWriter into a box table, with scales
+    estimated from the box sizes
+
+    Parameters:
+    directory (str) : output directory of the dataset
+
+    Returns:
+    table (dict) : box table, see box_table
+    """
+    from writers import load_raw_dataset
+
+    dataset = load_raw_dataset(directory)
+    boxes, counts = np.asarray(dataset['boxes']), np.asarray(dataset['counts'])
+    image_ids, slots = np.nonzero(np.arange(boxes.shape[1]) < counts[:, None])
+
+    config = dataset['header']['config']
+    table = box_table(image_ids,
+                      boxes[image_ids, slots, 0],
+                      boxes[image_ids, slots, 1:],
+                      corner_coordinates = config['corner_coordinates'],
+                      images = np.arange(len(counts)))
+    return estimate_scales(table, config['image_size'])
+
+def load_ground_truth(path,
+                      corner_coordinates = True,
+                      image_size = None):
+    """
+    Definition:
+    Reads the ground truth of a generated dataset: a COCO annotations.json, a raw
+    dataset directory, a yolo layout directory or a directory of label files. Label
+    files carry no scale, it is estimated from the box sizes with the image size of
+    the manifest of the dataset, or image_size.
+
+    Parameters:
+    path (str)                : annotations file or dataset directory
+    corner_coordinates (bool) : coordinate system of label files (raw datasets record their own)
+    image_size ((int , int))  : height and width of the images of label files, read from
+                                the manifest when None, scales stay unknown without either
+
+    Returns:
+    table (dict) : box table, see box_table
+    """
+    if path.endswith('.json'):
+        return load_coco_ground_truth(path)
+    if os.path.exists(os.path.join(path, 'header.json')):
+        return load_raw_ground_truth(path)
+    if os.path.isdir(os.path.join(path, 'labels')):
+        path = os.path.join(path, 'labels')
+
+    if image_size is None:
+        manifest = Manifest.load(os.path.dirname(os.path.normpath(path)))
+        image_size = manifest.config['image_size'] if manifest is not None else None
+
+    table = load_label_directory(path, corner_coordinates=corner_coordinates)
+    return estimate_scales(table, image_size) if image_size is not None else table
+
+def ground_truth_from_added_objects(added_objects_list,
+                                    image_ids = None,
+                                    corner_coordinates = True):
+    """
+    Definition:
+    Builds a box table from the added_objects of created images, including the scale
+    of every digit
+
+    Parameters:
+    added_objects_list (list) : added_objects dicts of create_image, one per image
+    image_ids (list)          : id of every image, their position when None
+    corner_coordinates (bool) : defines what bbox coordinate system is in use
+
+    Returns:
+    table (dict) : box table, see box_table
+    """
+    if image_ids is None:
+        image_ids = range(len(added_objects_list))
+
+    objects = [(image_id, added_object) for image_id, added_objects in zip(image_ids, added_objects_list)
+                                        for added_object in added_objects.values()]
+
+    return box_table([image_id for image_id, _ in objects],
+                     [added_object['class'] for _, added_object in objects],
+                     [added_object['bbox_norm'] for _, added_object in objects],
+                     scales = [added_object.get('scale', np.nan) for _, added_object in objects],
+                     corner_coordinates = corner_coordinates,
+                     images = image_ids)
+
+def _pairs(ground_truth,
+           predictions,
+           by_class = True,
+           num_classes = NUM_CLASSES):
+    """
+    Definition:
+    Lists every (prediction, ground truth) pair on the same image (and of the same
+    class when by_class) with its IoU, without any per-image Python loop
+
+    Returns:
+    pair_pred (np.array) : (P,) prediction index of every pair
+    pair_gt (np.array)   : (P,) ground truth index of every pair
+    iou (np.array)       : (P,) IoU of every pair
+    """
+    gt_keys = ground_truth['image_ids'] * num_classes + ground_truth['classes'] if by_class else ground_truth['image_ids']
+    pred_keys = predictions['image_ids'] * num_classes + predictions['classes'] if by_class else predictions['image_ids']
+
+    order = np.argsort(gt_keys, kind='stable')
+    sorted_keys = gt_keys[order]
+    start = np.searchsorted(sorted_keys, pred_keys, side='left')
+    counts = np.searchsorted(sorted_keys, pred_keys, side='right') - start
+
+    pair_pred = np.repeat(np.arange(len(pred_keys)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    pair_gt = order[np.repeat(start, counts) + offsets]
+
+    return pair_pred, pair_gt, geometry.iou(predictions['boxes'][pair_pred], ground_truth['boxes'][pair_gt])
+
+def _greedy_match(predictions,
+                  num_gt,
+                  pairs,
+                  iou_thresholds,
+                  by_class = True,
+                  num_classes = NUM_CLASSES):
+    """
+    Definition:
+    COCO greedy matching: in order of decreasing score, every prediction takes the
+    unmatched ground truth of its image (and class) with the highest IoU of at least
+    the threshold. Round r matches the r-th best prediction of every image (and class)
+    at once, which is exact since predictions of different images never compete.
+
+    Returns:
+    matched (np.array) : (T, N) matched ground truth index of every prediction at every
+                         threshold, -1 for none
+    """
+    n = len(predictions['scores'])
+    groups = predictions['image_ids'] * num_classes + predictions['classes'] if by_class else predictions['image_ids']
+
+    # Rank of every prediction by decreasing score within its group
+    order = np.lexsort((-predictions['scores'], groups))
+    sorted_groups = groups[order]
+    first = np.r_[True, sorted_groups[1:] != sorted_groups[:-1]] if n else np.zeros(0, dtype=bool)
+    rank = np.empty(n, dtype=np.int64)
+    rank[order] = np.arange(n) - np.maximum.accumulate(np.where(first, np.arange(n), 0))
+
+    # Pairs by round, then prediction, then decreasing IoU
+    pair_pred, pair_gt, iou = pairs
+    pair_rank = rank[pair_pred]
+    order = np.lexsort((-iou, pair_pred, pair_rank))
+    pair_pred, pair_gt, iou, pair_rank = pair_pred[order], pair_gt[order], iou[order], pair_rank[order]
+    bounds = np.searchsorted(pair_rank, np.arange(pair_rank[-1] + 2 if len(pair_rank) else 1))
+    rounds = [(pair_pred[low:high], pair_gt[low:high], iou[low:high]) for low, high in zip(bounds[:-1], bounds[1:])]
+
+    matched = np.full((len(iou_thresholds), n), -1, dtype=np.int64)
+    for t, iou_threshold in enumerate(iou_thresholds):
+        taken = np.zeros(num_gt, dtype=bool)
+        for round_pred, round_gt, round_iou in rounds:
+            candidate = (round_iou >= iou_threshold) & ~taken[round_gt]
+            round_pred, round_gt = round_pred[candidate], round_gt[candidate]
+            if not len(round_pred):
+                continue
+
+            # Highest IoU candidate of every prediction of the round
+            first = np.r_[True, round_pred[1:] != round_pred[:-1]]
+            matched[t, round_pred[first]] = round_gt[first]
+            taken[round_gt[first]] = True
+
+    return matched
+
+def _average_precision(true_positives,
+                       scores,
+                       classes,
+                       gt_classes,
+                       num_classes = NUM_CLASSES):
+    """
+    Definition:
+    101-point interpolated average precision of every class and IoU threshold
+
+    Parameters:
+    true_positives (np.array) : (T, N) bool, prediction matched at threshold t
+    scores (np.array)         : (N,) prediction scores
+    classes (np.array)        : (N,) prediction classes
+    gt_classes (np.array)     : (K,) ground truth classes
+
+    Returns:
+    ap (np.array) : (num_classes, T) average precision, NaN for classes without ground truth
+    """
+    num_gt = np.bincount(gt_classes, minlength=num_classes)
+    ap = np.full((num_classes, len(true_positives)), np.nan)
+
+    order = np.lexsort((-scores, classes))
+    bounds = np.searchsorted(classes[order], np.arange(num_classes + 1))
+    for c in range(num_classes):
+        if num_gt[c] == 0:
+            continue
+        tp = true_positives[:, order[bounds[c]:bounds[c + 1]]]
+        if not tp.shape[1]:
+            ap[c] = 0
+            continue
+
+        cumulative_tp = np.cumsum(tp, axis=1)
+        recall = cumulative_tp / num_gt[c]
+        precision = cumulative_tp / np.arange(1, tp.shape[1] + 1)
+        # Precision envelope, the best precision at any higher recall
+        precision = np.maximum.accumulate(precision[:, ::-1], axis=1)[:, ::-1]
+
+        for t in range(len(tp)):
+            index = np.searchsorted(recall[t], RECALL_POINTS, side='left')
+            ap[c, t] = np.where(index < tp.shape[1], precision[t, np.minimum(index, tp.shape[1] - 1)], 0).mean()
+
+    return ap
+
+def evaluate(ground_truth,
+             predictions,
+             iou_thresholds = IOU_THRESHOLDS,
+             conf_threshold = 0.25,
+             scale_bins = SCALE_BINS,
+             num_classes = NUM_CLASSES):
+    """
+    Definition:
+    Scores predictions against ground truth, both box tables (see box_table). AP is
+    computed over all predictions; precision, recall, recall by scale and the
+    confusion matrix use the predictions of at least conf_threshold at IoU 0.5.
+
+    Parameters:
+    ground_truth (dict)       : box table of the ground truth
+    predictions (dict)        : box table of the predictions
+    iou_thresholds (np.array) : IoU thresholds AP is averaged over
+    conf_threshold (float)    : score of the operating point
+    scale_bins (tuple)        : edges of the digit scale factor bins
+    num_classes (int)         : number of classes
+
+    Returns:
+    results (dict) : 'ap' (num_classes, T), 'ap_per_class', 'map', 'map50', 'map75',
+                     'precision', 'recall', 'recall_by_scale' list of
+                     {'scale', 'count', 'recall'}, 'confusion' (num_classes + 1)^2 counts
+                     of [predicted, true] class with background last, and box counts
+    """
+    iou_thresholds = np.asarray(iou_thresholds, dtype=float)
+    num_gt = len(ground_truth['classes'])
+
+    pairs = _pairs(ground_truth, predictions, num_classes=num_classes)
+    true_positives = _greedy_match(predictions, num_gt, pairs, iou_thresholds, num_classes=num_classes) >= 0
+    ap = _average_precision(true_positives, predictions['scores'], predictions['classes'],
+                            ground_truth['classes'], num_classes)
+
+    def map_at(threshold):
+        index = np.nonzero(np.isclose(iou_thresholds, threshold))[0]
+        return float(np.nanmean(ap[:, index[0]])) if len(index) and not np.isnan(ap).all() else np.nan
+
+    # Classes without ground truth have no AP
+    has_ap = ~np.isnan(ap).all(axis=1)
+    ap_per_class = np.full(num_classes, np.nan)
+    ap_per_class[has_ap] = np.nanmean(ap[has_ap], axis=1)
+
+    # Operating point
+    confident = {**predictions, **{key : predictions[key][predictions['scores'] >= conf_threshold] for key in BOX_KEYS}}
+    matched = _greedy_match(confident, num_gt, _pairs(ground_truth, confident, num_classes=num_classes),
+                            [0.5], num_classes=num_classes)[0]
+    gt_found = np.zeros(num_gt, dtype=bool)
+    gt_found[matched[matched >= 0]] = True
+
+    recall_by_scale = []
+    scale_bin = np.digitize(ground_truth['scales'], scale_bins) - 1
+    for b, (low, high) in enumerate(zip(scale_bins[:-1], scale_bins[1:])):
+        in_bin = scale_bin == b
+        recall_by_scale.append({'scale'  : (low, high),
+                                'count'  : int(in_bin.sum()),
+                                'recall' : float(gt_found[in_bin].mean()) if in_bin.any() else np.nan})
+
+    # Class agnostic matching for the confusion matrix
+    pair_pred, pair_gt, iou = _pairs(ground_truth, confident, by_class=False)
+    keep = iou >= 0.5
+    by_iou = np.argsort(-iou[keep], kind='stable')
+    pair_pred, pair_gt = pair_pred[keep][by_iou], pair_gt[keep][by_iou]
+    _, unique_pred = np.unique(pair_pred, return_index=True)
+    pair_pred, pair_gt = pair_pred[np.sort(unique_pred)], pair_gt[np.sort(unique_pred)]
+    _, unique_gt = np.unique(pair_gt, return_index=True)
+    pair_pred, pair_gt = pair_pred[unique_gt], pair_gt[unique_gt]
+
+    background = num_classes
+    confusion = np.zeros((num_classes + 1, num_classes + 1), dtype=np.int64)
+    np.add.at(confusion, (confident['classes'][pair_pred], ground_truth['classes'][pair_gt]), 1)
+    missed = np.ones(num_gt, dtype=bool)
+    missed[pair_gt] = False
+    np.add.at(confusion, (background, ground_truth['classes'][missed]), 1)
+    extra = np.ones(len(confident['classes']), dtype=bool)
+    extra[pair_pred] = False
+    np.add.at(confusion, (confident['classes'][extra], background), 1)
+
+    return {'iou_thresholds'   : iou_thresholds,
+            'ap'               : ap,
+            'ap_per_class'     : ap_per_class,
+            'map'              : float(np.nanmean(ap)) if not np.isnan(ap).all() else np.nan,
+            'map50'            : map_at(0.5),
+            'map75'            : map_at(0.75),
+            'precision'        : float((matched >= 0).mean()) if len(matched) else np.nan,
+            'recall'           : float(gt_found.mean()) if num_gt else np.nan,
+            'recall_by_scale'  : recall_by_scale,
+            'confusion'        : confusion,
+            'num_images'       : len(np.union1d(ground_truth['images'], predictions['images'])),
+            'num_ground_truth' : num_gt,
+            'num_predictions'  : len(predictions['scores'])}
+
+def format_results(results):
+    """
+    Definition:
+    Formats evaluation results as a text report
+
+    Parameters:
+    results (dict) : results of evaluate
+
+    Returns:
+    report (str) : multi-line report
+    """
+    lines = [f"{results['num_images']} images, {results['num_ground_truth']} objects, {results['num_predictions']} predictions",
+             f"mAP@[.5:.95] {results['map']:.4f} | mAP@.5 {results['map50']:.4f} | mAP@.75 {results['map75']:.4f}",
+             f"precision {results['precision']:.4f} | recall {results['recall']:.4f}",
+             "AP per class:   " + ' '.join(f"{c}:{ap:.3f}" for c, ap in enumerate(results['ap_per_class'])),
+             "recall by scale:"]
+    for scale_bin in results['recall_by_scale']:
+        low, high = scale_bin['scale']
+        lines.append(f"  [{low:g}, {high:g}) {scale_bin['count']:>8} objects | recall {scale_bin['recall']:.4f}")
+    unknown = results['num_ground_truth'] - sum(scale_bin['count'] for scale_bin in results['recall_by_scale'])
+    if unknown:
+        lines.append(f"  unknown  {unknown:>8} objects (no scale and no image size to estimate it, see --image-size)")
+
+    lines.append("confusion (rows predicted, columns true, background last):")
+    lines += ['  ' + ' '.join(f"{count:>6}" for count in row) for row in results['confusion']]
+
+    return '\n'.join(lines)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Evaluate detections against a generated MNIST object detection dataset")
+    parser.add_argument('ground_truth', help="annotations.json, dataset directory or label directory")
+    parser.add_argument('predictions', help="directory of %%08d.txt files of 'class a b c d score' lines")
+    parser.add_argument('--center-coordinates', action='store_true', help="label files hold center, width, height boxes")
+    parser.add_argument('--image-size', type=int, nargs=2, metavar=('HEIGHT', 'WIDTH'),
+                        help="image size of label files, read from the dataset manifest when omitted")
+    parser.add_argument('--conf-threshold', type=float, default=0.25, help="score of the operating point")
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    corner_coordinates = not args.center_coordinates
+    results = evaluate(load_ground_truth(args.ground_truth, corner_coordinates=corner_coordinates, image_size=args.image_size),
+                       load_label_directory(args.predictions, corner_coordinates=corner_coordinates, scores=True),
+                       conf_threshold=args.conf_threshold)
+    print(format_results(results))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, default=lambda value: value.tolist() if hasattr(value, 'tolist') else str(value))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,731 @@
+import os
+import math
+import time
+import argparse
+import threading
+import contextlib
+import collections
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from utils import *
+from writers import *
+from backgrounds import NoiseBank, NOISE_TYPES
+from blend import BLEND_MODES
+from cache import GenerationCache, cache_key, chunk_size, evict
+from manifest import Manifest, MANIFEST_FILE, remaining_ranges
+
+# Upper bound of the %08d image ids
+MAX_DATASET_SIZE = 99999999
+# Largest id range handed to a worker at once, bounds the progress granularity
+MAX_RANGE_SIZE = 1000
+# Number of the last committed ranges of a manifest whose files are checked on resume
+VERIFY_RANGES = 64
+# Supported dataset layouts
+OUTPUT_FORMATS = tuple(WRITERS)
+
+# create_image parameters taken from a generation config
+IMAGE_KEYS = ['image_size', 'noise_intensity', 'grid_rows', 'grid_cols', 'max_objects',
+              'max_scaling', 'add_gridlines', 'allow_overlap', 'corner_coordinates',
+              'min_objects', 'max_retries', 'blend_mode']
+# Config keys an image depends on besides IMAGE_KEYS, together they key the generation cache
+CACHE_KEYS = IMAGE_KEYS + ['seed', 'noise_type', 'noise_bank_mb']
+
+DEFAULT_CONFIG = {
+    'image_size'         : (256, 256),
+    'noise_intensity'    : 180,
+    'noise_type'         : 'uniform',
+    'noise_bank_mb'      : 0,
+    'grid_rows'          : 8,
+    'grid_cols'          : 8,
+    'max_objects'        : 10,
+    'min_objects'        : 0,
+    'max_retries'        : 0,
+    'max_scaling'        : 4.0,
+    'add_gridlines'      : False,
+    'allow_overlap'      : False,
+    'blend_mode'         : 'max',
+    'corner_coordinates' : True,
+    'dataset_size'       : 1000,
+    'output_directory'   : None,
+    'output_format'      : 'yolo',
+    'annotation_formats' : ['yolo'],
+    'grid_targets'       : False,
+    'anchors'            : None,
+    'shard_size'         : 10000,
+    'writer_threads'     : 4,
+    'seed'               : None,
+    'num_workers'        : None,
+    'start_method'       : None,
+    'mnist_path'         : None,
+    'mmap'               : False,
+    'instrument'         : False,
+    'cache_dir'          : None,
+    'cache_max_gb'       : 10.0,
+    'resume'             : False,
+}
+
+# State of a generation worker process, set once by _init_worker
+_worker = {}
+
+class GenerationCancelled(Exception):
+    """Raised by generate_dataset when its GenerationControl is cancelled"""
+
+class GenerationControl:
+    """
+    Definition:
+    Pause and cancel switch of a generate_dataset run, flipped from another thread
+    (e.g. a GUI). The run checks it before handing out every id range, so it pauses
+    or stops once the ranges already in flight are written; the dataset is never
+    left with half-written ranges.
+    """
+    def __init__(self):
+        self._running = threading.Event()
+        self._running.set()
+        self.cancelled = False
+
+    @property
+    def paused(self):
+        return not self._running.is_set()
+
+    def pause(self):
+        self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+    def cancel(self):
+        self.cancelled = True
+        self._running.set()
+
+    def wait(self):
+        """
+        Definition:
+        Blocks while the run is paused
+
+        Returns:
+        running (bool) : False once the run is cancelled
+        """
+        self._running.wait()
+        return not self.cancelled
+
+def image_seed(seed, image_id):
+    """
+    Definition:
+    Derives the RNG seed of one image from the dataset seed, so every image can be
+    generated on its own and the dataset does not depend on how ids are split up.
+
+    Parameters:
+    seed (int)     : dataset seed
+    image_id (int) : id of the image in the dataset
+
+    Returns:
+    state (np.array) : uint32 seed of the np.random.RandomState of the image
+    """
+    return np.random.SeedSequence([seed, image_id]).generate_state(4)
+
+def _share_array(array):
+    """
+    Definition:
+    Copies an array into a new shared memory block.
+
+    Parameters:
+    array (np.array) : array to share
+
+    Returns:
+    shm (SharedMemory) : the block, owned (and unlinked) by the caller
+    descriptor (tuple) : (name, shape, dtype) used by _attach_array
+    """
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+def _attach_array(descriptor):
+    """
+    Definition:
+    Maps a shared array created by _share_array into this process.
+
+    Parameters:
+    descriptor (tuple) : (name, shape, dtype) of the shared array
+
+    Returns:
+    shm (SharedMemory) : the attached block, must outlive the array
+    array (np.array)   : array backed by the shared block
+    """
+    name, shape, dtype = descriptor
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+def _background(config, bank = None):
+    """
+    Definition:
+    Creates the background engine of a generation config.
+
+    Parameters:
+    config (dict)   : complete generation config
+    bank (np.array) : noise bank built before, a new one is generated when None
+
+    Returns:
+    background (NoiseBank) : None for uniform noise without a bank, which keeps the
+                             generate_noisy_image backgrounds
+    """
+    if config['noise_type'] == 'uniform' and config['noise_bank_mb'] <= 0:
+        return None
+
+    return NoiseBank(config['image_size'],
+                     noise_intensity=config['noise_intensity'],
+                     noise_type=config['noise_type'],
+                     memory_mb=config['noise_bank_mb'],
+                     seed=config['seed'],
+                     bank=bank)
+
+def _cache_content(config):
+    """Config values of CACHE_KEYS, image_size as a list like its JSON form"""
+    content = {key : config[key] for key in CACHE_KEYS}
+    content['image_size'] = list(content['image_size'])
+    return content
+
+def _cache(config):
+    """
+    Definition:
+    Opens the generation cache of a config.
+
+    Parameters:
+    config (dict) : complete generation config with 'cache_key' set by generate_dataset
+
+    Returns:
+    cache (GenerationCache) : None when config['cache_dir'] is None
+    """
+    if config['cache_dir'] is None:
+        return None
+    return GenerationCache(config['cache_dir'], config['cache_key'], _cache_content(config))
+
+def _setup_worker(arrays, config):
+    """
+    Definition:
+    Stores the generation state of the current process.
+
+    Parameters:
+    arrays (dict) : 'objects', 'labels', the digit atlas arrays and the optional 'noise_bank'
+    config (dict) : complete generation config
+    """
+    _worker['objects'] = arrays['objects']
+    _worker['labels'] = arrays['labels']
+    _worker['atlas'] = {key : arrays[key] for key in ('pixels', 'offsets', 'shapes')}
+    _worker['resize_cache'] = ResizeCache()
+    _worker['placement_stats'] = GenerationStats() if config['instrument'] else PlacementStats()
+    _worker['image_kwargs'] = {key : config[key] for key in IMAGE_KEYS}
+    _worker['background'] = _background(config, arrays.get('noise_bank'))
+    _worker['cache'] = _cache(config)
+    _worker['config'] = config
+
+def _init_worker(descriptors, config):
+    """
+    Definition:
+    Pool initializer, attaches the shared MNIST arrays once per worker process.
+    """
+    arrays = {}
+    _worker['shm'] = []
+    for key, descriptor in descriptors.items():
+        shm, arrays[key] = _attach_array(descriptor)
+        _worker['shm'].append(shm)
+
+    _setup_worker(arrays, config)
+
+@contextlib.contextmanager
+def worker_pool(objects,
+                labels,
+                atlas,
+                config):
+    """
+    Definition:
+    Context manager setting up the generation state. With several workers, MNIST,
+    its labels, the digit atlas and the noise bank are copied into shared memory
+    once and a pool of processes attaches to them; the shared blocks are released
+    on exit.
+
+    Parameters:
+    objects (np.array)     : all images of MNIST dataset
+    labels (np.array)      : all associated classes and bbox labels of MNIST dataset
+    atlas (dict)           : digit atlas of objects
+    config (dict)          : complete generation config, config['num_workers'] of 0 or 1
+                             sets up this process instead of a pool; the pool is started
+                             with config['start_method'] ('fork', 'spawn' or 'forkserver'),
+                             the platform default when None
+
+    Returns:
+    pool (multiprocessing.Pool) : the worker pool, None when generating in this process
+    """
+    arrays = {'objects' : np.asarray(objects),
+              'labels'  : np.asarray(labels),
+              'pixels'  : atlas['pixels'],
+              'offsets' : atlas['offsets'],
+              'shapes'  : atlas['shapes']}
+
+    # The noise bank is built once and shared like MNIST
+    background = _background(config)
+    if background is not None and background.bank is not None:
+        arrays['noise_bank'] = background.bank
+
+    if config['num_workers'] <= 1:
+        _setup_worker(arrays, config)
+        yield None
+        return
+
+    shared, descriptors = [], {}
+    try:
+        for key, array in arrays.items():
+            shm, descriptors[key] = _share_array(array)
+            shared.append(shm)
+
+        context = mp.get_context(config['start_method'])
+        with context.Pool(config['num_workers'],
+                          initializer=_init_worker,
+                          initargs=(descriptors, config)) as pool:
+            yield pool
+    finally:
+        for shm in shared:
+            shm.close()
+            shm.unlink()
+
+def create_image_by_id(image_id):
+    """
+    Definition:
+    Creates image image_id of the dataset set up in the current process (a pool
+    worker, or the main process when generating without workers).
+
+    Parameters:
+    image_id (int) : id of the image in the dataset
+
+    Returns:
+    image (np.array)     : finished created image
+    added_objects (dict) : dict with all object class, true object coordinates on 
+                           image, and normalized coordinates
+    """
+    # A RandomState of its own (the same stream as seeding np.random) leaves the global
+    # state alone, so images can be created on a thread
+    return create_image(_worker['objects'],
+                        _worker['labels'],
+                        atlas=_worker['atlas'],
+                        resize_cache=_worker['resize_cache'],
+                        placement_stats=_worker['placement_stats'],
+                        background=_worker['background'],
+                        rng=np.random.RandomState(image_seed(_worker['config']['seed'], image_id)),
+                        **_worker['image_kwargs'])
+
+def _generate_range(id_range):
+    """
+    Definition:
+    Creates and writes the images with ids in [start, stop) in the current worker,
+    reading the images already in the generation cache from there.
+
+    Parameters:
+    id_range ((int , int)) : start and stop image id
+
+    Returns:
+    id_range ((int , int)) : the range written
+    stats (dict)           : PlacementStats (GenerationStats when instrumented) counts of the range
+    """
+    config = _worker['config']
+    start, stop = id_range
+    stats = _worker['placement_stats']
+    stats.reset()
+    timed = isinstance(stats, GenerationStats)
+
+    writer = WRITERS[config['output_format']](config['output_directory'], id_range, config)
+    if config['writer_threads'] > 0:
+        writer = AsyncWriter(writer, num_threads=config['writer_threads'])
+
+    cache = _worker['cache']
+    if cache is None:
+        images = ((image_id, *create_image_by_id(image_id)) for image_id in range(start, stop))
+    else:
+        hits = cache.hits
+        images = cache.images(start, stop, create_image_by_id)
+
+    with writer:
+        for image_id, image, added_objects in images:
+            if timed:
+                write_start = time.perf_counter()
+            writer.write(image_id, image, added_objects)
+            if timed:
+                stats.lap('write', write_start)
+
+    if timed:
+        stats.bytes_written += writer.bytes_written
+    if cache is not None:
+        stats.cached += cache.hits - hits
+
+    return id_range, stats.as_dict()
+
+def _run_ranges(pool,
+                ranges,
+                control = None,
+                max_in_flight = 1):
+    """
+    Definition:
+    Generates id ranges in this process or on the pool and yields their results as
+    they complete. With a control, ranges are handed out one by one with at most
+    max_in_flight in flight, so pausing and cancelling take effect between ranges.
+
+    Parameters:
+    pool (multiprocessing.Pool)  : worker pool, None generates in this process
+    ranges (list)                : (start, stop) id ranges
+    control (GenerationControl)  : pause and cancel switch of the run
+    max_in_flight (int)          : ranges handed to the pool at once with a control
+
+    Returns:
+    results (iterator) : _generate_range result of every range
+    """
+    if pool is None:
+        for id_range in ranges:
+            if control is not None and not control.wait():
+                raise GenerationCancelled()
+            yield _generate_range(id_range)
+        return
+
+    if control is None:
+        yield from pool.imap_unordered(_generate_range, ranges)
+        return
+
+    pending = collections.deque()
+    for id_range in ranges:
+        while len(pending) >= max_in_flight:
+            yield pending.popleft().get()
+        if not control.wait():
+            break
+        pending.append(pool.apply_async(_generate_range, (id_range,)))
+
+    while pending:
+        yield pending.popleft().get()
+    if control.cancelled:
+        raise GenerationCancelled()
+
+def id_ranges(dataset_size, num_chunks):
+    """
+    Definition:
+    Splits the image ids into contiguous ranges of (almost) equal size
+
+    Parameters:
+    dataset_size (int) : number of images in the dataset
+    num_chunks (int)   : number of ranges to split into
+
+    Returns:
+    ranges (list) : list of (start, stop) tuples covering range(dataset_size)
+    """
+    bounds = np.linspace(0, dataset_size, max(1, min(num_chunks, dataset_size)) + 1).astype(int)
+    return [(int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+def shard_ranges(dataset_size, shard_size):
+    """
+    Definition:
+    Splits the image ids into the ranges of consecutive shards
+
+    Parameters:
+    dataset_size (int) : number of images in the dataset
+    shard_size (int)   : number of images per shard
+
+    Returns:
+    ranges (list) : list of (start, stop) tuples covering range(dataset_size)
+    """
+    return [(start, min(start + shard_size, dataset_size)) for start in range(0, dataset_size, shard_size)]
+
+def complete_config(config):
+    """
+    Definition:
+    Fills in a generation config: missing keys are taken from DEFAULT_CONFIG, a
+    seed is drawn when none is set and num_workers defaults to all cores.
+
+    Parameters:
+    config (dict) : partial generation config
+
+    Returns:
+    config (dict) : complete generation config (a new dict)
+    """
+    config = {**DEFAULT_CONFIG, **config}
+    if config['seed'] is None:
+        config['seed'] = int(np.random.SeedSequence().generate_state(1)[0])
+    if config['num_workers'] is None:
+        config['num_workers'] = os.cpu_count() or 1
+
+    return config
+
+def prepare_mnist(config,
+                  objects = None,
+                  labels = None,
+                  atlas = None):
+    """
+    Definition:
+    Loads MNIST and its cached bbox table and digit atlas for a generation config,
+    unless the arrays are given already (the atlas is then built from the labels
+    if missing).
+
+    Parameters:
+    config (dict)      : generation config, uses 'mnist_path', 'mmap' and 'corner_coordinates'
+    objects (np.array) : all images of MNIST dataset
+    labels (np.array)  : all associated classes and bbox labels of MNIST dataset
+    atlas (dict)       : digit atlas of objects
+
+    Returns:
+    objects (np.array) : all images of MNIST dataset
+    labels (np.array)  : all associated classes and bbox labels of MNIST dataset
+    atlas (dict)       : digit atlas of objects
+    """
+    if objects is not None:
+        if atlas is None:
+            atlas = build_digit_atlas(objects, labels_to_bbox_table(labels, config['corner_coordinates']))
+        return objects, labels, atlas
+
+    objects, classes = load_mnist(path=config['mnist_path'], mmap=config['mmap'])
+    table = load_bbox_table(objects, classes)
+    labels = bbox_table_to_labels(table, corner_coordinates=config['corner_coordinates'])
+
+    return objects, labels, load_digit_atlas(objects, table)
+
+def terminal_progress(interval = 1.0,
+                      stats = None):
+    """
+    Definition:
+    Creates a progress callback printing images/sec and the ETA to the terminal, or
+    with stats, a log line of its throughput, bytes written and stage times
+
+    Parameters:
+    interval (float)        : minimum number of seconds between two printed lines
+    stats (GenerationStats) : instrumentation of the run, filled by generate_dataset
+
+    Returns:
+    progress (callable) : progress(done, total) callback for generate_dataset
+    """
+    start = time.perf_counter()
+    last_print = [-math.inf]
+
+    def progress(done, total):
+        now = time.perf_counter()
+        if now - last_print[0] < interval and done < total:
+            return
+        last_print[0] = now
+
+        if stats is not None:
+            print(f"{stats.progress_line()} | {stats.stage_line()}", flush=True)
+            return
+
+        rate = done / max(now - start, 1e-9)
+        eta = (total - done) / rate if rate > 0 else math.inf
+        eta_str = time.strftime('%H:%M:%S', time.gmtime(eta)) if math.isfinite(eta) else '--:--:--'
+        print(f"\r{done}/{total} images | {rate:8.1f} images/s | ETA {eta_str}",
+              end='\n' if done >= total else '', flush=True)
+
+    return progress
+
+def generate_dataset(config,
+                     objects = None,
+                     labels = None,
+                     atlas = None,
+                     progress = None,
+                     placement_stats = None,
+                     control = None):
+    """
+    Definition:
+    Generates a dataset into config['output_directory'] in the layout of
+    config['output_format'] (see writers.WRITERS) using a pool of worker processes. MNIST, its labels and the digit atlas are placed in
+    shared memory once; every worker gets contiguous id ranges and every image is
+    seeded from (seed, image id), so the dataset is the same for any worker count.
+
+    Parameters:
+    config (dict)       : generation config, missing keys are taken from DEFAULT_CONFIG
+    objects (np.array)  : all images of MNIST dataset, loaded from config when None
+    labels (np.array)   : all associated classes and bbox labels of MNIST dataset
+    atlas (dict)        : digit atlas of objects, built from labels when None
+    progress (callable) : progress(done, total) called as id ranges complete
+    placement_stats (PlacementStats) : counters the placements of all workers are added to; a
+                                       GenerationStats turns on config['instrument'] and also
+                                       collects the stage timers and bytes written
+    control (GenerationControl)      : pause and cancel switch of the run, a cancelled run
+                                       raises GenerationCancelled after its ranges in flight
+
+    Returns:
+    config (dict) : the complete config used, with the drawn seed filled in
+    """
+    seed_drawn = config.get('seed') is None
+    config = complete_config(config)
+    if config['output_directory'] is None:
+        raise ValueError("config['output_directory'] must be set")
+    if config['output_format'] not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format '{config['output_format']}'")
+    for annotation_format in config['annotation_formats']:
+        if annotation_format not in ANNOTATION_WRITERS:
+            raise ValueError(f"Unknown annotation format '{annotation_format}'")
+    if not 0 <= config['min_objects'] < config['max_objects']:
+        raise ValueError("config['min_objects'] must be at least 0 and below config['max_objects'], "
+                         "which is exclusive")
+    if config['max_objects'] - 1 > config['grid_rows'] * config['grid_cols']:
+        raise ValueError(f"Up to config['max_objects'] - 1 = {config['max_objects'] - 1} objects do not fit "
+                         f"the {config['grid_rows'] * config['grid_cols']} regions of the grid")
+    if config['noise_type'] not in NOISE_TYPES:
+        raise ValueError(f"Unknown noise type '{config['noise_type']}'")
+    if config['blend_mode'] not in BLEND_MODES:
+        raise ValueError(f"Unknown blend mode '{config['blend_mode']}'")
+    if config['grid_targets'] and config['output_format'] not in TARGET_FORMATS:
+        raise ValueError(f"Grid targets are not stored by the '{config['output_format']}' format")
+    if config['anchors'] is not None and np.shape(config['anchors'])[1:] != (2,):
+        raise ValueError("config['anchors'] must be a list of [width, height] pairs")
+    if config['cache_dir'] is not None and config['cache_max_gb'] < 0:
+        raise ValueError("config['cache_max_gb'] must not be negative")
+
+    manifest = None
+    if config['resume']:
+        manifest = Manifest.load(config['output_directory'])
+        if manifest is None:
+            raise ValueError(f"Cannot resume {config['output_directory']}, it has no {MANIFEST_FILE}")
+    if manifest is not None and seed_drawn:
+        # A resumed run continues with the seed of the run it resumes
+        config['seed'] = manifest.config['seed']
+
+    objects, labels, atlas = prepare_mnist(config, objects, labels, atlas)
+    if config['cache_dir'] is not None:
+        config['cache_key'] = cache_key(_cache_content(config), objects, labels)
+
+    config['dataset_size'] = n = min(config['dataset_size'], MAX_DATASET_SIZE)
+    if isinstance(placement_stats, GenerationStats):
+        config['instrument'] = True
+    if manifest is not None:
+        mismatched = manifest.mismatched_keys(config)
+        if mismatched:
+            raise ValueError(f"Cannot resume {config['output_directory']}, the config differs in {', '.join(mismatched)}")
+        if manifest.finalized:
+            # A crash may have come between finalizing the manifest and the cleanup
+            WRITERS[config['output_format']].cleanup(config['output_directory'], config)
+            return config
+    writer = WRITERS[config['output_format']]
+
+    if writer.sharded:
+        ranges = shard_ranges(n, config['shard_size'])
+    elif config['cache_dir'] is not None:
+        # Ranges of whole cache chunks, every chunk is read and extended by one worker
+        ranges = shard_ranges(n, chunk_size(config['image_size']))
+    else:
+        # Several ranges per worker keep the pool balanced and progress flowing
+        ranges = id_ranges(n, max(max(1, config['num_workers']) * 8, math.ceil(n / MAX_RANGE_SIZE)))
+
+    if manifest is None:
+        writer.prepare(config['output_directory'], config)
+        manifest = Manifest(config['output_directory'])
+        manifest.start(config)
+    else:
+        # Ranges committed just before an interruption are the ones whose files may be missing
+        tail = len(manifest.ranges) - VERIFY_RANGES
+        completed = [id_range for index, id_range in enumerate(manifest.ranges)
+                     if index < tail or writer.verify(config['output_directory'], id_range, config)]
+        writer.recover(config['output_directory'], config, completed)
+        manifest.resume(config, completed)
+        ranges = remaining_ranges(ranges, completed)
+
+    done = n - sum(stop - start for start, stop in ranges)
+    if isinstance(placement_stats, GenerationStats):
+        placement_stats.start(n - done)
+    if progress is not None and done > 0:
+        progress(done, n)
+
+    with manifest, worker_pool(objects, labels, atlas, config) as pool:
+        results = _run_ranges(pool, ranges, control, max_in_flight=2 * max(1, config['num_workers']))
+        for id_range, stats in results:
+            manifest.commit(id_range)
+            done += id_range[1] - id_range[0]
+            if placement_stats is not None:
+                placement_stats.merge(stats)
+            if progress is not None:
+                progress(done, n)
+
+        # What finalize builds from stays until the manifest is final, so a resume after
+        # a crash in between can finalize again
+        writer.finalize(config['output_directory'], config)
+        manifest.finalize()
+    writer.cleanup(config['output_directory'], config)
+    if config['cache_dir'] is not None:
+        evict(config['cache_dir'], int(config['cache_max_gb'] * 2**30))
+
+    return config
+
+def parse_args(argv = None):
+    """
+    Definition:
+    Parses the command line of the headless generator into a generation config
+
+    Parameters:
+    argv (list) : command line arguments, sys.argv[1:] when None
+
+    Returns:
+    config (dict) : generation config for generate_dataset
+    """
+    parser = argparse.ArgumentParser(description="Generate an MNIST object detection dataset")
+    parser.add_argument('output_directory', help="directory the dataset is written to")
+    parser.add_argument('--size', dest='dataset_size', type=int, default=DEFAULT_CONFIG['dataset_size'], help="number of images")
+    parser.add_argument('--image-height', type=int, default=DEFAULT_CONFIG['image_size'][0])
+    parser.add_argument('--image-width', type=int, default=DEFAULT_CONFIG['image_size'][1])
+    parser.add_argument('--noise-intensity', type=int, default=DEFAULT_CONFIG['noise_intensity'])
+    parser.add_argument('--noise-type', choices=list(NOISE_TYPES), default=DEFAULT_CONFIG['noise_type'],
+                        help="background noise family")
+    parser.add_argument('--noise-bank-mb', type=float, default=DEFAULT_CONFIG['noise_bank_mb'],
+                        help="MiB of precomputed noise shared by the workers that backgrounds are cut from, 0 generates every background")
+    parser.add_argument('--grid-rows', type=int, default=DEFAULT_CONFIG['grid_rows'])
+    parser.add_argument('--grid-cols', type=int, default=DEFAULT_CONFIG['grid_cols'])
+    parser.add_argument('--max-objects', type=int, default=DEFAULT_CONFIG['max_objects'],
+                        help="exclusive upper limit of objects per image, at most grid rows * cols + 1")
+    parser.add_argument('--min-objects', type=int, default=DEFAULT_CONFIG['min_objects'],
+                        help="inclusive lower limit of objects per image, below --max-objects")
+    parser.add_argument('--max-retries', type=int, default=DEFAULT_CONFIG['max_retries'],
+                        help="placements retried per object rejected for overlapping")
+    parser.add_argument('--max-scaling', type=float, default=DEFAULT_CONFIG['max_scaling'])
+    parser.add_argument('--gridlines', dest='add_gridlines', action='store_true', help="draw the image grid")
+    parser.add_argument('--allow-overlap', action='store_true', help="keep objects that overlap")
+    parser.add_argument('--blend', dest='blend_mode', choices=list(BLEND_MODES), default=DEFAULT_CONFIG['blend_mode'],
+                        help="how overlapping digits and the background are combined")
+    parser.add_argument('--center-coordinates', action='store_true', help="write center, width, height labels")
+    parser.add_argument('--seed', type=int, default=DEFAULT_CONFIG['seed'], help="dataset seed, random when omitted")
+    parser.add_argument('--workers', dest='num_workers', type=int, default=DEFAULT_CONFIG['num_workers'], help="worker processes, all cores when omitted")
+    parser.add_argument('--format', dest='output_format', choices=list(OUTPUT_FORMATS), default=DEFAULT_CONFIG['output_format'],
+                        help="images/ + labels/ files, WebDataset tar shards, packed binary shards or raw .npy arrays")
+    parser.add_argument('--annotations', dest='annotation_formats', nargs='+', choices=list(ANNOTATION_WRITERS),
+                        default=DEFAULT_CONFIG['annotation_formats'], help="annotation formats of the yolo layout")
+    parser.add_argument('--grid-targets', action='store_true',
+                        help="store S x S x (5 + C) YOLO grid targets of the image grid (tar, packed and raw formats)")
+    parser.add_argument('--anchors', nargs='+', type=lambda pair: [float(value) for value in pair.split(',')],
+                        default=DEFAULT_CONFIG['anchors'], metavar='W,H',
+                        help="anchor sizes as fractions of the image, grid targets get one slot per anchor")
+    parser.add_argument('--shard-size', type=int, default=DEFAULT_CONFIG['shard_size'], help="images per shard")
+    parser.add_argument('--writer-threads', type=int, default=DEFAULT_CONFIG['writer_threads'],
+                        help="threads encoding and writing images per worker, 0 writes synchronously")
+    parser.add_argument('--mnist-path', default=DEFAULT_CONFIG['mnist_path'], help="mnist.npz or directory with MNIST")
+    parser.add_argument('--mmap', action='store_true', help="memory-map MNIST")
+    parser.add_argument('--cache-dir', default=DEFAULT_CONFIG['cache_dir'],
+                        help="generation cache directory, images of earlier runs with the same seed and settings are reused")
+    parser.add_argument('--cache-max-gb', type=float, default=DEFAULT_CONFIG['cache_max_gb'],
+                        help="size of the generation cache, least recently used images are evicted beyond it")
+    parser.add_argument('--resume', action='store_true',
+                        help="continue an interrupted run in output_directory from its manifest, with the same settings")
+    parser.add_argument('--stats', dest='instrument', action='store_true',
+                        help="time the generation stages and log throughput, bytes written and stage times")
+    args = vars(parser.parse_args(argv))
+
+    args['image_size'] = (args.pop('image_height'), args.pop('image_width'))
+    args['corner_coordinates'] = not args.pop('center_coordinates')
+
+    return args
+
+def main(argv = None):
+    config = parse_args(argv)
+    if config['instrument']:
+        placement_stats = GenerationStats()
+        progress = terminal_progress(interval=10.0, stats=placement_stats)
+    else:
+        placement_stats = PlacementStats()
+        progress = terminal_progress()
+
+    config = generate_dataset(config, progress=progress, placement_stats=placement_stats)
+    print(f"Dataset written to {config['output_directory']} (seed {config['seed']})")
+    print(placement_stats)
+
+if __name__ == "__main__":
+    main()
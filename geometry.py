@@ -0,0 +1,233 @@
+import numpy as np
+
+# Array-native bounding box geometry. Every function takes boxes as (..., 4)
+# arrays, a single box being the (4,) case, in either coordinate system:
+#   corner : [x_min, y_min, x_max, y_max]
+#   center : [center_x, center_y, width, height]
+# Coordinates are pixels unless stated otherwise; normalize / denormalize move
+# between pixels and fractions of the image size.
+
+def to_center(boxes):
+    """
+    Definition:
+    Converts corner boxes to center, width, height boxes
+
+    Parameters:
+    boxes (np.array) : (..., 4) corner boxes
+
+    Returns:
+    boxes (np.array) : (..., 4) float center boxes
+    """
+    boxes = np.asarray(boxes, dtype=float)
+    width = boxes[..., 2] - boxes[..., 0]
+    height = boxes[..., 3] - boxes[..., 1]
+
+    return np.stack([boxes[..., 0] + width / 2,
+                     boxes[..., 1] + height / 2,
+                     width,
+                     height], axis=-1)
+
+def to_corner(boxes):
+    """
+    Definition:
+    Converts center, width, height boxes to corner boxes
+
+    Parameters:
+    boxes (np.array) : (..., 4) center boxes
+
+    Returns:
+    boxes (np.array) : (..., 4) float corner boxes
+    """
+    boxes = np.asarray(boxes, dtype=float)
+    half_width = boxes[..., 2] / 2
+    half_height = boxes[..., 3] / 2
+
+    return np.stack([boxes[..., 0] - half_width,
+                     boxes[..., 1] - half_height,
+                     boxes[..., 0] + half_width,
+                     boxes[..., 1] + half_height], axis=-1)
+
+def as_corner(boxes,
+              corner_coordinates=True):
+    """
+    Definition:
+    Returns boxes of either coordinate system as corner boxes
+
+    Parameters:
+    boxes (np.array)          : (..., 4) boxes
+    corner_coordinates (bool) : defines what bbox coordinate system boxes are in
+
+    Returns:
+    boxes (np.array) : (..., 4) corner boxes
+    """
+    return np.asarray(boxes) if corner_coordinates else to_corner(boxes)
+
+def normalize(boxes,
+              image_shape):
+    """
+    Definition:
+    Divides pixel boxes (either coordinate system) by the image size
+
+    Parameters:
+    boxes (np.array)          : (..., 4) pixel boxes
+    image_shape ((int , int)) : height and width of the image
+
+    Returns:
+    boxes (np.array) : (..., 4) float boxes in fractions of the image size
+    """
+    height, width = image_shape[:2]
+    return np.asarray(boxes) / np.array([width, height, width, height], dtype=float)
+
+def denormalize(boxes,
+                image_shape):
+    """
+    Definition:
+    Multiplies normalized boxes (either coordinate system) by the image size
+
+    Parameters:
+    boxes (np.array)          : (..., 4) boxes in fractions of the image size
+    image_shape ((int , int)) : height and width of the image
+
+    Returns:
+    boxes (np.array) : (..., 4) float pixel boxes
+    """
+    height, width = image_shape[:2]
+    return np.asarray(boxes) * np.array([width, height, width, height], dtype=float)
+
+def clip(boxes,
+         image_shape):
+    """
+    Definition:
+    Clips corner boxes to the image
+
+    Parameters:
+    boxes (np.array)          : (..., 4) pixel corner boxes
+    image_shape ((int , int)) : height and width of the image
+
+    Returns:
+    boxes (np.array) : (..., 4) corner boxes inside [0, width] x [0, height]
+    """
+    height, width = image_shape[:2]
+    return np.clip(boxes, 0, np.array([width, height, width, height]))
+
+def area(boxes):
+    """
+    Definition:
+    Computes the area of corner boxes, empty boxes have area 0
+
+    Parameters:
+    boxes (np.array) : (..., 4) corner boxes
+
+    Returns:
+    area (np.array) : (...) box areas
+    """
+    boxes = np.asarray(boxes)
+    return (np.maximum(boxes[..., 2] - boxes[..., 0], 0) *
+            np.maximum(boxes[..., 3] - boxes[..., 1], 0))
+
+def overlap_matrix(boxes1,
+                   boxes2):
+    """
+    Definition:
+    Pairwise overlap test of corner boxes. Boxes are closed intervals, boxes that
+    only touch overlap.
+
+    Parameters:
+    boxes1 (np.array) : (N, 4) corner boxes
+    boxes2 (np.array) : (M, 4) corner boxes
+
+    Returns:
+    overlap (np.array) : (N, M) bool array, True where the boxes overlap
+    """
+    boxes1 = np.asarray(boxes1)[:, None, :]
+    boxes2 = np.asarray(boxes2)[None, :, :]
+
+    return ~((boxes1[..., 2] < boxes2[..., 0]) | (boxes2[..., 2] < boxes1[..., 0]) |
+             (boxes1[..., 3] < boxes2[..., 1]) | (boxes2[..., 3] < boxes1[..., 1]))
+
+def intersection_matrix(boxes1,
+                        boxes2):
+    """
+    Definition:
+    Pairwise intersection areas of corner boxes
+
+    Parameters:
+    boxes1 (np.array) : (N, 4) corner boxes
+    boxes2 (np.array) : (M, 4) corner boxes
+
+    Returns:
+    intersection (np.array) : (N, M) float intersection areas
+    """
+    boxes1 = np.asarray(boxes1, dtype=float)[:, None, :]
+    boxes2 = np.asarray(boxes2, dtype=float)[None, :, :]
+
+    width = np.minimum(boxes1[..., 2], boxes2[..., 2]) - np.maximum(boxes1[..., 0], boxes2[..., 0])
+    height = np.minimum(boxes1[..., 3], boxes2[..., 3]) - np.maximum(boxes1[..., 1], boxes2[..., 1])
+
+    return np.maximum(width, 0) * np.maximum(height, 0)
+
+def iou_matrix(boxes1,
+               boxes2):
+    """
+    Definition:
+    Pairwise intersection over union of corner boxes
+
+    Parameters:
+    boxes1 (np.array) : (N, 4) corner boxes
+    boxes2 (np.array) : (M, 4) corner boxes
+
+    Returns:
+    iou (np.array) : (N, M) float IoU, 0 where both boxes are empty
+    """
+    intersection = intersection_matrix(boxes1, boxes2)
+    union = area(np.asarray(boxes1, dtype=float))[:, None] + area(np.asarray(boxes2, dtype=float))[None, :] - intersection
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(union > 0, intersection / union, 0.0)
+
+def iou(boxes1,
+        boxes2):
+    """
+    Definition:
+    Element-wise intersection over union of paired corner boxes
+
+    Parameters:
+    boxes1 (np.array) : (..., 4) corner boxes
+    boxes2 (np.array) : (..., 4) corner boxes, broadcast against boxes1
+
+    Returns:
+    iou (np.array) : (...) float IoU, 0 where both boxes are empty
+    """
+    boxes1 = np.asarray(boxes1, dtype=float)
+    boxes2 = np.asarray(boxes2, dtype=float)
+
+    width = np.minimum(boxes1[..., 2], boxes2[..., 2]) - np.maximum(boxes1[..., 0], boxes2[..., 0])
+    height = np.minimum(boxes1[..., 3], boxes2[..., 3]) - np.maximum(boxes1[..., 1], boxes2[..., 1])
+    intersection = np.maximum(width, 0) * np.maximum(height, 0)
+    union = area(boxes1) + area(boxes2) - intersection
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(union > 0, intersection / union, 0.0)
+
+def pixel_boxes(objects):
+    """
+    Definition:
+    Locates the pixel bounding box of the non-zero pixels of every image in a stack
+
+    Parameters:
+    objects (np.array) : (N, H, W) array of images
+
+    Returns:
+    boxes (np.array) : (N, 4) int array of pixel [x_min, y_min, x_max, y_max],
+                       the boxes are inclusive of their max edge
+    """
+    rows = objects.any(axis=2)
+    cols = objects.any(axis=1)
+
+    # First and last occupied row / column of every image
+    y_min = rows.argmax(axis=1)
+    y_max = rows.shape[1] - 1 - rows[:, ::-1].argmax(axis=1)
+    x_min = cols.argmax(axis=1)
+    x_max = cols.shape[1] - 1 - cols[:, ::-1].argmax(axis=1)
+
+    return np.stack([x_min, y_min, x_max, y_max], axis=1)
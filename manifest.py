@@ -0,0 +1,204 @@
+import os
+import json
+import bisect
+
+# Progress log of a generation run, kept in the output directory. The first line
+# holds the generation config, then every id range appends one line once all of
+# its files are written, and a last line marks the run finalized:
+#   {"version": 1, "config": {...}}
+#   {"start": 0, "stop": 1000}
+#   ...
+#   {"finalized": true}
+# Lines are only appended and synced one by one, so after a crash the file holds
+# every committed range and at most one torn line, which is ignored.
+MANIFEST_FILE = 'manifest.jsonl'
+MANIFEST_VERSION = 1
+# Config keys a run can be resumed with other values of: they change how the dataset
+# is generated, not what is written
+RUN_KEYS = ('output_directory', 'num_workers', 'start_method', 'writer_threads', 'mnist_path', 'mmap',
+            'instrument', 'cache_dir', 'cache_max_gb', 'cache_key', 'resume')
+
+def _normalize(config):
+    """Config as it reads back from JSON, tuples become lists"""
+    return json.loads(json.dumps(config, default=str))
+
+class Manifest:
+    """
+    Definition:
+    Append-only manifest of the id ranges of a dataset that are completely written,
+    see MANIFEST_FILE. A new run starts it with start, a resumed run loads it and
+    continues it with resume; commit appends a range.
+
+    Parameters:
+    directory (str) : output directory of the dataset
+    """
+    def __init__(self, directory):
+        self.path = os.path.join(directory, MANIFEST_FILE)
+        self.config = None
+        # Committed (start, stop) ranges in the order they completed
+        self.ranges = []
+        self.finalized = False
+        self.file = None
+
+    @classmethod
+    def load(cls, directory):
+        """
+        Definition:
+        Reads the manifest of a dataset, up to a torn last line.
+
+        Parameters:
+        directory (str) : output directory of the dataset
+
+        Returns:
+        manifest (Manifest) : None when the directory has no manifest with a complete first line
+        """
+        manifest = cls(directory)
+        try:
+            with open(manifest.path, 'rb') as f:
+                lines = f.read().splitlines(keepends=True)
+        except FileNotFoundError:
+            return None
+
+        for line in lines:
+            try:
+                entry = json.loads(line) if line.endswith(b'\n') else None
+            except ValueError:
+                entry = None
+            if entry is None:
+                break
+
+            if 'config' in entry:
+                if entry.get('version') != MANIFEST_VERSION:
+                    raise ValueError(f"{manifest.path} has unsupported version {entry.get('version')}")
+                manifest.config = entry['config']
+            elif 'finalized' in entry:
+                manifest.finalized = True
+            else:
+                manifest.ranges.append((entry['start'], entry['stop']))
+
+        return manifest if manifest.config is not None else None
+
+    def mismatched_keys(self, config):
+        """
+        Definition:
+        Keys outside RUN_KEYS whose values differ between the manifest and a config,
+        a run can only be resumed with a config without any.
+
+        Parameters:
+        config (dict) : complete generation config of the resumed run
+
+        Returns:
+        keys (list) : the differing keys
+        """
+        config = _normalize(config)
+        return sorted(key for key in set(config) | set(self.config)
+                      if key not in RUN_KEYS and config.get(key) != self.config.get(key))
+
+    def start(self, config):
+        """
+        Definition:
+        Starts the manifest of a new run, replacing an existing one.
+
+        Parameters:
+        config (dict) : complete generation config
+        """
+        self.config = _normalize(config)
+        self.ranges = []
+        self.finalized = False
+        self.file = open(self.path, 'w')
+        self._append({'version' : MANIFEST_VERSION, 'config' : self.config})
+
+    def resume(self, config, ranges):
+        """
+        Definition:
+        Continues a loaded manifest with only the given committed ranges. The manifest
+        is rewritten once (atomically) with the config of the resumed run, dropping a
+        torn line and the ranges left out, and further commits are appended.
+
+        Parameters:
+        config (dict) : complete generation config of the resumed run
+        ranges (list) : committed (start, stop) ranges that are kept
+        """
+        self.config = _normalize(config)
+        self.ranges = list(ranges)
+        with open(self.path + '.tmp', 'w') as f:
+            f.write(json.dumps({'version' : MANIFEST_VERSION, 'config' : self.config}) + '\n')
+            for start, stop in self.ranges:
+                f.write(json.dumps({'start' : start, 'stop' : stop}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.path + '.tmp', self.path)
+        self.file = open(self.path, 'a')
+
+    def commit(self, id_range):
+        """
+        Definition:
+        Records an id range whose files are completely written.
+
+        Parameters:
+        id_range ((int , int)) : start and stop image id
+        """
+        start, stop = id_range
+        self.ranges.append((start, stop))
+        self._append({'start' : start, 'stop' : stop})
+
+    def finalize(self):
+        """
+        Definition:
+        Marks the dataset complete, called after the writer's finalize.
+        """
+        self.finalized = True
+        self._append({'finalized' : True})
+
+    def _append(self, entry):
+        self.file.write(json.dumps(entry) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def remaining_ranges(ranges,
+                     completed):
+    """
+    Definition:
+    Removes the completed ids from id ranges
+
+    Parameters:
+    ranges (list)    : (start, stop) id ranges of a run
+    completed (list) : (start, stop) ranges already written, in any order
+
+    Returns:
+    ranges (list) : (start, stop) pieces of ranges holding no completed id, in order
+    """
+    # Merge the completed ranges into sorted disjoint intervals
+    merged = []
+    for start, stop in sorted(completed):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], stop)
+        else:
+            merged.append([start, stop])
+    starts = [start for start, _ in merged]
+
+    remaining = []
+    for start, stop in ranges:
+        position = start
+        index = max(bisect.bisect_right(starts, start) - 1, 0)
+        while position < stop and index < len(merged) and merged[index][0] < stop:
+            done_start, done_stop = merged[index]
+            if done_start > position:
+                remaining.append((position, done_start))
+            position = max(position, done_stop)
+            index += 1
+        if position < stop:
+            remaining.append((position, stop))
+
+    return remaining
@@ -0,0 +1,149 @@
+import threading
+
+class PreviewGallery:
+    """
+    Definition:
+    Pages through previews that are rendered ahead of time on a background thread.
+    Previews belong to one set of parameters: set_params with different parameters
+    drops every preview and the thread starts over, so paging never shows a preview
+    of outdated inputs. The thread keeps up to prefetch previews ready after the one
+    shown, so next() returns at once unless paging outruns the rendering.
+
+    Parameters:
+    render (callable)   : render(params) returns one preview, called on the background thread
+    prefetch (int)      : number of previews rendered ahead of the one shown
+    history (int)       : number of previews kept before the one shown for previous()
+    on_ready (callable) : called on the background thread after every rendered preview
+    on_error (callable) : on_error(exception) called on the background thread when render
+                          raises, rendering then stops until the next set_params
+    """
+    def __init__(self, render, prefetch = 8, history = 32, on_ready = None, on_error = None):
+        self.render = render
+        self.prefetch = prefetch
+        self.history = history
+        self.on_ready = on_ready
+        self.on_error = on_error
+        self.condition = threading.Condition()
+        self.params = None
+        # Shown and prefetched previews of params, previews[current] is shown
+        self.previews = []
+        self.current = -1
+        # Incremented whenever the previews are dropped, renders of older versions are discarded
+        self.version = 0
+        self.closed = False
+        self.thread = None
+
+    def set_params(self, params):
+        """
+        Definition:
+        Sets the parameters of the previews, starting the background thread on first use.
+        Previews of other parameters are dropped.
+        """
+        with self.condition:
+            if params != self.params:
+                self.params = params
+                self.previews = []
+                self.current = -1
+                self.version += 1
+                self.condition.notify_all()
+
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._prefetch, daemon=True)
+                self.thread.start()
+
+    def invalidate(self):
+        """
+        Definition:
+        Drops every preview and stops rendering until set_params is called again.
+        """
+        with self.condition:
+            self.params = None
+            self.previews = []
+            self.current = -1
+            self.version += 1
+
+    def close(self):
+        """
+        Definition:
+        Stops the background thread.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def next(self):
+        """
+        Definition:
+        Moves to the next preview.
+
+        Returns:
+        preview : the next preview, None when it is not rendered yet
+        """
+        with self.condition:
+            if self.current + 1 >= len(self.previews):
+                return None
+
+            self.current += 1
+            # Forget the oldest previews beyond history
+            drop = max(self.current - self.history, 0)
+            del self.previews[:drop]
+            self.current -= drop
+
+            self.condition.notify_all()
+            return self.previews[self.current]
+
+    def previous(self):
+        """
+        Definition:
+        Moves to the previous preview.
+
+        Returns:
+        preview : the previous preview, None at the first kept preview
+        """
+        with self.condition:
+            if self.current <= 0:
+                return None
+
+            self.current -= 1
+            return self.previews[self.current]
+
+    @property
+    def ready(self):
+        """
+        Number of rendered previews after the one shown.
+        """
+        with self.condition:
+            return len(self.previews) - self.current - 1
+
+    def _wanted(self):
+        return (self.params is not None and
+                len(self.previews) - self.current - 1 < self.prefetch)
+
+    def _prefetch(self):
+        while True:
+            with self.condition:
+                while not self.closed and not self._wanted():
+                    self.condition.wait()
+                if self.closed:
+                    return
+                params, version = self.params, self.version
+
+            try:
+                preview = self.render(params)
+            except Exception as error:
+                # Invalid parameters or a failing render, wait for the next set_params
+                with self.condition:
+                    current = version == self.version
+                    if current:
+                        self.params = None
+                if current and self.on_error is not None:
+                    self.on_error(error)
+                continue
+
+            with self.condition:
+                if version != self.version:
+                    continue
+                self.previews.append(preview)
+
+            if self.on_ready is not None:
+                self.on_ready()
@@ -0,0 +1,175 @@
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from generate import *
+from writers import PAD_CLASS
+from targets import grid_targets, target_shape
+
+def _create_batch(id_range, max_boxes, target_kwargs = None):
+    """
+    Definition:
+    Creates the images with ids in [start, stop) in the current worker and packs
+    them into one batch, with the grid targets of the whole batch encoded at once
+    when target_kwargs are given.
+
+    Parameters:
+    id_range ((int , int)) : start and stop image id
+    max_boxes (int)        : number of box rows per image
+    target_kwargs (dict)   : grid_targets keyword arguments, no targets when None
+
+    Returns:
+    images (np.array) : (B, height, width) uint8 images
+    boxes (np.array)  : (B, max_boxes, 5) float32 [class, bbox_norm] rows, padded
+                        with rows of PAD_CLASS
+    targets (np.array) : (B, *targets.target_shape) float32 grid targets, only with
+                         target_kwargs
+    """
+    images, boxes = [], np.full((id_range[1] - id_range[0], max_boxes, 5), PAD_CLASS, dtype=np.float32)
+    for row, image_id in enumerate(range(*id_range)):
+        image, added_objects = create_image_by_id(image_id)
+        labels = added_objects_array(added_objects)[:max_boxes]
+        images.append(image)
+        boxes[row, :len(labels)] = labels
+
+    if target_kwargs is not None:
+        return np.stack(images), boxes, grid_targets(boxes, **target_kwargs)
+
+    return np.stack(images), boxes
+
+def stream_batches(config,
+                   batch_size = 32,
+                   objects = None,
+                   labels = None,
+                   atlas = None,
+                   prefetch = 4,
+                   start_id = 0,
+                   num_batches = None):
+    """
+    Definition:
+    Iterator over batches of images created on the fly, without writing anything
+    to disk. Batches cover consecutive image ids from start_id and every image is
+    seeded from (seed, image id), so a seeded stream equals the dataset
+    generate_dataset would write. Up to prefetch batches are created in the
+    background while the consumer works: by a pool of processes with
+    num_workers > 1, by a thread otherwise.
+
+    Parameters:
+    config (dict)       : generation config, missing keys are taken from DEFAULT_CONFIG
+    batch_size (int)    : number of images per batch
+    objects (np.array)  : all images of MNIST dataset, loaded from config when None
+    labels (np.array)   : all associated classes and bbox labels of MNIST dataset
+    atlas (dict)        : digit atlas of objects, built from labels when None
+    prefetch (int)      : number of batches generated ahead of the consumer
+    start_id (int)      : id of the first image
+    num_batches (int)   : number of batches to yield, endless when None
+
+    Returns:
+    iterator of (images, boxes) : (B, height, width) uint8 images and
+                                  (B, max_objects, 5) float32 padded boxes, followed by
+                                  (B, *targets.target_shape) float32 grid targets with
+                                  config['grid_targets']
+    """
+    config = complete_config(config)
+    objects, labels, atlas = prepare_mnist(config, objects, labels, atlas)
+    max_boxes = config['max_objects']
+    target_kwargs = None
+    if config['grid_targets']:
+        target_kwargs = {'grid_rows'          : config['grid_rows'],
+                         'grid_cols'          : config['grid_cols'],
+                         'corner_coordinates' : config['corner_coordinates'],
+                         'anchors'            : config['anchors']}
+
+    def batch_ranges():
+        batch = 0
+        while num_batches is None or batch < num_batches:
+            start = start_id + batch * batch_size
+            yield (start, start + batch_size)
+            batch += 1
+
+    with worker_pool(objects, labels, atlas, config) as pool:
+        # Without workers one thread creates the batches; create_image_by_id keeps its
+        # random state per image, so the thread shares none with the consumer
+        executor = ThreadPoolExecutor(1) if pool is None else None
+        pending = collections.deque()
+
+        def next_batch():
+            batch = pending.popleft()
+            return batch.result() if executor is not None else batch.get()
+
+        try:
+            for id_range in batch_ranges():
+                if executor is not None:
+                    pending.append(executor.submit(_create_batch, id_range, max_boxes, target_kwargs))
+                else:
+                    pending.append(pool.apply_async(_create_batch, (id_range, max_boxes, target_kwargs)))
+                if len(pending) >= prefetch:
+                    yield next_batch()
+            while pending:
+                yield next_batch()
+        finally:
+            if executor is not None:
+                # A consumer stopping early leaves batches that were never started
+                for batch in pending:
+                    batch.cancel()
+                executor.shutdown()
+
+def tf_dataset(config,
+               batch_size = 32,
+               **stream_kwargs):
+    """
+    Definition:
+    Wraps stream_batches in a tf.data.Dataset
+
+    Parameters:
+    config (dict)        : generation config, missing keys are taken from DEFAULT_CONFIG
+    batch_size (int)     : number of images per batch
+    stream_kwargs (dict) : further keyword arguments of stream_batches
+
+    Returns:
+    dataset (tf.data.Dataset) : dataset of (images, boxes) batches, (images, boxes, targets)
+                                with config['grid_targets']
+    """
+    import tensorflow as tf
+
+    config = complete_config(config)
+    height, width = config['image_size']
+    signature = (tf.TensorSpec((batch_size, height, width), tf.uint8),
+                 tf.TensorSpec((batch_size, config['max_objects'], 5), tf.float32))
+    if config['grid_targets']:
+        shape = target_shape(config['grid_rows'], config['grid_cols'], config['anchors'])
+        signature += (tf.TensorSpec((batch_size,) + shape, tf.float32),)
+
+    return tf.data.Dataset.from_generator(lambda: stream_batches(config, batch_size, **stream_kwargs),
+                                          output_signature=signature)
+
+def torch_dataset(config,
+                  batch_size = 32,
+                  **stream_kwargs):
+    """
+    Definition:
+    Wraps stream_batches in a torch IterableDataset. The dataset yields whole
+    batches and prefetches in its own workers, so use it with
+    DataLoader(dataset, batch_size=None) and the default num_workers=0.
+
+    Parameters:
+    config (dict)        : generation config, missing keys are taken from DEFAULT_CONFIG
+    batch_size (int)     : number of images per batch
+    stream_kwargs (dict) : further keyword arguments of stream_batches
+
+    Returns:
+    dataset (torch.utils.data.IterableDataset) : dataset of (images, boxes) tensor batches,
+                                                 (images, boxes, targets) with config['grid_targets']
+    """
+    import torch
+    from torch.utils.data import IterableDataset
+
+    config = complete_config(config)
+
+    class MNISTDetectionStream(IterableDataset):
+        def __iter__(self):
+            for batch in stream_batches(config, batch_size, **stream_kwargs):
+                yield tuple(torch.from_numpy(array) for array in batch)
+
+    return MNISTDetectionStream()
@@ -0,0 +1,121 @@
+import numpy as np
+
+import geometry
+
+# YOLO style grid targets encoded from [class, bbox_norm] annotation rows. The
+# image is split into grid_rows x grid_cols cells and every object is assigned to
+# the cell holding its box center. Each cell (or each anchor of a cell) holds the
+# channels
+#   [objectness, x offset, y offset, width, height, one-hot class ...]
+# where the offsets are the center within the cell in [0, 1] and width and height
+# are fractions of the image. With anchors, an object goes to the anchor of its
+# cell whose (width, height) has the highest IoU with its box, both centered. A
+# cell (anchor) holding several centers keeps the last of those objects.
+
+# Number of digit classes, the one-hot part of the targets
+NUM_CLASSES = 10
+# Channels before the one-hot class
+BOX_CHANNELS = 5
+
+def target_shape(grid_rows,
+                 grid_cols,
+                 anchors = None,
+                 num_classes = NUM_CLASSES):
+    """
+    Definition:
+    Shape of the grid target tensor of one image
+
+    Parameters:
+    grid_rows (int)    : number of rows of the grid
+    grid_cols (int)    : number of cols of the grid
+    anchors (np.array) : (A, 2) anchor widths and heights as fractions of the image, no anchors when None
+    num_classes (int)  : number of classes
+
+    Returns:
+    shape (tuple) : (grid_rows, grid_cols, 5 + num_classes), with anchors (grid_rows, grid_cols, A, 5 + num_classes)
+    """
+    if anchors is None:
+        return (grid_rows, grid_cols, BOX_CHANNELS + num_classes)
+    return (grid_rows, grid_cols, len(anchors), BOX_CHANNELS + num_classes)
+
+def anchor_ious(sizes,
+                anchors):
+    """
+    Definition:
+    IoU of boxes and anchors sharing one center, the anchor matching criterion
+
+    Parameters:
+    sizes (np.array)   : (N, 2) box widths and heights
+    anchors (np.array) : (A, 2) anchor widths and heights
+
+    Returns:
+    iou (np.array) : (N, A) float IoU
+    """
+    sizes = np.asarray(sizes, dtype=float)
+    anchors = np.asarray(anchors, dtype=float)
+
+    intersection = (np.minimum(sizes[:, None, 0], anchors[None, :, 0]) *
+                    np.minimum(sizes[:, None, 1], anchors[None, :, 1]))
+    union = (sizes[:, 0] * sizes[:, 1])[:, None] + (anchors[:, 0] * anchors[:, 1])[None, :] - intersection
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(union > 0, intersection / union, 0.0)
+
+def grid_targets(labels,
+                 grid_rows,
+                 grid_cols,
+                 corner_coordinates = True,
+                 anchors = None,
+                 num_classes = NUM_CLASSES):
+    """
+    Definition:
+    Encodes annotation rows into grid target tensors, for one image or a batch at once
+
+    Parameters:
+    labels (np.array)         : (..., K, 5) [class, bbox_norm] rows, rows of a negative class
+                                (padding) are skipped
+    grid_rows (int)           : number of rows of the grid
+    grid_cols (int)           : number of cols of the grid
+    corner_coordinates (bool) : defines what bbox coordinate system the labels are in
+    anchors (np.array)        : (A, 2) anchor widths and heights as fractions of the image,
+                                no anchor dimension when None
+    num_classes (int)         : number of classes
+
+    Returns:
+    targets (np.array) : (..., *target_shape(grid_rows, grid_cols, anchors, num_classes)) float32
+    """
+    labels = np.asarray(labels, dtype=np.float32)
+    batch_shape = labels.shape[:-2]
+    labels = labels.reshape((int(np.prod(batch_shape)),) + labels.shape[-2:])
+    num_anchors = 1 if anchors is None else len(anchors)
+
+    targets = np.zeros((len(labels), grid_rows, grid_cols, num_anchors, BOX_CHANNELS + num_classes),
+                       dtype=np.float32)
+
+    image, row = np.nonzero(labels[..., 0] >= 0)
+    rows = labels[image, row]
+    boxes = rows[:, 1:] if not corner_coordinates else geometry.to_center(rows[:, 1:])
+
+    # Cell of every box center, centers on the far image edge belong to the last cell
+    x = boxes[:, 0] * grid_cols
+    y = boxes[:, 1] * grid_rows
+    cell_col = np.clip(x.astype(int), 0, grid_cols - 1)
+    cell_row = np.clip(y.astype(int), 0, grid_rows - 1)
+
+    if anchors is None:
+        anchor = np.zeros(len(rows), dtype=int)
+    else:
+        anchor = anchor_ious(boxes[:, 2:], anchors).argmax(axis=1)
+
+    values = np.zeros((len(rows), BOX_CHANNELS + num_classes), dtype=np.float32)
+    values[:, 0] = 1
+    values[:, 1] = x - cell_col
+    values[:, 2] = y - cell_row
+    values[:, 3:5] = boxes[:, 2:]
+    values[np.arange(len(rows)), BOX_CHANNELS + rows[:, 0].astype(int)] = 1
+
+    targets[image, cell_row, cell_col, anchor] = values
+
+    if anchors is None:
+        targets = targets[..., 0, :]
+    return targets.reshape(batch_shape + targets.shape[1:])
@@ -0,0 +1,33 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# The modules live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import build_bbox_table, build_digit_atlas, bbox_table_to_labels
+
+@pytest.fixture(scope='session')
+def mnist():
+    """
+    Definition:
+    Small stand-in for MNIST, so the tests need no download: every 28x28 image holds
+    one block of random intensities of digit size at a random position.
+
+    Returns:
+    objects (np.array) : (500, 28, 28) uint8 images
+    labels (np.array)  : (500, 5) corner labels of bbox_table_to_labels
+    atlas (dict)       : digit atlas of the images
+    """
+    rng = np.random.RandomState(0)
+    objects = np.zeros((500, 28, 28), dtype=np.uint8)
+    for image in objects:
+        y, x = rng.randint(0, 8, 2)
+        height, width = rng.randint(4, 21, 2)
+        image[y:y + height, x:x + width] = rng.randint(1, 256, (height, width))
+    classes = rng.randint(0, 10, (len(objects), 1)).astype(np.uint8)
+
+    table = build_bbox_table(objects, classes)
+    return objects, bbox_table_to_labels(table, corner_coordinates=True), build_digit_atlas(objects, table)
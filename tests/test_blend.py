@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from blend import BLEND_MODES, NUMPY_KERNELS, blend, numba_kernels
+
+# Every (dst, src) pair of uint8 values
+DST, SRC = (values.astype(np.uint8) for values in np.meshgrid(np.arange(256), np.arange(256), indexing='ij'))
+
+# Definitions of the modes, see blend.py
+REFERENCE = {'max'   : lambda dst, src: np.maximum(dst, src),
+             'alpha' : lambda dst, src: src + np.round(dst * (255 - src) / 255),
+             'add'   : lambda dst, src: np.minimum(dst + src, 255)}
+
+@pytest.mark.parametrize('mode', BLEND_MODES)
+def test_numpy_kernel_matches_definition(mode):
+    dst = DST.copy()
+    NUMPY_KERNELS[mode](dst, SRC)
+    np.testing.assert_array_equal(dst, REFERENCE[mode](DST.astype(np.float64), SRC.astype(np.float64)))
+
+@pytest.mark.parametrize('mode', BLEND_MODES)
+def test_numba_kernel_matches_numpy(mode):
+    pytest.importorskip('numba')
+    numba_dst, numpy_dst = DST.copy(), DST.copy()
+    numba_kernels()[mode](numba_dst, SRC)
+    NUMPY_KERNELS[mode](numpy_dst, SRC)
+    np.testing.assert_array_equal(numba_dst, numpy_dst)
+
+@pytest.mark.parametrize('use_numba', [False, True])
+@pytest.mark.parametrize('mode', BLEND_MODES)
+def test_blend_writes_into_canvas_region(mode, use_numba):
+    if use_numba:
+        pytest.importorskip('numba')
+    rng = np.random.RandomState(0)
+    canvas = rng.randint(0, 256, (40, 50)).astype(np.uint8)
+    src = rng.randint(0, 256, (12, 17)).astype(np.uint8)
+
+    expected = canvas.copy()
+    NUMPY_KERNELS[mode](expected[5:17, 20:37], src)
+    blend(canvas[5:17, 20:37], src, mode=mode, use_numba=use_numba)
+    np.testing.assert_array_equal(canvas, expected)
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        blend(DST.copy(), SRC, mode='screen')
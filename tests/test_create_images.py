@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+from skimage import transform
+
+import blend
+from utils import (atlas_crop, composite_object, create_images, resize_object, resized_shape,
+                   _resize_crops)
+
+class FlatBackground:
+    """Background engine of one gray value, so every object can be traced in the images"""
+    def __init__(self, value):
+        self.value = value
+
+    def draw(self, size, rng = None):
+        return np.full(size, self.value, dtype=np.uint8)
+
+def _atlas(crops):
+    """Digit atlas of a list of crops"""
+    return {'pixels'  : np.concatenate([crop.ravel() for crop in crops]),
+            'offsets' : np.cumsum([0] + [crop.size for crop in crops])[:-1],
+            'shapes'  : np.array([crop.shape for crop in crops])}
+
+def _replay(images, annotations, atlas, background, blend_mode):
+    """
+    Definition:
+    Creates the images again object by object with composite_object, from the boxes
+    of the annotations. The class column of the labels the images were created with
+    holds the digit index.
+
+    Returns:
+    images (np.array) : the replayed images
+    """
+    replayed = np.full(images.shape, background, dtype=np.uint8)
+    height, width = images.shape[1:]
+    for image_index, digit, *box in annotations:
+        x_min, y_min, x_max, y_max = np.round(np.array(box) * [width, height, width, height]).astype(int)
+        crop = atlas_crop(atlas, int(digit))
+        shape = (y_max - y_min, x_max - x_min)
+        # Resized output depends on the output shape only
+        scaled = crop if shape == crop.shape else transform.resize(crop, shape, order=1, mode='constant', cval=0,
+                                                                   anti_aliasing=False, preserve_range=True)
+        composite_object(replayed[int(image_index)], scaled.astype(np.uint8),
+                         (slice(y_min, y_max), slice(x_min, x_max)), blend_mode=blend_mode)
+    return replayed
+
+def test_resize_crops_matches_resize_object():
+    rng = np.random.RandomState(1)
+    crops = []
+    for index in range(120):
+        shape = tuple(rng.randint(1, 29, 2))
+        # Crops with and without zeros, empty and constant crops clip differently
+        fill = [rng.randint(0, 256, shape), rng.randint(1, 256, shape), np.zeros(shape), np.full(shape, 200)][index % 4]
+        crops.append(fill.astype(np.uint8))
+    atlas = _atlas(crops)
+
+    for scale_value in (1.125, 1.5, 2.0, 2.375, 3.0, 4.0):
+        shapes = np.array([resized_shape(crop.shape, scale_value) for crop in crops])
+        resized = _resize_crops(atlas, np.arange(len(crops)), shapes)
+        for crop, (height, width), batch in zip(crops, shapes, resized):
+            np.testing.assert_array_equal(batch[:height, :width], resize_object(crop, scale_value).astype(np.uint8))
+
+@pytest.mark.parametrize('blend_mode', blend.BLEND_MODES)
+@pytest.mark.parametrize('allow_overlap', [False, True])
+def test_create_images_matches_replay(mnist, blend_mode, allow_overlap):
+    objects, labels, atlas = mnist
+    labels = labels.copy()
+    labels[:, 0] = np.arange(len(labels))
+
+    images, annotations = create_images(objects, labels, 40, image_size=(96, 160), atlas=atlas, grid_rows=3,
+                                        grid_cols=5, max_objects=12, min_objects=4, max_scaling=3.0,
+                                        max_retries=2, allow_overlap=allow_overlap, background=FlatBackground(90),
+                                        blend_mode=blend_mode, rng=np.random.RandomState(2), use_numba=False)
+
+    assert len(annotations) >= 40 * 4
+    np.testing.assert_array_equal(images, _replay(images, annotations, atlas, 90, blend_mode))
+
+@pytest.mark.parametrize('blend_mode', blend.BLEND_MODES)
+@pytest.mark.parametrize('allow_overlap', [False, True])
+def test_create_images_numba_matches_numpy(mnist, blend_mode, allow_overlap):
+    pytest.importorskip('numba')
+    objects, labels, atlas = mnist
+    kwargs = dict(image_size=(96, 160), atlas=atlas, max_objects=12, min_objects=4, max_scaling=3.0,
+                  max_retries=2, allow_overlap=allow_overlap, blend_mode=blend_mode, add_gridlines=True)
+
+    numba_images, numba_annotations = create_images(objects, labels, 40, rng=np.random.RandomState(5),
+                                                    use_numba=True, **kwargs)
+    numpy_images, numpy_annotations = create_images(objects, labels, 40, rng=np.random.RandomState(5),
+                                                    use_numba=False, **kwargs)
+
+    np.testing.assert_array_equal(numba_images, numpy_images)
+    np.testing.assert_array_equal(numba_annotations, numpy_annotations)
+
+def test_create_images_empty_batch(mnist):
+    objects, labels, atlas = mnist
+    images, annotations = create_images(objects, labels, 0, image_size=(32, 48), atlas=atlas)
+    assert images.shape == (0, 32, 48)
+    assert annotations.shape == (0, 6)
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from utils import (build_bbox_table, build_digit_atlas, bbox_table_to_labels, labels_to_bbox_table,
+                   create_image)
+from evaluate import (SCALE_BINS, SCALE_STEP, box_table, estimate_scales, evaluate, load_ground_truth,
+                      ground_truth_from_added_objects)
+
+@pytest.fixture(scope='module')
+def mnist_digits():
+    """Digits of MNIST proportions: the longer side of every digit spans 20 pixels"""
+    rng = np.random.RandomState(3)
+    objects = np.zeros((300, 28, 28), dtype=np.uint8)
+    for image in objects:
+        height, width = (20, rng.randint(4, 21)) if rng.rand() < 0.7 else (rng.randint(4, 21), 20)
+        y, x = rng.randint(0, 29 - height), rng.randint(0, 29 - width)
+        image[y:y + height, x:x + width] = rng.randint(1, 256, (height, width))
+    table = build_bbox_table(objects, rng.randint(0, 10, len(objects)))
+    return objects, bbox_table_to_labels(table, corner_coordinates=True), build_digit_atlas(objects, table)
+
+@pytest.mark.parametrize('corner_coordinates', [True, False])
+def test_estimated_scales_match_created_scales(mnist_digits, corner_coordinates):
+    objects, labels, atlas = mnist_digits
+    if not corner_coordinates:
+        labels = bbox_table_to_labels(labels_to_bbox_table(labels, True), corner_coordinates=False)
+    rng = np.random.RandomState(4)
+    # Small regions clamp the scale of large digits to values off the scale step
+    added_objects_list = [create_image(objects, labels, image_size=(160, 128), grid_rows=4, grid_cols=4,
+                                       max_objects=10, max_scaling=4.0, atlas=atlas,
+                                       corner_coordinates=corner_coordinates, rng=rng)[1] for _ in range(150)]
+
+    table = ground_truth_from_added_objects(added_objects_list, corner_coordinates=corner_coordinates)
+    created = table['scales'].copy()
+    table['scales'][:] = np.nan
+    estimated = estimate_scales(table, (160, 128))['scales']
+
+    on_step = created % SCALE_STEP == 0
+    assert on_step.sum() > 300 and (~on_step).any()
+    np.testing.assert_array_equal(estimated[on_step], created[on_step])
+    assert np.abs(estimated - created).max() <= SCALE_STEP / 2
+    np.testing.assert_array_equal(np.digitize(estimated, SCALE_BINS), np.digitize(created, SCALE_BINS))
+
+def test_label_files_get_scales_from_manifest(mnist, tmp_path):
+    from generate import generate_dataset
+
+    objects, labels, atlas = mnist
+    generate_dataset({'output_directory' : str(tmp_path), 'dataset_size' : 12, 'num_workers' : 1,
+                      'image_size' : (64, 96), 'seed' : 1}, objects=objects, labels=labels, atlas=atlas)
+
+    ground_truth = load_ground_truth(str(tmp_path))
+    assert len(ground_truth['images']) == 12
+    assert not np.isnan(ground_truth['scales']).any()
+    assert (ground_truth['scales'] >= 1).all()
+
+def test_num_images_counts_images_without_ground_truth():
+    ground_truth = box_table([0, 1], [2, 3], [[0.1, 0.1, 0.3, 0.3], [0.2, 0.2, 0.4, 0.4]], images=[0, 1, 2])
+    predictions = box_table([0, 3], [2, 7], [[0.1, 0.1, 0.3, 0.3], [0.5, 0.5, 0.6, 0.6]], scores=[0.9, 0.8])
+
+    results = evaluate(ground_truth, predictions)
+    assert results['num_images'] == 4
+    assert results['num_ground_truth'] == 2
+    assert results['recall'] == 0.5
@@ -0,0 +1,168 @@
+import os
+import json
+from xml.etree import ElementTree
+
+import numpy as np
+import pytest
+
+from utils import PlacementStats
+from generate import generate_dataset, GenerationControl, GenerationCancelled
+from manifest import Manifest, MANIFEST_FILE
+from writers import RAW_FILES, CocoAnnotationWriter
+
+CONFIG = {'image_size'  : (64, 96),
+          'grid_rows'   : 4,
+          'grid_cols'   : 4,
+          'max_objects' : 6,
+          'max_scaling' : 2.0,
+          'seed'        : 7}
+
+def _generate(mnist, directory, placement_stats = None, **config):
+    objects, labels, atlas = mnist
+    return generate_dataset({**CONFIG, 'output_directory' : str(directory), **config},
+                            objects=objects, labels=labels, atlas=atlas, placement_stats=placement_stats)
+
+def _files(directory):
+    """Relative path -> contents of every file of a dataset, but the files recording the run config"""
+    files = {}
+    for root, _, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(root, name)
+            if name in (MANIFEST_FILE, RAW_FILES['header']):
+                continue
+            with open(path, 'rb') as f:
+                files[os.path.relpath(path, directory)] = f.read()
+            if name == 'annotations.json':
+                # So does the info of the COCO annotations
+                coco = json.loads(files[os.path.relpath(path, directory)])
+                del coco['info']
+                files[os.path.relpath(path, directory)] = coco
+    return files
+
+@pytest.mark.parametrize('output_format, config', [('yolo', {'annotation_formats' : ['yolo', 'voc', 'coco']}),
+                                                   ('tar', {'shard_size' : 20}),
+                                                   ('packed', {'shard_size' : 20}),
+                                                   ('raw', {})])
+def test_same_dataset_for_any_worker_count(mnist, tmp_path, output_format, config):
+    _generate(mnist, tmp_path / 'serial', dataset_size=48, num_workers=1, output_format=output_format, **config)
+    _generate(mnist, tmp_path / 'pool', dataset_size=48, num_workers=3, output_format=output_format, **config)
+
+    serial = _files(tmp_path / 'serial')
+    assert len(serial) > 1
+    assert serial == _files(tmp_path / 'pool')
+
+@pytest.mark.parametrize('corner_coordinates', [True, False])
+def test_voc_and_coco_boxes_match_yolo_labels(mnist, tmp_path, corner_coordinates):
+    _generate(mnist, tmp_path, dataset_size=16, num_workers=2, annotation_formats=['yolo', 'voc', 'coco'],
+              corner_coordinates=corner_coordinates)
+    height, width = CONFIG['image_size']
+    with open(tmp_path / 'annotations.json') as f:
+        coco = json.load(f)
+
+    coco_boxes = {}
+    for annotation in coco['annotations']:
+        coco_boxes.setdefault(annotation['image_id'], []).append([annotation['category_id']] + annotation['bbox'])
+
+    num_objects = 0
+    for image_id in range(16):
+        # YOLO labels are normalized by the image width and height, VOC and COCO boxes are in pixels
+        yolo_boxes = []
+        for line in (tmp_path / 'labels' / f"{image_id:08d}.txt").read_text().splitlines():
+            class_id, a, b, c, d = line.split()
+            a, b, c, d = float(a) * width, float(b) * height, float(c) * width, float(d) * height
+            if not corner_coordinates:
+                a, b, c, d = a - c / 2, b - d / 2, a + c / 2, b + d / 2
+            yolo_boxes.append([int(class_id), a, b, c, d])
+
+        root = ElementTree.parse(tmp_path / 'Annotations' / f"{image_id:08d}.xml").getroot()
+        assert (int(root.findtext('size/width')), int(root.findtext('size/height'))) == (width, height)
+        voc_boxes = [[int(obj.findtext('name'))] + [float(obj.findtext(f'bndbox/{key}'))
+                                                     for key in ('xmin', 'ymin', 'xmax', 'ymax')]
+                     for obj in root.iter('object')]
+        assert np.array(voc_boxes) == pytest.approx(np.array(yolo_boxes), abs=1e-3)
+
+        coco_corners = [[class_id, x, y, x + w, y + h] for class_id, x, y, w, h in coco_boxes.get(image_id, [])]
+        assert np.array(coco_corners) == pytest.approx(np.array(yolo_boxes), abs=1e-3)
+        num_objects += len(yolo_boxes)
+
+    assert num_objects == len(coco['annotations']) > 0
+
+def test_spawned_workers(mnist, tmp_path):
+    # The start method of the GUI, whose process must not be forked
+    _generate(mnist, tmp_path / 'serial', dataset_size=24, num_workers=1)
+    _generate(mnist, tmp_path / 'spawned', dataset_size=24, num_workers=2, start_method='spawn')
+    assert _files(tmp_path / 'spawned') == _files(tmp_path / 'serial')
+
+def test_resume_after_interruption(mnist, tmp_path):
+    _generate(mnist, tmp_path / 'reference', dataset_size=64, num_workers=1)
+
+    directory = tmp_path / 'resumed'
+    objects, labels, atlas = mnist
+    control = GenerationControl()
+    with pytest.raises(GenerationCancelled):
+        generate_dataset({**CONFIG, 'output_directory' : str(directory), 'dataset_size' : 64, 'num_workers' : 1},
+                         objects=objects, labels=labels, atlas=atlas,
+                         progress=lambda done, total: control.cancel(), control=control)
+
+    manifest = Manifest.load(directory)
+    assert not manifest.finalized
+    committed = sum(stop - start for start, stop in manifest.ranges)
+    assert 0 < committed < 64
+
+    # A crash right after the last commit may have lost its files, the range is written again
+    start, stop = manifest.ranges[-1]
+    os.remove(directory / 'labels' / f"{start:08d}.txt")
+
+    stats = PlacementStats()
+    _generate(mnist, directory, placement_stats=stats, dataset_size=64, num_workers=2, resume=True)
+    assert Manifest.load(directory).finalized
+    assert stats.images == 64 - committed + stop - start
+    assert _files(directory) == _files(tmp_path / 'reference')
+
+class Crash(Exception):
+    pass
+
+def _crash(*args, **kwargs):
+    raise Crash()
+
+@pytest.mark.parametrize('crash_point', ['manifest', 'cleanup'])
+def test_resume_after_crash_while_finalizing(mnist, tmp_path, monkeypatch, crash_point):
+    config = {'dataset_size' : 40, 'num_workers' : 2, 'annotation_formats' : ['yolo', 'coco']}
+    _generate(mnist, tmp_path / 'reference', **config)
+
+    directory = tmp_path / 'resumed'
+    with monkeypatch.context() as patch:
+        # Crash after the COCO annotations are built, before the manifest or the cleanup records it
+        if crash_point == 'manifest':
+            patch.setattr(Manifest, 'finalize', _crash)
+        else:
+            patch.setattr(CocoAnnotationWriter, 'cleanup', _crash)
+        with pytest.raises(Crash):
+            _generate(mnist, directory, **config)
+    assert (directory / CocoAnnotationWriter.parts_directory).is_dir()
+    assert Manifest.load(directory).finalized == (crash_point == 'cleanup')
+
+    stats = PlacementStats()
+    _generate(mnist, directory, placement_stats=stats, resume=True, **config)
+    assert stats.images == 0
+    assert Manifest.load(directory).finalized
+    assert not (directory / CocoAnnotationWriter.parts_directory).exists()
+    assert _files(directory) == _files(tmp_path / 'reference')
+
+def test_resume_without_manifest(mnist, tmp_path):
+    with pytest.raises(ValueError):
+        _generate(mnist, tmp_path, dataset_size=8, num_workers=1, resume=True)
+
+def test_cached_images_equal_fresh_images(mnist, tmp_path):
+    _generate(mnist, tmp_path / 'reference', dataset_size=80, num_workers=1)
+
+    cache_dir = tmp_path / 'cache'
+    # A smaller run leaves chunk prefixes that the next run extends, the last run only reads
+    for dataset_size, expect_hits in ((30, False), (80, True), (80, True)):
+        stats = PlacementStats()
+        _generate(mnist, tmp_path / 'cached', placement_stats=stats, dataset_size=dataset_size,
+                  num_workers=2, cache_dir=str(cache_dir))
+        assert (stats.cached > 0) == expect_hits
+
+    assert stats.cached == 80
+    assert _files(tmp_path / 'cached') == _files(tmp_path / 'reference')
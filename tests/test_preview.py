@@ -0,0 +1,27 @@
+import queue
+
+from preview import PreviewGallery
+
+def test_render_errors_reach_on_error():
+    errors = queue.Queue()
+    def render(params):
+        if params == 'invalid':
+            raise ValueError("invalid literal for int()")
+        return params
+
+    gallery = PreviewGallery(render, prefetch=2, on_error=errors.put)
+    try:
+        gallery.set_params('invalid')
+        error = errors.get(timeout=5)
+        assert isinstance(error, ValueError)
+        # Rendering stops until new parameters are set
+        assert gallery.params is None and gallery.ready == 0
+
+        ready = queue.Queue()
+        gallery.on_ready = lambda: ready.put(True)
+        gallery.set_params('valid')
+        ready.get(timeout=5)
+        assert gallery.next() == 'valid'
+        assert errors.empty()
+    finally:
+        gallery.close()
@@ -0,0 +1,29 @@
+import numpy as np
+
+from utils import GenerationStats, add_object_to_image, create_image
+
+def test_create_image_counts_placements(mnist):
+    objects, labels, atlas = mnist
+    stats = GenerationStats()
+    rng = np.random.RandomState(0)
+    added = sum(len(create_image(objects, labels, image_size=(64, 64), max_objects=8, max_scaling=3.0,
+                                 max_retries=2, atlas=atlas, placement_stats=stats, rng=rng)[1])
+                for _ in range(30))
+
+    assert stats.images == 30
+    assert stats.accepted == added
+    assert stats.attempts == stats.accepted + stats.rejected
+    assert stats.rejected > 0
+
+def test_add_object_to_image_counts_no_placements(mnist):
+    objects, labels, _ = mnist
+    stats = GenerationStats()
+    image = np.zeros((64, 64), dtype=np.uint8)
+    for object_num in range(4):
+        image, _ = add_object_to_image(image, object_num + 1, objects[object_num], labels[object_num], object_num,
+                                       scale_value=1.5, stats=stats)
+
+    # Objects are composited without an overlap test, only create_image accepts placements
+    assert stats.attempts == stats.accepted == 0
+    assert stats.resizes == 4
+    assert stats.timers['composite'] > 0
@@ -0,0 +1,110 @@
+import os
+import time
+import threading
+
+import numpy as np
+import pytest
+
+from generate import generate_dataset
+from writers import AsyncWriter, DatasetWriter
+
+class RecordingWriter(DatasetWriter):
+    """
+    Definition:
+    In-memory writer: stores every payload, optionally waiting for an event first
+    and failing on one image id.
+    """
+    def __init__(self, ordered = False, release = None, fail_id = None):
+        super().__init__(None, (0, 0), {})
+        self.ordered = ordered
+        self.release = release
+        self.fail_id = fail_id
+        self.stored = []
+        self.closed = self.aborted = False
+
+    def encode(self, image_id, image, added_objects):
+        return f"{image_id}".encode()
+
+    def store(self, image_id, payload):
+        if self.release is not None:
+            self.release.wait()
+        if image_id == self.fail_id:
+            raise OSError(f"disk full at {image_id}")
+        self.stored.append(image_id)
+
+    def close(self):
+        self.closed = True
+
+    def abort(self):
+        self.aborted = True
+
+def _shards(directory):
+    """File name -> contents of the shard files of a dataset"""
+    shards = {}
+    for name in sorted(os.listdir(directory)):
+        if name.startswith('shard-'):
+            with open(os.path.join(directory, name), 'rb') as f:
+                shards[name] = f.read()
+    return shards
+
+@pytest.mark.parametrize('output_format', ['tar', 'packed'])
+def test_async_shards_equal_synchronous_shards(mnist, tmp_path, output_format):
+    objects, labels, atlas = mnist
+    for writer_threads in (0, 4):
+        generate_dataset({'output_directory' : str(tmp_path / str(writer_threads)), 'output_format' : output_format,
+                          'dataset_size' : 50, 'shard_size' : 20, 'image_size' : (64, 64), 'seed' : 3,
+                          'num_workers' : 1, 'writer_threads' : writer_threads},
+                         objects=objects, labels=labels, atlas=atlas)
+
+    shards = _shards(tmp_path / '0')
+    assert len(shards) >= 3
+    assert shards == _shards(tmp_path / '4')
+
+@pytest.mark.parametrize('ordered', [False, True])
+def test_async_writer_bounds_images_in_flight(ordered):
+    release = threading.Event()
+    inner = RecordingWriter(ordered=ordered, release=release)
+    writer = AsyncWriter(inner, num_threads=2)
+    image = np.zeros((4, 4), dtype=np.uint8)
+
+    handed_over = []
+    def produce():
+        for image_id in range(20):
+            writer.write(image_id, image, {})
+            handed_over.append(image_id)
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+
+    # Stores are blocked, so write() returns for 4 * num_threads images and then waits
+    deadline = time.monotonic() + 5
+    while len(handed_over) < 8 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.2)
+    assert len(handed_over) == 8
+
+    release.set()
+    producer.join(5)
+    writer.close()
+    assert len(handed_over) == 20
+    assert sorted(inner.stored) == list(range(20))
+    assert inner.stored == list(range(20)) or not ordered
+    assert inner.closed and not inner.aborted
+    assert writer.bytes_written == sum(len(str(image_id)) for image_id in range(20))
+
+@pytest.mark.parametrize('ordered', [False, True])
+@pytest.mark.parametrize('num_images', [6, 1000])
+def test_async_writer_raises_first_error_and_aborts(ordered, num_images):
+    inner = RecordingWriter(ordered=ordered, fail_id=5)
+    image = np.zeros((4, 4), dtype=np.uint8)
+
+    # With 6 images the error surfaces in close(), with more in a later write()
+    with pytest.raises(OSError, match='disk full at 5'):
+        with AsyncWriter(inner, num_threads=4) as writer:
+            for image_id in range(num_images):
+                writer.write(image_id, image, {})
+                if image_id >= 5:
+                    time.sleep(0.001)
+
+    assert inner.aborted and not inner.closed
+    assert 5 not in inner.stored
+    assert len(inner.stored) < num_images
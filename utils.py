@@ -1,28 +1,143 @@
-import tensorflow as tf
 import numpy as np
-import matplotlib.pyplot as plt
-import cv2
 import random
-from skimage import transform
 import os
-from tqdm import tqdm
 import math
-import copy
+import hashlib
+import gzip
+import struct
+import urllib.request
+import functools
+import time
+from collections import OrderedDict
 
-def load_mnist():
+import geometry
+import blend
+
+# Heavy optional libraries (cv2, skimage) are imported inside the functions that
+# use them so importing utils, e.g. in every worker process, stays cheap.
+
+# Side length of the square MNIST digit images
+MNIST_IMAGE_SIZE = 28
+# Default location for preprocessed MNIST caches (bbox tables, ...)
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'mnist_object_detection')
+# Where MNIST is looked for when no explicit path is given, in order
+MNIST_SEARCH_DIRS = [CACHE_DIR, os.path.join(os.path.expanduser('~'), '.keras', 'datasets')]
+MNIST_URL = 'https://storage.googleapis.com/tensorflow/tf-keras-datasets/mnist.npz'
+# Raw IDX file names of the original MNIST distribution (optionally .gz)
+MNIST_IDX_FILES = {'x_train' : 'train-images-idx3-ubyte',
+                   'y_train' : 'train-labels-idx1-ubyte',
+                   'x_test'  : 't10k-images-idx3-ubyte',
+                   'y_test'  : 't10k-labels-idx1-ubyte'}
+# Pixels create_images handles at once (noise, resized crops), bounds its temporaries
+BATCH_CHUNK_PIXELS = 1 << 20
+
+def read_idx(path,
+             mmap=False):
+    """
+    Definition:
+    Reads an array stored in the IDX format of the original MNIST distribution.
+    Gzipped files are decompressed in memory; plain files can be memory-mapped.
+
+    Parameters:
+    path (str)  : path to the IDX file (optionally ending in .gz)
+    mmap (bool) : memory-map the file read-only instead of reading it
+
+    Returns:
+    data (np.array) : uint8 array with the shape stored in the IDX header
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        _, dtype_code, ndim = struct.unpack('>HBB', f.read(4))
+        if dtype_code != 0x08:
+            raise ValueError(f"{path} does not hold unsigned byte data")
+        shape = struct.unpack('>' + 'I' * ndim, f.read(4 * ndim))
+
+        if mmap and opener is open:
+            return np.memmap(path, dtype=np.uint8, mode='r', offset=4 + 4 * ndim, shape=shape)
+        return np.frombuffer(f.read(), dtype=np.uint8).reshape(shape)
+
+def find_mnist(path=None):
+    """
+    Definition:
+    Locates a local copy of MNIST. Accepts either an mnist.npz file or a directory
+    holding mnist.npz or the four raw IDX files. Without a path, MNIST_SEARCH_DIRS
+    are searched and mnist.npz is downloaded into CACHE_DIR if nothing is found.
+
+    Parameters:
+    path (str) : mnist.npz file or directory containing MNIST
+
+    Returns:
+    source (str or dict) : path of mnist.npz, or dict of IDX paths keyed like MNIST_IDX_FILES
+    """
+    if path is not None and os.path.isfile(path):
+        return path
+
+    search_dirs = [path] if path is not None else MNIST_SEARCH_DIRS
+    for directory in search_dirs:
+        npz_path = os.path.join(directory, 'mnist.npz')
+        if os.path.isfile(npz_path):
+            return npz_path
+
+        idx_paths = {}
+        for key, name in MNIST_IDX_FILES.items():
+            for candidate in (name, name + '.gz'):
+                if os.path.isfile(os.path.join(directory, candidate)):
+                    idx_paths[key] = os.path.join(directory, candidate)
+                    break
+        if len(idx_paths) == len(MNIST_IDX_FILES):
+            return idx_paths
+
+    if path is not None:
+        raise FileNotFoundError(f"No mnist.npz or MNIST IDX files found at {path}")
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    npz_path = os.path.join(CACHE_DIR, 'mnist.npz')
+    urllib.request.urlretrieve(MNIST_URL, npz_path)
+    return npz_path
+
+def load_mnist(path=None,
+               mmap=False):
     """
     Definition:
     Loads MNIST data and concatenates train and test sets into singular
-    outputs
+    outputs. Reads mnist.npz or the raw IDX files directly (see find_mnist).
+    With mmap the concatenated arrays are written once to CACHE_DIR as .npy files
+    and memory-mapped read-only, so several processes share one page-cached copy.
+
+    Parameters:
+    path (str)  : mnist.npz file or directory containing MNIST
+    mmap (bool) : return read-only memory-mapped arrays
 
     Returns: 
     X (np.array) : Array of 28 x 28 images
     Y (np.array) : Class labels withe expanded dim.
     """
-    mnist = tf.keras.datasets.mnist
-    (x_train, y_train), (x_test, y_test) = mnist.load_data()
-    X = np.concatenate([x_train, x_test], axis=0)
-    Y = np.concatenate([y_train, y_test], axis=0)
+    source = find_mnist(path)
+
+    if mmap:
+        source_files = sorted(source.values()) if isinstance(source, dict) else [source]
+        key = hashlib.blake2b(digest_size=8)
+        for source_file in source_files:
+            key.update(f"{os.path.abspath(source_file)}:{os.path.getsize(source_file)}".encode())
+        x_path = os.path.join(CACHE_DIR, f"mnist_{key.hexdigest()}_x.npy")
+        y_path = os.path.join(CACHE_DIR, f"mnist_{key.hexdigest()}_y.npy")
+
+        if not (os.path.exists(x_path) and os.path.exists(y_path)):
+            X, Y = load_mnist(path=path, mmap=False)
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            np.save(x_path, X)
+            np.save(y_path, Y)
+
+        return np.load(x_path, mmap_mode='r'), np.load(y_path, mmap_mode='r')
+
+    if isinstance(source, dict):
+        arrays = {key : read_idx(idx_path) for key, idx_path in source.items()}
+    else:
+        with np.load(source) as npz:
+            arrays = {key : npz[key] for key in MNIST_IDX_FILES}
+
+    X = np.concatenate([arrays['x_train'], arrays['x_test']], axis=0)
+    Y = np.concatenate([arrays['y_train'], arrays['y_test']], axis=0)
     Y = np.expand_dims(Y, -1)
 
     return X, Y
@@ -42,12 +157,7 @@ def to_center_coordinates(x_min, y_min, x_max, y_max):
     Returns:
     list: [center_x, center_y, width, height]
     """
-    width = x_max - x_min
-    height = y_max - y_min
-    center_x = x_min + width / 2
-    center_y = y_min + height / 2
-    
-    return [center_x, center_y, width, height]
+    return geometry.to_center([x_min, y_min, x_max, y_max]).tolist()
 
 def to_corner_coordinates(center_x, center_y, width, height):
     """
@@ -64,12 +174,7 @@ def to_corner_coordinates(center_x, center_y, width, height):
     Returns:
     list: [x_min, y_min, x_max, y_max]
     """
-    x_min = center_x - width / 2
-    y_min = center_y - height / 2
-    x_max = center_x + width / 2
-    y_max = center_y + height / 2
-    
-    return [x_min, y_min, x_max, y_max]
+    return geometry.to_corner([center_x, center_y, width, height]).tolist()
 
 def find_bbox(object, 
               corner_coordinates=True):
@@ -87,23 +192,407 @@ def find_bbox(object,
     or
     np.array : [center_x, center_y, width, height]
     """
-    # Find the non-zero pixels
-    coords = np.column_stack(np.where(object > 0)).astype(float)
-    coords[:, 0] = coords[:, 0] / object.shape[0]
-    coords[:, 1] = coords[:, 1] / object.shape[1]
-    # Find the top_left bottom_right bounding box coordinates
-    y_min, x_min = coords.min(axis=0)
-    y_max, x_max = coords.max(axis=0)
+    bbox = geometry.normalize(geometry.pixel_boxes(object[None] > 0)[0], object.shape)
 
     # return specified label-type (corner coordinates) 
     if corner_coordinates:
-        return np.array([x_min, y_min, x_max, y_max])
+        return bbox
     # (center-coordinate, width, height)
     else:
-        return np.array(to_center_coordinates(x_min, y_min, x_max, y_max))
+        return geometry.to_center(bbox)
+
+def find_bboxes(objects):
+    """
+    Definition:
+    Vectorized find_bbox over a whole stack of images. Locates the pixel bounding
+    box of the non-zero pixels of every image in a single NumPy pass.
+
+    Parameters:
+    objects (np.array) : (N, 28, 28) array of MNIST images
+
+    Returns:
+    bboxes (np.array) : (N, 4) uint8 array of pixel [x_min, y_min, x_max, y_max]
+    """
+    return geometry.pixel_boxes(objects).astype(np.uint8)
+
+def mnist_checksum(objects, labels):
+    """
+    Definition:
+    Computes a short checksum of the MNIST images and class labels, used to key
+    the on-disk preprocessing caches.
+
+    Parameters:
+    objects (np.array) : all images of MNIST dataset
+    labels (np.array)  : all associated classes of MNIST dataset
+
+    Returns:
+    checksum (str) : hex digest identifying the dataset contents
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    digest.update(np.ascontiguousarray(objects).data)
+    digest.update(np.ascontiguousarray(labels, dtype=np.uint8).data)
+    return digest.hexdigest()
+
+def build_bbox_table(objects, labels):
+    """
+    Definition:
+    Computes the bounding box of every MNIST digit in one pass and stores it in
+    both coordinate systems using compact dtypes. Corner coordinates are whole
+    pixels (uint8) and center coordinates are multiples of 0.5 pixel, which are
+    represented exactly by float16.
+
+    Parameters:
+    objects (np.array) : all images of MNIST dataset
+    labels (np.array)  : all associated classes of MNIST dataset
+
+    Returns:
+    table (dict) : 'classes' (N,) uint8, 'corner' (N, 4) uint8 pixel
+                   [x_min, y_min, x_max, y_max] and 'center' (N, 4) float16
+                   pixel [center_x, center_y, width, height]
+    """
+    corner = find_bboxes(objects)
+    center = geometry.to_center(corner)
+
+    return {'classes' : np.asarray(labels, dtype=np.uint8).reshape(-1),
+            'corner'  : corner,
+            'center'  : center.astype(np.float16)}
+
+def _load_or_build_npz(cache_path, build):
+    """
+    Definition:
+    Reads a dict of arrays from an .npz cache file, or builds it and tries to
+    save it there when the file does not exist yet.
+
+    Parameters:
+    cache_path (str)  : .npz file of the cache entry
+    build (callable)  : returns the dict of arrays to cache
+
+    Returns:
+    arrays (dict) : cached or freshly built dict of arrays
+    """
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as cached:
+            return {key : cached[key] for key in cached.files}
+
+    arrays = build()
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        np.savez(cache_path, **arrays)
+    except OSError:
+        # A read-only cache location only costs a recompute next time
+        pass
+
+    return arrays
+
+def load_bbox_table(objects,
+                    labels,
+                    cache_dir = CACHE_DIR):
+    """
+    Definition:
+    Returns the bbox table of the MNIST dataset, reading it from the on-disk
+    cache when one exists for the same dataset checksum and building (and
+    saving) it otherwise. The checksum is kept in the table under 'checksum'
+    so caches derived from the table can share the same key.
+
+    Parameters:
+    objects (np.array) : all images of MNIST dataset
+    labels (np.array)  : all associated classes of MNIST dataset
+    cache_dir (str)    : directory holding the cache, None disables caching
+
+    Returns:
+    table (dict) : see build_bbox_table
+    """
+    if cache_dir is None:
+        return build_bbox_table(objects, labels)
+
+    checksum = mnist_checksum(objects, labels)
+    table = _load_or_build_npz(os.path.join(cache_dir, f"bboxes_{checksum}.npz"),
+                               lambda: build_bbox_table(objects, labels))
+    table['checksum'] = checksum
+
+    return table
+
+def bbox_table_to_labels(table,
+                         corner_coordinates=True):
+    """
+    Definition:
+    Builds the normalized (N, 5) label array consumed by create_image from a bbox
+    table. Values are identical to stacking find_bbox over every image, so
+    switching coordinate systems only costs this conversion.
+
+    Parameters:
+    table (dict)              : bbox table from build_bbox_table / load_bbox_table
+    corner_coordinates (bool) : Specifies output format
+
+    Returns:
+    labels (np.array) : (N, 5) array of [class, x_min, y_min, x_max, y_max]
+                        or [class, center_x, center_y, width, height]
+    """
+    bboxes = geometry.normalize(table['corner'], (MNIST_IMAGE_SIZE, MNIST_IMAGE_SIZE))
+
+    if not corner_coordinates:
+        bboxes = geometry.to_center(bboxes)
+
+    return np.column_stack([table['classes'].astype(float), bboxes])
     
+def labels_to_bbox_table(labels,
+                         corner_coordinates=True):
+    """
+    Definition:
+    Inverse of bbox_table_to_labels. Rounds normalized labels to the pixel corners
+    grab_x_bbox_region would crop, so an atlas can be built from any label array.
+
+    Parameters:
+    labels (np.array)         : (N, 5) normalized class and bbox labels
+    corner_coordinates (bool) : defines what bbox coordinate system labels are in
+
+    Returns:
+    table (dict) : 'classes' and 'corner' entries of a bbox table
+    """
+    x_min, y_min, x_max, y_max = geometry.as_corner(labels[:, 1:], corner_coordinates).T
+
+    corner = np.stack([np.floor(x_min * MNIST_IMAGE_SIZE),
+                       np.floor(y_min * MNIST_IMAGE_SIZE),
+                       np.ceil(x_max * MNIST_IMAGE_SIZE),
+                       np.ceil(y_max * MNIST_IMAGE_SIZE)], axis=1)
+
+    return {'classes' : labels[:, 0].astype(np.uint8),
+            'corner'  : corner.astype(np.uint8)}
+
+def build_digit_atlas(objects, table):
+    """
+    Definition:
+    Packs the bbox crop of every MNIST digit into one contiguous uint8 buffer.
+    Crops match grab_x_bbox_region with corner coordinates, i.e. the pixel
+    rows y_min:y_max and cols x_min:x_max of the bbox table.
+
+    Parameters:
+    objects (np.array) : all images of MNIST dataset
+    table (dict)       : bbox table of the same images
+
+    Returns:
+    atlas (dict) : 'pixels' 1D uint8 buffer of all crops, 'offsets' (N,) int64
+                   start of every crop in the buffer and 'shapes' (N, 2) uint8
+                   crop height and width
+    """
+    x_min, y_min, x_max, y_max = table['corner'].T.astype(np.int64)
+    shapes = np.stack([y_max - y_min, x_max - x_min], axis=1)
+
+    offsets = np.zeros(len(shapes), dtype=np.int64)
+    np.cumsum(shapes[:-1, 0] * shapes[:-1, 1], out=offsets[1:])
+
+    # Boolean indexing walks the stack in C order, so the selected pixels come
+    # out crop after crop, each one row-major
+    pixel_range = np.arange(objects.shape[1])
+    rows = (pixel_range >= y_min[:, None]) & (pixel_range < y_max[:, None])
+    cols = (pixel_range >= x_min[:, None]) & (pixel_range < x_max[:, None])
+    pixels = objects[rows[:, :, None] & cols[:, None, :]]
+
+    return {'pixels'  : pixels,
+            'offsets' : offsets,
+            'shapes'  : shapes.astype(np.uint8)}
+
+def load_digit_atlas(objects,
+                     table,
+                     cache_dir = CACHE_DIR):
+    """
+    Definition:
+    Returns the digit atlas of the MNIST dataset, cached next to the bbox table
+    under the same dataset checksum.
+
+    Parameters:
+    objects (np.array) : all images of MNIST dataset
+    table (dict)       : bbox table from load_bbox_table
+    cache_dir (str)    : directory holding the cache, None disables caching
+
+    Returns:
+    atlas (dict) : see build_digit_atlas
+    """
+    if cache_dir is None or 'checksum' not in table:
+        return build_digit_atlas(objects, table)
+
+    return _load_or_build_npz(os.path.join(cache_dir, f"atlas_{table['checksum']}.npz"),
+                              lambda: build_digit_atlas(objects, table))
+
+def atlas_crop(atlas, index):
+    """
+    Definition:
+    Returns the bbox crop of one digit as a view into the atlas buffer.
+
+    Parameters:
+    atlas (dict) : digit atlas from build_digit_atlas
+    index (int)  : index of the digit in the MNIST dataset
+
+    Returns:
+    crop (np.array) : 2D uint8 bbox crop of the digit
+    """
+    height, width = int(atlas['shapes'][index, 0]), int(atlas['shapes'][index, 1])
+    offset = int(atlas['offsets'][index])
+
+    return atlas['pixels'][offset:offset + height * width].reshape(height, width)
+
+def resized_shape(shape, scale_value):
+    """
+    Definition:
+    Shape of a crop after resize_object, i.e. the zoomed shape rounded the way
+    scipy.ndimage.zoom (used by skimage) rounds it.
+
+    Parameters:
+    shape ((int , int))  : height and width of the crop
+    scale_value (float)  : scaler for object size
+
+    Returns:
+    shape ((int , int)) : height and width of the resized crop
+    """
+    zoom = 1 / np.divide(shape, (shape[0] * scale_value, shape[1] * scale_value))
+    return tuple(int(round(size * factor)) for size, factor in zip(shape, zoom))
+
+def resize_object(bbox_object,
+                  scale_value,
+                  order = 1,
+                  backend = 'skimage'):
+    """
+    Definition:
+    Scales a digit crop by scale_value. The 'skimage' backend is the reference
+    skimage.transform.resize call. The 'cv2' backend produces the same output
+    shape several times faster; its border pixels follow OpenCV's edge rule
+    rather than skimage's constant padding, so it is not bit-identical.
+
+    Parameters:
+    bbox_object (np.array) : 2D digit crop
+    scale_value (float)    : scaler for object size
+    order (int)            : interpolation order, 0 nearest or 1 linear
+    backend (str)          : 'skimage' or 'cv2'
+
+    Returns:
+    bbox_object (np.array) : resized crop (float64 for linear, input dtype for nearest)
+    """
+    m, n = bbox_object.shape
+    output_shape = (m * scale_value, n * scale_value)
+
+    if backend == 'skimage':
+        from skimage import transform
+        return transform.resize(bbox_object, 
+                                output_shape,
+                                order = order,
+                                mode = 'constant',
+                                cval = 0,
+                                anti_aliasing=False,
+                                preserve_range=True)
+    elif backend == 'cv2':
+        import cv2
+        rows, cols = resized_shape(bbox_object.shape, scale_value)
+        if order == 0:
+            return cv2.resize(bbox_object, (cols, rows), interpolation=cv2.INTER_NEAREST_EXACT)
+        return cv2.resize(bbox_object.astype(np.float64), (cols, rows), interpolation=cv2.INTER_LINEAR)
+    else:
+        raise ValueError(f"Unknown resize backend '{backend}'")
+
+class ResizeCache:
+    """
+    Definition:
+    LRU cache of resized digit crops keyed by (digit index, scale value), bounded
+    by a memory budget. Crops are stored as uint8 truncated from the resize
+    output, which is exactly what the uint8 canvas keeps after compositing, so
+    images are identical to resizing every object (for the same backend).
+
+    Parameters:
+    max_bytes (int) : memory budget of the cached crops
+    order (int)     : interpolation order, 0 nearest or 1 linear
+    backend (str)   : resize backend, see resize_object
+    """
+    def __init__(self,
+                 max_bytes = 256 * 2**20,
+                 order = 1,
+                 backend = 'skimage'):
+        self.max_bytes = max_bytes
+        self.order = order
+        self.backend = backend
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._crops = OrderedDict()
+
+    def __len__(self):
+        return len(self._crops)
+
+    def _add(self, key, bbox_object, scale_value):
+        resized = resize_object(bbox_object,
+                                scale_value,
+                                order = self.order,
+                                backend = self.backend).astype(np.uint8)
+        resized.setflags(write=False)
+        self._crops[key] = resized
+        self.nbytes += resized.nbytes
+        return resized
+
+    def resize(self, index, bbox_object, scale_value):
+        """
+        Definition:
+        Returns the resized crop of digit index, resizing bbox_object on a miss.
+
+        Parameters:
+        index (int)            : index of the digit in the MNIST dataset
+        bbox_object (np.array) : 2D bbox crop of that digit
+        scale_value (float)    : scaler for object size
+
+        Returns:
+        resized (np.array) : read-only uint8 resized crop
+        """
+        key = (int(index), float(scale_value))
+        resized = self._crops.get(key)
+        if resized is not None:
+            self._crops.move_to_end(key)
+            self.hits += 1
+            return resized
+
+        self.misses += 1
+        resized = self._add(key, bbox_object, scale_value)
+        while self.nbytes > self.max_bytes and len(self._crops) > 1:
+            _, evicted = self._crops.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+            self.evictions += 1
+
+        return resized
+
+    def prewarm(self,
+                atlas,
+                scale_options,
+                indices = None):
+        """
+        Definition:
+        Fills the cache with a pyramid of every scale step for the given digits,
+        stopping once the memory budget is reached.
+
+        Parameters:
+        atlas (dict)            : digit atlas holding the crops
+        scale_options (np.array): scale values to precompute (1 is skipped)
+        indices (iterable)      : digit indices to precompute, all when None
+
+        Returns:
+        count (int) : number of crops added to the cache
+        """
+        if indices is None:
+            indices = range(len(atlas['offsets']))
+
+        count = 0
+        for index in indices:
+            crop = atlas_crop(atlas, index)
+            for scale_value in scale_options:
+                key = (int(index), float(scale_value))
+                if scale_value == 1 or key in self._crops:
+                    continue
+                if self.nbytes >= self.max_bytes:
+                    return count
+                self._add(key, crop, scale_value)
+                count += 1
+
+        return count
+
 def generate_noisy_image(image_size=(128, 128),
-                         noise_intensity = 128):
+                         noise_intensity = 128,
+                         rng = None):
     """
     Definition:
     Creates an background image with random noise and returns as a numpy array.
@@ -111,32 +600,39 @@ def generate_noisy_image(image_size=(128, 128),
     Parameters:
     image_size ((int , int)) : the set height and width of returned image
     noise_intensity (int)    : the scalar intensity value for the background noise
+    rng (np.random.RandomState) : random source, the global np.random when None
 
     Returns:
     random_image (np.array) : 2D np.array with shape size and random values 
                               from 0 to intensity
     """
+    rng = np.random if rng is None else rng
     # Generate a random array of shape size with values between 0 and 255
-    random_image = np.random.randint(0, noise_intensity, image_size, dtype=np.uint8)
+    random_image = rng.randint(0, noise_intensity, image_size, dtype=np.uint8)
     return random_image
 
 def choose_regions_to_populate(max_objects = 8,
                                grid_rows = 4,
-                               grid_cols = 4):
+                               grid_cols = 4,
+                               min_objects = 0,
+                               rng = None):
     """
     Definition:
     Randomly chooses up to the max_objects regions based on the allowable grid
 
     Parameters:
-    max_objects (int) : upper limit of chosen regions
+    max_objects (int) : exclusive upper limit of chosen regions, at most grid_rows * grid_cols + 1
     grid_rows (int)   : number of rows the image is broken down into
     grid_cols (int)   : number of cols the image is broken down into
+    min_objects (int) : inclusive lower limit of chosen regions, below max_objects
+    rng (np.random.RandomState) : random source, the global np.random when None
     
     Returns:
-    regions (np.array) : 1D array of random values of length between 0 and max_objects
+    regions (np.array) : 1D array of random values of length in [min_objects, max_objects)
     """
-    num_objects = np.random.choice(range(max_objects), 1)
-    regions = np.random.choice(range(1, grid_cols * grid_rows + 1), 
+    rng = np.random if rng is None else rng
+    num_objects = rng.choice(range(min_objects, max_objects), 1)
+    regions = rng.choice(range(1, grid_cols * grid_rows + 1), 
                                num_objects, 
                                replace=False)
     return regions
@@ -170,50 +666,62 @@ def grab_x_bbox_region(object,
 
     return object[y_min:y_max, x_min:x_max]
 
-def add_object_to_image(image,
-                        region_of_interest,
-                        object,
-                        label,
-                        object_num,
-                        grid_rows = 4,
-                        grid_cols = 4,
-                        scale_value = 1,
-                        corner_coordinates=True):
+def place_object(image_shape,
+                 region_of_interest,
+                 object,
+                 label,
+                 object_num,
+                 grid_rows = 4,
+                 grid_cols = 4,
+                 scale_value = 1,
+                 corner_coordinates=True,
+                 cropped=False,
+                 rng=None):
     """
     Definition:
-    Overlays the object onto the image centered in the region of interest. The object may be
-    scaled up in size.
+    Works out where the object lands when centered in the region of interest, without
+    touching the image. The object is not resized yet; its scaled size is known from
+    resized_shape, so the placement can be checked before paying for the resize.
 
     Parameters:
-    image (np.array)          : current image being created
+    image_shape ((int , int)) : height and width of the image being created
     region_of_interest (int)  : region num of image grid to center object in
-    object (np.array)         : 2D MNIST image array
+    object (np.array)         : 2D MNIST image array, or its bbox crop if cropped
     label (np.array)          : associated class and bbox label with input object
     object_num (int)          : nth object being added to image (used for tracking in wrapper function)
     grid_rows (int)           : number of rows the image is broken down into
     grid_cols (int)           : number of cols the image is broken down into
     scale_value (float)       : scaler for object size
     corner_coordinates (bool) : defines what bbox coordinate system is in use
+    cropped (bool)            : object is already the bbox crop (e.g. from the digit atlas)
+    rng (np.random.RandomState) : random source of the center, the global np.random when None
 
     Returns:
-    image (np.array)    : updated image with new overlayed object
-    added_object (dict) : dict with class, true object coordinates on image, and normalized coordinates
+    bbox_object (np.array) : unscaled bbox crop of the object
+    scale_value (float)    : scaler to apply, clamped to fit the region
+    region (tuple)         : (row slice, col slice) of the image the scaled object covers
+    added_object (dict)    : dict with class, true object coordinates on image, normalized coordinates
+                             and the applied scale
     """
     # Determine the size of a region based on chosen image grid
-    region_x = int(image.shape[1] / grid_rows)
-    region_y = int(image.shape[0] / grid_cols)
+    region_x = int(image_shape[1] / grid_rows)
+    region_y = int(image_shape[0] / grid_cols)
     # Randomly choose a center point within the size of one grid region
-    y_center = np.random.randint(0, region_y + 1, 1)
-    x_center = np.random.randint(0, region_x + 1, 1)
+    rng = np.random if rng is None else rng
+    y_center = rng.randint(0, region_y + 1, 1)
+    x_center = rng.randint(0, region_x + 1, 1)
     # Offset center to the chosen region of interest 
 
     y_center += ((region_of_interest - 1)// grid_cols) * region_y
     x_center += ((region_of_interest - 1) % grid_cols) * region_x
     
     # Grab the bbox area of the input object for overlaying onto the image
-    bbox_object = grab_x_bbox_region(object,
-                                     label,
-                                     corner_coordinates=corner_coordinates)
+    if cropped:
+        bbox_object = object
+    else:
+        bbox_object = grab_x_bbox_region(object,
+                                         label,
+                                         corner_coordinates=corner_coordinates)
    
     m, n = bbox_object.shape
 
@@ -226,15 +734,9 @@ def add_object_to_image(image,
     if scale_value > min(region_x / n, region_y / m) * 2 :
         scale_value = (math.floor(min(region_x / n, region_y / m) * 20) / 10) - 0.5
     
-    if scale_value != 1: # and region_of_interest not in edge_regions:
-        bbox_object = transform.resize(bbox_object, 
-                                       (m * scale_value, n * scale_value),
-                                       mode = 'constant',
-                                       cval = 0,
-                                       anti_aliasing=False,
-                                       preserve_range=True)
     # Find new size of bbox object
-    m, n = bbox_object.shape
+    if scale_value != 1: # and region_of_interest not in edge_regions:
+        m, n = resized_shape(bbox_object.shape, scale_value)
     
     # Calculate image location for bbox object
     y_min = int((x_center[0] - n // 2))
@@ -245,31 +747,143 @@ def add_object_to_image(image,
     if y_min < 0:
         up_shift = 0 - y_min
         y_min, y_max = y_min + up_shift, y_max + up_shift
-    elif y_max >= image.shape[1]:
-        down_shift = (y_max - image.shape[1]) + 1
+    elif y_max >= image_shape[1]:
+        down_shift = (y_max - image_shape[1]) + 1
         y_min, y_max = y_min - down_shift, y_max - down_shift  
 
     if x_min < 0:
         r_shift = 0 - x_min
         x_min, x_max = x_min + r_shift, x_max + r_shift
-    elif x_max >= image.shape[0]:
-        l_shift = (x_max - image.shape[0]) + 1
+    elif x_max >= image_shape[0]:
+        l_shift = (x_max - image_shape[0]) + 1
         x_min, x_max = x_min - l_shift, x_max - l_shift
 
-    image[x_min:x_max, y_min:y_max] = np.maximum(image[x_min:x_max, y_min:y_max], bbox_object)
+    region = (slice(x_min, x_max), slice(y_min, y_max))
 
-    N, M = image.shape
+    N, M = image_shape
 
     if corner_coordinates:
         added_object = {object_num : {'class' : int(label[0]),
                                       'bbox_true' : [y_min,     x_min,     y_max,     x_max    ],
-                                      'bbox_norm' : [y_min / M, x_min / N, y_max / M, x_max / N]}
+                                      'bbox_norm' : [y_min / M, x_min / N, y_max / M, x_max / N],
+                                      'scale'     : float(scale_value)}
                         }
     else:
         center_x, center_y, width, height = to_center_coordinates(y_min, x_min, y_max, x_max)
         added_object = {object_num : {'class' : int(label[0]),
                                       'bbox_true' : [center_x,     center_y,     width,     height     ],
-                                      'bbox_norm' : [center_x / M, center_y / N, width / M, height / N]}}
+                                      'bbox_norm' : [center_x / M, center_y / N, width / M, height / N],
+                                      'scale'     : float(scale_value)}}
+
+    return bbox_object, scale_value, region, added_object
+
+def composite_object(image,
+                     bbox_object,
+                     region,
+                     scale_value = 1,
+                     resize=None,
+                     blend_mode='max'):
+    """
+    Definition:
+    Scales the object and overlays it in place onto the image region chosen by place_object.
+    Compositing stays in uint8: a float resize is truncated first, which for the max
+    mode equals truncating the float composite as the uint8 canvas used to.
+
+    Parameters:
+    image (np.array)       : current uint8 image being created, modified in place
+    bbox_object (np.array) : unscaled bbox crop of the object
+    region (tuple)         : (row slice, col slice) from place_object
+    scale_value (float)    : scaler for object size
+    resize (callable)      : resize(bbox_object, scale_value) replacing resize_object (e.g. a cache)
+    blend_mode (str)       : how the object is combined with the image, see blend.BLEND_MODES
+
+    Returns:
+    image (np.array) : updated image with new overlayed object
+    """
+    if scale_value != 1:
+        if resize is None:
+            bbox_object = resize_object(bbox_object, scale_value)
+        else:
+            bbox_object = resize(bbox_object, scale_value)
+
+    if bbox_object.dtype != np.uint8:
+        bbox_object = bbox_object.astype(np.uint8)
+    blend.blend(image[region], bbox_object, blend_mode)
+
+    return image
+
+def add_object_to_image(image,
+                        region_of_interest,
+                        object,
+                        label,
+                        object_num,
+                        grid_rows = 4,
+                        grid_cols = 4,
+                        scale_value = 1,
+                        corner_coordinates=True,
+                        cropped=False,
+                        resize=None,
+                        stats=None,
+                        blend_mode='max'):
+    """
+    Definition:
+    Overlays the object onto the image centered in the region of interest. The object may be
+    scaled up in size.
+
+    Parameters:
+    image (np.array)          : current image being created
+    region_of_interest (int)  : region num of image grid to center object in
+    object (np.array)         : 2D MNIST image array, or its bbox crop if cropped
+    label (np.array)          : associated class and bbox label with input object
+    object_num (int)          : nth object being added to image (used for tracking in wrapper function)
+    grid_rows (int)           : number of rows the image is broken down into
+    grid_cols (int)           : number of cols the image is broken down into
+    scale_value (float)       : scaler for object size
+    corner_coordinates (bool) : defines what bbox coordinate system is in use
+    cropped (bool)            : object is already the bbox crop (e.g. from the digit atlas)
+    resize (callable)         : resize(bbox_object, scale_value) replacing resize_object (e.g. a cache)
+    stats (GenerationStats)   : instrumentation updated with the stage times, scale clamp and resize
+                                of the object
+    blend_mode (str)          : how the object is combined with the image, see blend.BLEND_MODES
+
+    Returns:
+    image (np.array)    : updated image with new overlayed object
+    added_object (dict) : dict with class, true object coordinates on image, and normalized coordinates
+    """
+    if stats is not None:
+        start = time.perf_counter()
+        requested_scale = scale_value
+
+    bbox_object, scale_value, region, added_object = place_object(image.shape,
+                                                                  region_of_interest,
+                                                                  object,
+                                                                  label,
+                                                                  object_num,
+                                                                  grid_rows = grid_rows,
+                                                                  grid_cols = grid_cols,
+                                                                  scale_value = scale_value,
+                                                                  corner_coordinates=corner_coordinates,
+                                                                  cropped=cropped)
+
+    if stats is not None:
+        start = stats.lap('placement', start)
+        # No overlap test here, placements are only counted where one is made (create_image)
+        stats.scale_clamps += scale_value != requested_scale
+        if scale_value != 1:
+            stats.resizes += 1
+            bbox_object = (resize or resize_object)(bbox_object, scale_value)
+            scale_value = 1
+            start = stats.lap('resize', start)
+
+    image = composite_object(image,
+                             bbox_object,
+                             region,
+                             scale_value = scale_value,
+                             resize = resize,
+                             blend_mode = blend_mode)
+
+    if stats is not None:
+        stats.lap('composite', start)
 
     return image, added_object
 
@@ -288,24 +902,207 @@ def check_overlap(bbox1,
     Returns:
     overlap (bool) : True if the boxes overlap, False otherwise
     """
-    # Unpack the coordinates
-    if corner_coordinates:
-        x1_min, y1_min, x1_max, y1_max = bbox1
-        x2_min, y2_min, x2_max, y2_max = bbox2
-    else:
-        center1_x, center1_y, width1, height1 = bbox1
-        x1_min, y1_min, x1_max, y1_max = to_corner_coordinates(center1_x, center1_y, width1, height1)
-        center2_x, center2_y, width2, height2 = bbox2
-        x2_min, y2_min, x2_max, y2_max = to_corner_coordinates(center2_x, center2_y, width2, height2)
+    bbox1 = geometry.as_corner(bbox1, corner_coordinates)
+    bbox2 = geometry.as_corner(bbox2, corner_coordinates)
+
+    return bool(geometry.overlap_matrix([bbox1], [bbox2])[0, 0])
+
+class OccupancyGrid:
+    """
+    Definition:
+    Occupancy bitmap of the boxes accepted on an image. A box is tested against all
+    accepted boxes at once by looking at the pixels it covers, so the cost does not
+    grow with the number of objects already placed. Boxes are closed intervals, a
+    box touching an accepted one overlaps it exactly as in check_overlap.
+
+    Parameters:
+    image_shape ((int , int)) : height and width of the image being created
+    """
+    def __init__(self, image_shape):
+        # One spare row and column for the closed max edge of boxes on the border
+        self.occupied = np.zeros((image_shape[0] + 1, image_shape[1] + 1), dtype=bool)
+
+    @staticmethod
+    def _cells(region):
+        rows, cols = region
+        return slice(rows.start, rows.stop + 1), slice(cols.start, cols.stop + 1)
+
+    def overlaps(self, region):
+        """
+        Definition:
+        Checks if a box overlaps any occupied box
+
+        Parameters:
+        region (tuple) : (row slice, col slice) of the box, as returned by place_object
+
+        Returns:
+        overlap (bool) : True if the box overlaps an occupied box
+        """
+        return bool(self.occupied[self._cells(region)].any())
+
+    def occupy(self, region):
+        """
+        Definition:
+        Marks a box as occupied
+
+        Parameters:
+        region (tuple) : (row slice, col slice) of the box, as returned by place_object
+        """
+        self.occupied[self._cells(region)] = True
+
+class PlacementStats:
+    """
+    Definition:
+    Counters of the object placements done by create_image, to see how many of the
+    requested objects end up on the images and what the retries buy.
+
+    Attributes:
+    images (int)    : number of images created
+    requested (int) : number of objects the chosen regions asked for
+    attempts (int)  : number of placements tried, including retries
+    accepted (int)  : number of objects added to the images
+    rejected (int)  : number of placements rejected for overlapping
+    retries (int)   : number of placements retried after a rejection
+    cached (int)    : number of images read from the generation cache instead of created
+    """
+    FIELDS = ('images', 'requested', 'attempts', 'accepted', 'rejected', 'retries', 'cached')
+
+    def __init__(self, **counts):
+        for field in self.FIELDS:
+            setattr(self, field, counts.get(field, 0))
+
+    @property
+    def acceptance_rate(self):
+        """Fraction of the placement attempts that were accepted"""
+        return self.accepted / self.attempts if self.attempts else 0.0
+
+    @property
+    def fill_rate(self):
+        """Fraction of the requested objects that were added"""
+        return self.accepted / self.requested if self.requested else 0.0
+
+    def as_dict(self):
+        return {field : getattr(self, field) for field in self.FIELDS}
+
+    def merge(self, other):
+        """
+        Definition:
+        Adds the counts of other (a PlacementStats or its as_dict) to these
+
+        Returns:
+        stats (PlacementStats) : self
+        """
+        if isinstance(other, PlacementStats):
+            other = other.as_dict()
+        for field in self.FIELDS:
+            setattr(self, field, getattr(self, field) + other.get(field, 0))
+        return self
+
+    def reset(self):
+        for field in self.FIELDS:
+            setattr(self, field, 0)
+
+    def __str__(self):
+        return (f"{self.accepted}/{self.requested} objects placed on {self.images} images "
+                f"({self.acceptance_rate:.1%} of {self.attempts} attempts accepted, {self.retries} retries)"
+                + (f", {self.cached} images from the cache" if self.cached else ""))
+
+class GenerationStats(PlacementStats):
+    """
+    Definition:
+    PlacementStats with the instrumentation of a generation run: cumulative seconds
+    spent in every stage, scale clamps, resizes and bytes written, and the derived
+    throughput and ETA. create_image only times its stages when given one of these,
+    so runs without it pay nothing beyond a type check per image.
+
+    Parameters:
+    total (int) : number of images the run will create, for the ETA
+
+    Attributes:
+    scale_clamps (int)  : objects whose scale was reduced to fit their region
+    resizes (int)       : objects composited at a scale other than 1
+    bytes_written (int) : bytes of encoded images and annotations handed to the writers
+    timers (dict)       : stage -> cumulative seconds, summed over all workers
+    """
+    FIELDS = PlacementStats.FIELDS + ('scale_clamps', 'resizes', 'bytes_written')
+    STAGES = ('noise', 'placement', 'overlap', 'resize', 'composite', 'write')
+
+    def __init__(self, total = None, **counts):
+        super().__init__(**counts)
+        self.timers = dict.fromkeys(self.STAGES, 0.0)
+        self.timers.update(counts.get('timers', {}))
+        self.start(total)
+
+    def start(self, total = None):
+        """Restarts the clock of the run, e.g. when the generation starts"""
+        self.total = total
+        self.start_time = time.perf_counter()
+
+    def lap(self, stage, start):
+        """
+        Definition:
+        Adds the time since start to a stage
+
+        Returns:
+        now (float) : the current time.perf_counter(), start of the next stage
+        """
+        now = time.perf_counter()
+        self.timers[stage] += now - start
+        return now
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.start_time
+
+    @property
+    def images_per_second(self):
+        elapsed = self.elapsed
+        return self.images / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        """Seconds until total images are created at the current rate, None when unknown"""
+        rate = self.images_per_second
+        if self.total is None or rate <= 0:
+            return None
+        return max(self.total - self.images, 0) / rate
+
+    def as_dict(self):
+        counts = super().as_dict()
+        counts['timers'] = dict(self.timers)
+        return counts
 
-    # Check if the boxes do not overlap
-    if x1_max < x2_min or x2_max < x1_min:  # One box is to the left of the other
-        return False
-    if y1_max < y2_min or y2_max < y1_min:  # One box is above the other
-        return False
+    def merge(self, other):
+        if isinstance(other, PlacementStats):
+            other = other.as_dict()
+        super().merge(other)
+        for stage, seconds in other.get('timers', {}).items():
+            self.timers[stage] = self.timers.get(stage, 0.0) + seconds
+        return self
 
-    # If none of the above conditions are true, the boxes overlap
-    return True
+    def reset(self):
+        super().reset()
+        self.timers = dict.fromkeys(self.STAGES, 0.0)
+
+    def progress_line(self):
+        """One line of images, throughput, bytes written and ETA"""
+        eta = self.eta
+        eta_str = time.strftime('%H:%M:%S', time.gmtime(eta)) if eta is not None else '--:--:--'
+        total = f"/{self.total}" if self.total is not None else ''
+        return (f"{self.images}{total} images | {self.images_per_second:.1f} images/s | "
+                f"{self.bytes_written / 2**20:.1f} MiB | ETA {eta_str}")
+
+    def stage_line(self):
+        """One line of the share of the timed seconds spent in every stage"""
+        timed = sum(self.timers.values())
+        if timed <= 0:
+            return "no stage timings"
+        return ' | '.join(f"{stage} {seconds / timed:.0%}" for stage, seconds in self.timers.items())
+
+    def __str__(self):
+        return '\n'.join([self.progress_line(),
+                          super().__str__() + f", {self.scale_clamps} scale clamps, {self.resizes} resizes",
+                          self.stage_line()])
 
 def draw_grid_on_image(image, 
                        grid_rows = 4, 
@@ -347,10 +1144,21 @@ def create_image(objects,
                  max_scaling = 2.5,
                  add_gridlines = False,
                  allow_overlap = False,
-                 corner_coordinates=True):
+                 corner_coordinates=True,
+                 atlas=None,
+                 resize_cache=None,
+                 min_objects = 0,
+                 max_retries = 0,
+                 placement_stats=None,
+                 background=None,
+                 blend_mode='max',
+                 rng=None):
     """
     Definition:
-    Create an image for the output dataset
+    Create an image for the output dataset. Overlap is tested on an OccupancyGrid;
+    with max_retries, a rejected object is drawn again (digit, scale and an unused
+    region) up to max_retries times, so dense layouts get close to the requested
+    number of objects. Without retries the image only depends on the seed as before.
 
     Parameters:
     objects (np.array)         : all images of MNIST dataset
@@ -359,26 +1167,47 @@ def create_image(objects,
     noise_intensity (int)      : the scalar intensity value for the background noise
     grid_rows (int)            : number of rows the image is broken down into
     grid_cols (int)            : number of cols the image is broken down into
-    max_objects (int)          : upper limit of objects to be added to image
+    max_objects (int)          : exclusive upper limit of objects to be added to image
     max_scaling (float)        : upper limit of size scalar for objects
     add_gridlines (bool)       : adds gridlines to image if True
     allow_overlap (bool)       : removes added object if it overlaps with another object if False
     corner_coordinates (bool)  : defines what bbox coordinate system is in use
+    atlas (dict)               : digit atlas of objects, crops are taken from it when given
+    resize_cache (ResizeCache) : cache for the scaled crops, every object is resized when None
+    min_objects (int)          : inclusive lower limit of objects to be added to image
+    max_retries (int)          : placements retried per object after overlapping
+    placement_stats (PlacementStats) : counters updated with the placements of this image, the
+                                       stages are timed as well when it is a GenerationStats
+    background (NoiseBank)     : background engine the noise is drawn from, generate_noisy_image
+                                 noise when None
+    blend_mode (str)           : how objects are combined with the image, see blend.BLEND_MODES
+    rng (np.random.RandomState): random source, the global np.random when None
 
     Returns:
     image (np.array)     : finished created image
     added_objects (dict) : dict with all object class, true object coordinates on 
                            image, and normalized coordinates
     """
-    image = generate_noisy_image(image_size = image_size,
-                                 noise_intensity = noise_intensity)
+    timed = isinstance(placement_stats, GenerationStats)
+    if timed:
+        start = time.perf_counter()
+
+    rng = np.random if rng is None else rng
+    if background is None:
+        image = generate_noisy_image(image_size = image_size,
+                                     noise_intensity = noise_intensity,
+                                     rng = rng)
+    else:
+        image = background.draw(image_size, rng = rng)
     
     data_size = len(objects)
     scaling_options = np.arange(1, max_scaling + 0.125, 0.125)
 
     regions_to_populate = choose_regions_to_populate(max_objects=max_objects,
                                                      grid_rows = grid_rows,
-                                                     grid_cols = grid_cols)
+                                                     grid_cols = grid_cols,
+                                                     min_objects = min_objects,
+                                                     rng = rng)
     
     if add_gridlines:
         image = draw_grid_on_image(image, 
@@ -386,47 +1215,605 @@ def create_image(objects,
                                    grid_cols = grid_cols)
         
     added_objects = {}
+    occupancy = OccupancyGrid(image.shape)
+    # Regions not chosen yet, retried objects move to one of them
+    spare_regions = np.setdiff1d(np.arange(1, grid_rows * grid_cols + 1), regions_to_populate) if max_retries else None
+    attempts = rejected = retries = scale_clamps = resizes = 0
+
+    if timed:
+        start = placement_stats.lap('noise', start)
 
     for object_num, region in enumerate(regions_to_populate):
-       
-        index = np.random.randint(0, data_size)
-        scaler = np.random.choice(scaling_options)
-
-        temp_image, object_to_add = add_object_to_image(image = copy.deepcopy(image),
-                                                        region_of_interest = region,
-                                                        object = objects[index],
-                                                        label = labels[index],
-                                                        object_num = object_num,
-                                                        grid_rows = grid_rows,
-                                                        grid_cols = grid_cols,
-                                                        scale_value = scaler,
-                                                        corner_coordinates=corner_coordinates)
-        
-        overlap = False
-        if object_num > 0 and not allow_overlap:
-            added_objects_list = list(added_objects.values())
-            for added_object in added_objects_list:
-                overlap = check_overlap(object_to_add[object_num]['bbox_true'],
-                                        added_object['bbox_true'],
-                                        corner_coordinates=corner_coordinates)
+        for retry in range(max_retries + 1):
+            if retry:
+                retries += 1
+                if len(spare_regions):
+                    spare = rng.randint(0, len(spare_regions))
+                    region, spare_regions = spare_regions[spare], np.delete(spare_regions, spare)
+
+            index = rng.randint(0, data_size)
+            scaler = rng.choice(scaling_options)
+
+            if atlas is not None:
+                object = atlas_crop(atlas, index)
+            else:
+                object = objects[index]
+
+            # Place the object on geometry only, the image is only touched once accepted
+            bbox_object, scale_value, image_region, object_to_add = place_object(image.shape,
+                                                                                 region_of_interest = region,
+                                                                                 object = object,
+                                                                                 label = labels[index],
+                                                                                 object_num = object_num,
+                                                                                 grid_rows = grid_rows,
+                                                                                 grid_cols = grid_cols,
+                                                                                 scale_value = scaler,
+                                                                                 corner_coordinates=corner_coordinates,
+                                                                                 cropped = atlas is not None,
+                                                                                 rng = rng)
+            attempts += 1
+            scale_clamps += scale_value != scaler
+            if timed:
+                start = placement_stats.lap('placement', start)
+
+            if not allow_overlap:
+                overlap = occupancy.overlaps(image_region)
+                if not overlap:
+                    occupancy.occupy(image_region)
+                if timed:
+                    start = placement_stats.lap('overlap', start)
                 if overlap:
-                    break
-        
-        if not overlap:
+                    rejected += 1
+                    continue
+
+            if resize_cache is not None:
+                resize = functools.partial(resize_cache.resize, index)
+            else:
+                resize = None
+
+            if scale_value != 1:
+                resizes += 1
+                if timed:
+                    # Resize here rather than in composite_object to time it on its own
+                    bbox_object = (resize or resize_object)(bbox_object, scale_value)
+                    scale_value = 1
+                    start = placement_stats.lap('resize', start)
+
+            image = composite_object(image,
+                                     bbox_object,
+                                     image_region,
+                                     scale_value = scale_value,
+                                     resize = resize,
+                                     blend_mode = blend_mode)
             added_objects.update(object_to_add)
-            image = temp_image
-        
-        del temp_image
+            if timed:
+                start = placement_stats.lap('composite', start)
+            break
+
+    if placement_stats is not None:
+        placement_stats.merge({'images'       : 1,
+                               'requested'    : len(regions_to_populate),
+                               'attempts'     : attempts,
+                               'accepted'     : len(added_objects),
+                               'rejected'     : rejected,
+                               'retries'      : retries,
+                               'scale_clamps' : scale_clamps,
+                               'resizes'      : resizes})
 
     return image, added_objects
 
+@functools.lru_cache(maxsize=None)
+def _numba_batch_kernels():
+    """
+    Definition:
+    Compiles the Numba kernels of create_images on first use (cached on disk by Numba).
+    They give the same results as its NumPy path: the noise kernel scales the 16 bit
+    values the same way, and the composite kernel resizes every object with the
+    arithmetic of _resize_crops and blends it with the integer formulas of blend.
+
+    Returns:
+    kernels (dict) : 'noise' and 'composite' kernels, None when Numba is not installed
+    """
+    try:
+        import numba
+    except ImportError:
+        return None
+
+    @numba.njit(cache=True, nogil=True)
+    def noise_kernel(values, noise_intensity, out):
+        for i in range(out.size):
+            out[i] = (np.uint32(values[i]) * np.uint32(noise_intensity)) >> 16
+
+    @numba.njit(cache=True, nogil=True, inline='always')
+    def crop_pixel(pixels, offset, m, n, row, col):
+        # Zero outside the crop, skimage's constant padding
+        if row < 0 or row >= m or col < 0 or col >= n:
+            return 0.0
+        return np.float64(pixels[offset + row * n + col])
+
+    @numba.njit(cache=True, nogil=True, inline='always')
+    def interpolate(pixels, offset, m, n, i, j, row_zoom, col_zoom):
+        position = (i + 0.5) * row_zoom - 0.5
+        row = np.floor(position)
+        row_after = position - row
+        row_before = 1 - row_after
+        position = (j + 0.5) * col_zoom - 0.5
+        col = np.floor(position)
+        col_after = position - col
+        col_before = 1 - col_after
+        row, col = np.int64(row), np.int64(col)
+
+        value = (crop_pixel(pixels, offset, m, n, row, col) * row_before) * col_before
+        value += (crop_pixel(pixels, offset, m, n, row, col + 1) * row_before) * col_after
+        value += (crop_pixel(pixels, offset, m, n, row + 1, col) * row_after) * col_before
+        value += (crop_pixel(pixels, offset, m, n, row + 1, col + 1) * row_after) * col_after
+        return value
+
+    @numba.njit(cache=True, nogil=True)
+    def composite_kernel(images, pixels, offsets, crop_shapes, shapes, image_index, corners, mode):
+        for k in range(len(offsets)):
+            m, n = crop_shapes[k, 0], crop_shapes[k, 1]
+            rows, cols = shapes[k, 0], shapes[k, 1]
+            offset = offsets[k]
+            row_zoom, col_zoom = m / rows, n / cols
+
+            low, high = 255, 0
+            for p in range(m * n):
+                low = min(low, pixels[offset + p])
+                high = max(high, pixels[offset + p])
+            low_value, high_value = np.float64(low), np.float64(high)
+            if low > 0:
+                for i in range(rows):
+                    for j in range(cols):
+                        if interpolate(pixels, offset, m, n, i, j, row_zoom, col_zoom) <= 0:
+                            low_value = 0.0
+
+            image = images[image_index[k]]
+            top, left = corners[k, 0], corners[k, 1]
+            for i in range(rows):
+                for j in range(cols):
+                    value = interpolate(pixels, offset, m, n, i, j, row_zoom, col_zoom)
+                    src = np.int32(np.uint8(min(max(value, low_value), high_value)))
+                    dst = np.int32(image[top + i, left + j])
+                    if mode == 0:
+                        dst = max(dst, src)
+                    elif mode == 1:
+                        dst = dst * (255 - src) + 128
+                        dst = src + ((dst + (dst >> 8)) >> 8)
+                    else:
+                        dst = min(dst + src, 255)
+                    image[top + i, left + j] = dst
+
+    return {'noise'     : noise_kernel,
+            'composite' : composite_kernel}
+
+def _noise_images(shape,
+                  noise_intensity,
+                  rng,
+                  kernels = None):
+    """
+    Definition:
+    Uniform noise for a batch of images: 16 random bits per pixel, cut from raw
+    64-bit draws of a Generator seeded from rng, are scaled to [0, noise_intensity)
+    with a multiply and shift as in backgrounds.uniform_noise. Filled in chunks of
+    about a million pixels, so the temporaries stay in cache.
+
+    Parameters:
+    shape ((int , int , int))   : number, height and width of the images
+    noise_intensity (int)       : exclusive upper bound of the values, at most 256
+    rng (np.random.RandomState) : random source the Generator is seeded from
+    kernels (dict)              : _numba_batch_kernels, NumPy when None
+
+    Returns:
+    images (np.array) : uint8 array of shape
+    """
+    generator = np.random.default_rng(rng.randint(0, 2**31))
+    images = np.empty(shape, dtype=np.uint8)
+    flat = images.reshape(shape[0], shape[1] * shape[2])
+    step = max(1, BATCH_CHUNK_PIXELS // max(flat.shape[1], 1))
+    for start in range(0, len(flat), step):
+        chunk = flat[start:start + step].reshape(-1)
+        words = generator.integers(0, 2**64 - 1, -(-chunk.size // 4), dtype=np.uint64, endpoint=True)
+        values = words.view(np.uint16)[:chunk.size]
+        if kernels is not None:
+            kernels['noise'](values, noise_intensity, chunk)
+            continue
+        values = np.multiply(values, np.uint32(noise_intensity), dtype=np.uint32)
+        values >>= 16
+        chunk[...] = values
+
+    return images
+
+def _atlas_stack(atlas,
+                 indices):
+    """
+    Definition:
+    Stacks digit crops of the atlas, each padded with zeros to the largest crop
+
+    Parameters:
+    atlas (dict)       : digit atlas holding the crops
+    indices (np.array) : (K,) digit indices
+
+    Returns:
+    crops (np.array)  : (K, max height, max width) uint8 crops in the top left corner
+    inside (np.array) : (K, max height, max width) bool mask of the crop pixels
+    """
+    m = atlas['shapes'][indices, 0].astype(np.int64)[:, None, None]
+    n = atlas['shapes'][indices, 1].astype(np.int64)[:, None, None]
+    rows = np.arange(m.max())[None, :, None]
+    cols = np.arange(n.max())[None, None, :]
+    inside = (rows < m) & (cols < n)
+    pixels = atlas['offsets'][indices].astype(np.int64)[:, None, None] + rows * n + cols
+    crops = np.where(inside, atlas['pixels'][np.where(inside, pixels, 0)], 0).astype(np.uint8)
+
+    return crops, inside
+
+def _zoom_weights(size,
+                  resized,
+                  size_max):
+    """
+    Definition:
+    Linear interpolation weights along one axis of many crops, computed the way
+    scipy.ndimage.zoom (used by skimage's resize) computes them
+
+    Parameters:
+    size (np.array)    : (K,) length of every crop along the axis
+    resized (np.array) : (K,) length of every resized crop
+    size_max (int)     : largest crop length, bounds the indices
+
+    Returns:
+    first (np.array)  : (K, max resized) index of the first neighbour in the crops padded by one
+    before (np.array) : (K, max resized) weight of the first neighbour
+    after (np.array)  : (K, max resized) weight of the second neighbour
+    """
+    position = (np.arange(resized.max()) + 0.5) * (size / resized)[:, None] - 0.5
+    first = np.floor(position)
+    after = position - first
+    # Positions past the end of the shorter crops are dropped, they only stay in bounds
+    first = np.clip(first.astype(np.int64) + 1, 0, size_max)
+
+    return first, 1 - after, after
+
+def _resize_crops(atlas,
+                  indices,
+                  shapes):
+    """
+    Definition:
+    Resizes many digit crops at once, bit-identical to resize_object followed by the
+    uint8 truncation of composite_object. The crops are stacked with a border of
+    zeros (skimage's constant padding), every output pixel weighs its four
+    neighbours, rows first as scipy sums them, and the result is clipped to the
+    range of its crop as skimage clips it.
+
+    Parameters:
+    atlas (dict)       : digit atlas holding the crops
+    indices (np.array) : (K,) digit indices
+    shapes (np.array)  : (K, 2) height and width of the resized crops, from resized_shape
+
+    Returns:
+    resized (np.array) : (K, max height, max width) uint8 resized crops in the top left corner
+    """
+    crops, inside = _atlas_stack(atlas, indices)
+    count, m_max, n_max = crops.shape
+    padded = np.zeros((count, m_max + 2, n_max + 2), dtype=np.uint8)
+    padded[:, 1:-1, 1:-1] = crops
+    low = np.where(inside, crops, 255).min(axis=(1, 2)).astype(np.float64)
+    high = crops.max(axis=(1, 2)).astype(np.float64)
+
+    rows, row_before, row_after = _zoom_weights(atlas['shapes'][indices, 0], shapes[:, 0], m_max)
+    cols, col_before, col_after = _zoom_weights(atlas['shapes'][indices, 1], shapes[:, 1], n_max)
+
+    # Gather the two neighbouring columns on the small padded crops, then their rows
+    left = np.take_along_axis(padded, cols[:, None, :], axis=2)
+    right = np.take_along_axis(padded, cols[:, None, :] + 1, axis=2)
+    crop = np.arange(count)[:, None]
+    row_before, row_after = row_before[:, :, None], row_after[:, :, None]
+    col_before, col_after = col_before[:, None, :], col_after[:, None, :]
+
+    resized = left[crop, rows] * row_before
+    resized *= col_before
+    for neighbours, row_weight, col_weight in ((right[crop, rows], row_before, col_after),
+                                               (left[crop, rows + 1], row_after, col_before),
+                                               (right[crop, rows + 1], row_after, col_after)):
+        term = neighbours * row_weight
+        term *= col_weight
+        resized += term
+
+    # The padding value 0 widens the clip range when the output holds it and the crop does not
+    valid = ((np.arange(resized.shape[1])[:, None] < shapes[:, 0, None, None]) &
+             (np.arange(resized.shape[2]) < shapes[:, 1, None, None]))
+    low[(low > 0) & (np.where(valid, resized, np.inf).min(axis=(1, 2)) <= 0)] = 0
+    np.clip(resized, low[:, None, None], high[:, None, None], out=resized)
+
+    return resized.astype(np.uint8)
+
+def _composite_batch(images,
+                     atlas,
+                     indices,
+                     scales,
+                     shapes,
+                     image_index,
+                     corners,
+                     slots,
+                     blend_mode):
+    """
+    Definition:
+    NumPy path of create_images: resizes the objects together per scale value and
+    blends all their pixels in place with one gather and scatter. Pixels of objects
+    that may overlap are blended one object slot at a time, in placement order.
+
+    Parameters:
+    images (np.array)      : (B, height, width) uint8 images, modified in place
+    atlas (dict)           : digit atlas holding the crops
+    indices (np.array)     : (K,) digit index of every object
+    scales (np.array)      : (K,) scale value of every object
+    shapes (np.array)      : (K, 2) height and width of every resized object
+    image_index (np.array) : (K,) image of every object
+    corners (np.array)     : (K, 2) top row and left column of every object
+    slots (np.array)       : (K,) object slot of every object, None when objects never overlap
+    blend_mode (str)       : how objects are combined with the images, see blend.BLEND_MODES
+    """
+    height, width = images.shape[1:]
+    starts = (image_index * height + corners[:, 0]) * width + corners[:, 1]
+
+    # Destination and value of every object pixel, per blend wave
+    waves = {}
+    for scale_value in np.unique(scales):
+        # Chunks of similar sizes pad the stacked crops the least
+        group = np.nonzero(scales == scale_value)[0]
+        group = group[np.argsort(shapes[group, 0] * shapes[group, 1], kind='stable')]
+        step = max(1, BATCH_CHUNK_PIXELS // int((shapes[group, 0] * shapes[group, 1]).max()))
+        for chunk in (group[start:start + step] for start in range(0, len(group), step)):
+            if scale_value == 1:
+                crops, _ = _atlas_stack(atlas, indices[chunk])
+            else:
+                crops = _resize_crops(atlas, indices[chunk], shapes[chunk])
+            rows = np.arange(crops.shape[1])[None, :, None]
+            cols = np.arange(crops.shape[2])[None, None, :]
+            valid = (rows < shapes[chunk, 0, None, None]) & (cols < shapes[chunk, 1, None, None])
+            destination = (starts[chunk, None, None] + rows * width + cols)[valid]
+            values = crops[valid]
+            if slots is None:
+                waves.setdefault(0, []).append((destination, values))
+                continue
+            wave = np.broadcast_to(slots[chunk, None, None], valid.shape)[valid]
+            for slot in np.unique(wave):
+                waves.setdefault(slot, []).append((destination[wave == slot], values[wave == slot]))
+
+    flat = images.reshape(-1)
+    for slot in sorted(waves):
+        destination = np.concatenate([pixels for pixels, _ in waves[slot]])
+        canvas = flat[destination]
+        blend.blend(canvas[None], np.concatenate([values for _, values in waves[slot]])[None],
+                    blend_mode, use_numba=False)
+        flat[destination] = canvas
+
+def create_images(objects,
+                  labels,
+                  batch_size,
+                  image_size = (128, 128),
+                  noise_intensity = 180,
+                  grid_rows = 4,
+                  grid_cols = 4,
+                  max_objects = 8,
+                  max_scaling = 2.5,
+                  add_gridlines = False,
+                  allow_overlap = False,
+                  corner_coordinates=True,
+                  atlas=None,
+                  min_objects = 0,
+                  max_retries = 0,
+                  placement_stats=None,
+                  background=None,
+                  blend_mode='max',
+                  rng=None,
+                  use_numba=None):
+    """
+    Definition:
+    Batched create_image. Every random choice is drawn for the whole batch, and
+    placement, retries and overlap checks run on arrays over the images, one object
+    slot at a time. Accepted objects are resized bit-identical to resize_object and
+    composited in placement order, so non-commutative blends (alpha) match
+    create_image. With Numba one compiled kernel resizes and blends every object;
+    the NumPy path resizes the objects together per scale value and blends all their
+    pixels at once (once per object slot when objects may overlap), with identical
+    results. Images follow the distribution of create_image but not its random
+    stream; the uniform noise is drawn from raw 16 bit values.
+
+    Parameters:
+    objects (np.array)         : all images of MNIST dataset
+    label (np.array)           : all associated classes and bbox labels of MNIST dataset
+    batch_size (int)           : number of images to create
+    image_size ((int , int))   : the set height and width of returned images
+    noise_intensity (int)      : the scalar intensity value for the background noise
+    grid_rows (int)            : number of rows the image is broken down into
+    grid_cols (int)            : number of cols the image is broken down into
+    max_objects (int)          : exclusive upper limit of objects to be added to an image
+    max_scaling (float)        : upper limit of size scalar for objects
+    add_gridlines (bool)       : adds gridlines to images if True
+    allow_overlap (bool)       : removes added object if it overlaps with another object if False
+    corner_coordinates (bool)  : defines what bbox coordinate system is in use
+    atlas (dict)               : digit atlas of objects, built from labels when None
+    min_objects (int)          : inclusive lower limit of objects to be added to an image
+    max_retries (int)          : placements retried per object after overlapping
+    placement_stats (PlacementStats) : counters updated with the placements of the batch
+    background (NoiseBank)     : background engine every background is drawn from, uniform
+                                 noise when None
+    blend_mode (str)           : how objects are combined with the images, see blend.BLEND_MODES
+    rng (np.random.RandomState): random source, the global np.random when None
+    use_numba (bool)           : use the Numba kernels, when Numba is installed when None
+
+    Returns:
+    images (np.array)      : (batch_size, height, width) uint8 created images
+    annotations (np.array) : (K, 6) array of [image index, class, bbox_norm] rows, one per
+                             added object, ordered by image and then by object
+    """
+    if blend_mode not in blend.BLEND_MODES:
+        raise ValueError(f"Unknown blend mode '{blend_mode}'")
+    kernels = _numba_batch_kernels() if use_numba or use_numba is None else None
+    if use_numba and kernels is None:
+        raise ImportError("use_numba requires numba")
+
+    rng = np.random if rng is None else rng
+    if atlas is None:
+        atlas = build_digit_atlas(objects, labels_to_bbox_table(labels, corner_coordinates))
+
+    height, width = image_size
+    num_regions = grid_rows * grid_cols
+    if max_objects - 1 > num_regions:
+        raise ValueError(f"max_objects {max_objects} exceeds the {num_regions} grid regions + 1")
+    data_size = len(atlas['offsets'])
+    scaling_options = np.arange(1, max_scaling + 0.125, 0.125)
+    region_x = int(width / grid_rows)
+    region_y = int(height / grid_cols)
+
+    if background is None:
+        images = _noise_images((batch_size, height, width), noise_intensity, rng, kernels)
+    else:
+        images = np.empty((batch_size, height, width), dtype=np.uint8)
+        for image in images:
+            image[...] = background.draw(image_size, rng = rng)
+    if add_gridlines:
+        for i in range(1, grid_rows):
+            images[:, i * (height // grid_rows), :] = 0
+        for j in range(1, grid_cols):
+            images[:, :, j * (width // grid_cols)] = 0
+
+    # A random order of the regions of every image: the first num_objects are
+    # populated and retried objects move to the next unused ones
+    num_objects = rng.randint(min_objects, max_objects, batch_size)
+    slots = int(num_objects.max()) if batch_size else 0
+    region_order = np.argsort(rng.random_sample((batch_size, num_regions)), axis=1) + 1
+    next_spare = num_objects.copy()
+
+    # Accepted objects of every (image, slot)
+    accepted = np.zeros((batch_size, slots), dtype=bool)
+    indices = np.zeros((batch_size, slots), dtype=np.int64)
+    scales = np.ones((batch_size, slots))
+    boxes = np.zeros((batch_size, slots, 4), dtype=np.int64)
+    attempts = rejected = retries = scale_clamps = 0
+
+    for slot in range(slots):
+        trying = np.nonzero(num_objects > slot)[0]
+        regions = region_order[trying, slot]
+        for retry in range(max_retries + 1):
+            if retry:
+                retries += len(trying)
+                spare = next_spare[trying] < num_regions
+                regions = np.where(spare, region_order[trying, np.minimum(next_spare[trying], num_regions - 1)], regions)
+                next_spare[trying] += spare
+
+            # Draw and place the objects exactly like place_object / resized_shape
+            index = rng.randint(0, data_size, len(trying))
+            scaler = rng.choice(scaling_options, len(trying))
+            row_center = rng.randint(0, region_y + 1, len(trying)) + ((regions - 1) // grid_cols) * region_y
+            col_center = rng.randint(0, region_x + 1, len(trying)) + ((regions - 1) % grid_cols) * region_x
+
+            m = atlas['shapes'][index, 0].astype(np.int64)
+            n = atlas['shapes'][index, 1].astype(np.int64)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                fit = np.minimum(region_x / n, region_y / m)
+                scale = np.where(scaler > fit * 2, np.floor(fit * 20) / 10 - 0.5, scaler)
+                scaled = scale != 1
+                m = np.where(scaled, np.round(m * (1 / (m / (m * scale)))), m).astype(np.int64)
+                n = np.where(scaled, np.round(n * (1 / (n / (n * scale)))), n).astype(np.int64)
+            attempts += len(trying)
+            scale_clamps += int((scale != scaler).sum())
+
+            row_min = row_center - m // 2
+            col_min = col_center - n // 2
+            row_min -= np.where(row_min < 0, row_min, np.maximum(row_min + m - height + 1, 0))
+            col_min -= np.where(col_min < 0, col_min, np.maximum(col_min + n - width + 1, 0))
+            box = np.stack([col_min, row_min, col_min + n, row_min + m], axis=1)
+
+            if allow_overlap:
+                placed = np.ones(len(trying), dtype=bool)
+            else:
+                # Closed boxes as in OccupancyGrid: touching an accepted box overlaps it
+                others = boxes[trying, :slot]
+                overlap = ((others[:, :, 0] <= box[:, None, 2]) & (box[:, None, 0] <= others[:, :, 2]) &
+                           (others[:, :, 1] <= box[:, None, 3]) & (box[:, None, 1] <= others[:, :, 3]))
+                placed = ~(overlap & accepted[trying, :slot]).any(axis=1)
+                rejected += int((~placed).sum())
+
+            done = trying[placed]
+            accepted[done, slot] = True
+            indices[done, slot] = index[placed]
+            scales[done, slot] = scale[placed]
+            boxes[done, slot] = box[placed]
+
+            trying, regions = trying[~placed], regions[~placed]
+            if not len(trying):
+                break
+
+    image_index, slot_index = np.nonzero(accepted)
+    object_index, object_scale, object_box = indices[accepted], scales[accepted], boxes[accepted]
+    shapes = np.stack([object_box[:, 3] - object_box[:, 1], object_box[:, 2] - object_box[:, 0]], axis=1)
+
+    # Objects are ordered by image and then by slot, i.e. in placement order
+    if kernels is not None:
+        kernels['composite'](images,
+                             atlas['pixels'],
+                             atlas['offsets'][object_index].astype(np.int64),
+                             atlas['shapes'][object_index].astype(np.int64),
+                             shapes,
+                             image_index,
+                             object_box[:, [1, 0]],
+                             blend.BLEND_MODES.index(blend_mode))
+    else:
+        _composite_batch(images, atlas, object_index, object_scale, shapes, image_index,
+                         object_box[:, [1, 0]], slot_index if allow_overlap else None, blend_mode)
+
+    if placement_stats is not None:
+        placement_stats.merge({'images'       : batch_size,
+                               'requested'    : int(num_objects.sum()),
+                               'attempts'     : attempts,
+                               'accepted'     : len(object_index),
+                               'rejected'     : rejected,
+                               'retries'      : retries,
+                               'scale_clamps' : scale_clamps,
+                               'resizes'      : int((object_scale != 1).sum())})
+
+    bboxes = object_box.astype(np.float64)
+    if not corner_coordinates:
+        bboxes = geometry.to_center(bboxes)
+    bboxes = geometry.normalize(bboxes, image_size)
+
+    annotations = np.column_stack([image_index,
+                                   labels[object_index, 0],
+                                   bboxes])
+
+    return images, annotations
+
+def _spans(starts,
+           stops):
+    """
+    Definition:
+    Enumerates the integers of many inclusive ranges at once
+
+    Parameters:
+    starts (np.array) : (N,) int first value of every range
+    stops (np.array)  : (N,) int last value of every range
+
+    Returns:
+    owners (np.array) : range index of every value
+    values (np.array) : the values of all ranges, concatenated
+    """
+    lengths = np.maximum(stops - starts + 1, 0)
+    owners = np.repeat(np.arange(len(starts)), lengths)
+    offsets = np.arange(len(owners)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+    return owners, starts[owners] + offsets
+
 def add_bboxes_to_image(image, 
                         added_objects, 
                         label_color_map,
                         corner_coordinates=True):
     """
     Definition
-    Convert image to RGB and overlay bboxes colored by class
+    Convert image to RGB and overlay bboxes colored by class. The one pixel outlines
+    of all bboxes are scattered in a single pass, clipped to the image and with later
+    objects drawn on top, as drawing them one by one would.
 
     Parameters:
     image (np.array)           : image
@@ -437,41 +1824,96 @@ def add_bboxes_to_image(image,
     Returns:
     image (np.array) : RGB image with bboxes
     """    
+    height, width = image.shape[:2]
+
+    bboxes = np.array([value['bbox_true'] for value in added_objects.values()]).reshape(-1, 4)
+    bboxes = geometry.as_corner(bboxes, corner_coordinates).astype(int)
+    bboxes = np.clip(bboxes, 0, [width - 1, height - 1, width - 1, height - 1])
+    classes = np.array([value['class'] for value in added_objects.values()], dtype=int)
+
+    # Pixels of the four edges of every bbox, ordered by object so later objects are drawn on top
+    x_min, y_min, x_max, y_max = bboxes.T
+    owners_x, xs = _spans(x_min, x_max)
+    owners_y, ys = _spans(y_min, y_max)
+    owners = np.concatenate([owners_x, owners_x, owners_y, owners_y])
+    rows = np.concatenate([y_min[owners_x], y_max[owners_x], ys, ys])
+    cols = np.concatenate([xs, xs, x_min[owners_y], x_max[owners_y]])
+    order = np.argsort(owners, kind='stable')
+
+    colors = np.zeros((max(label_color_map) + 1, 3), dtype=np.uint8)
+    for class_id, color in label_color_map.items():
+        colors[class_id] = color
+
     image = np.stack([image, image, image], axis=-1)
+    image[rows[order], cols[order]] = colors[classes[owners[order]]]
 
-    for _ , value in added_objects.items():
-        
-        if corner_coordinates:
-            x_min, y_min, x_max, y_max = value['bbox_true']
-        else:
-            center_x, center_y, width, height = value['bbox_true']
-            x_min, y_min, x_max, y_max = to_corner_coordinates(center_x, center_y, width, height)
-
-        image = cv2.rectangle(image, 
-                              (int(x_min), int(y_min)),
-                              (int(x_max), int(y_max)),  
-                              color=label_color_map[value['class']], 
-                              thickness=1)
-    
     return image
 
+def added_object_corners(added_object,
+                         corner_coordinates=True):
+    """
+    Definition
+    Returns the pixel corner coordinates of an added object in either coordinate system
+
+    Parameters:
+    added_object (dict)       : class and bbox information of one added object
+    corner_coordinates (bool) : defines what bbox coordinate system is in use
+
+    Returns:
+    list: [x_min, y_min, x_max, y_max]
+    """
+    if corner_coordinates:
+        return list(added_object['bbox_true'])
+    return to_corner_coordinates(*added_object['bbox_true'])
+
 def added_objects_txt(added_objects):
     """
     Definition
+    Formats the added objects as a table for display, the fields of the YOLO
+    annotation lines centered in columns separated by |
 
     Parameters:
+    added_objects (dict) : dictionary with all object and bbox information
 
     Returns:
-    
-    """    
+    labels (str) : one row per object
+    """
+    return "\n".join('|'.join('{: ^10}'.format(field) for field in line.split(' '))
+                     for line in added_objects_yolo(added_objects).splitlines())
+
+def added_objects_yolo(added_objects):
+    """
+    Definition
+    Formats the added objects as the lines of a YOLO annotation file
+
+    Parameters:
+    added_objects (dict) : dictionary with all object and bbox information
+
+    Returns:
+    labels (str) : one "class a b c d" line per object with normalized coordinates
+    """
     labels_list = []
     for added_object in added_objects.values():
         class_id = added_object['class']
         a, b, c, d = added_object['bbox_norm']
-        bbox_data = [a, b, c, d]
-        bbox_data = [f'{x:.6f}' for x in bbox_data]
-        bbox_data = [class_id] + bbox_data
-        bbox_data = ['{: ^10}'.format(data) for data in bbox_data]
-        labels_list.append('|'.join(bbox_data))
+        labels_list.append(f"{class_id} {a:.6f} {b:.6f} {c:.6f} {d:.6f}")
+
+    return "\n".join(labels_list)
+
+def added_objects_array(added_objects):
+    """
+    Definition
+    Packs the added objects into an array of normalized labels
+
+    Parameters:
+    added_objects (dict) : dictionary with all object and bbox information
+
+    Returns:
+    labels (np.array) : (k, 5) float32 array of [class, bbox_norm] rows
+    """
+    labels = np.zeros((len(added_objects), 5), dtype=np.float32)
+    for row, added_object in enumerate(added_objects.values()):
+        labels[row, 0] = added_object['class']
+        labels[row, 1:] = added_object['bbox_norm']
 
-    return "\n".join(labels_list)
\ No newline at end of file
+    return labels
@@ -0,0 +1,795 @@
+import os
+import io
+import json
+import shutil
+import tarfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import numpy as np
+
+from utils import added_objects_yolo, added_objects_array, added_object_corners
+from targets import grid_targets, target_shape
+
+# Class value of the padding rows of fixed-size box arrays
+PAD_CLASS = -1
+# Files of the raw output format
+RAW_FILES = {'images'  : 'images.npy',
+             'boxes'   : 'boxes.npy',
+             'counts'  : 'counts.npy',
+             'targets' : 'targets.npy',
+             'header'  : 'header.json'}
+# Output formats that can store the grid targets of config['grid_targets']
+TARGET_FORMATS = ('tar', 'packed', 'raw')
+
+def payload_nbytes(payload):
+    """
+    Definition:
+    Counts the bytes of an encoded record: bytes, text, arrays and nested tuples or lists of them
+
+    Parameters:
+    payload : record returned by a writer's encode
+
+    Returns:
+    nbytes (int) : size of the record
+    """
+    if isinstance(payload, (bytes, bytearray, memoryview, str)):
+        return len(payload)
+    if isinstance(payload, np.ndarray):
+        return payload.nbytes
+    if isinstance(payload, (tuple, list)):
+        return sum(payload_nbytes(item) for item in payload)
+    return 0
+
+def write_file(path, data):
+    """
+    Definition:
+    Writes one file through a temporary file renamed into place, so after a crash
+    path either holds the complete data or does not exist.
+
+    Parameters:
+    path (str)         : destination path
+    data (bytes | str) : file contents, str is written as text
+    """
+    with open(path + '.tmp', 'w' if isinstance(data, str) else 'wb') as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
+
+def encode_image(image, extension = '.jpg'):
+    """
+    Definition:
+    Encodes an image into the bytes of an image file
+
+    Parameters:
+    image (np.array) : image to encode
+    extension (str)  : file type, as understood by cv2.imencode
+
+    Returns:
+    data (bytes) : encoded image file
+    """
+    import cv2
+
+    ok, buffer = cv2.imencode(extension, image)
+    if not ok:
+        raise ValueError(f"Could not encode image as {extension}")
+    return buffer.tobytes()
+
+def encode_array(array):
+    """
+    Definition:
+    Serializes an array in the .npy format, read back with decode_array
+
+    Parameters:
+    array (np.array) : array to serialize
+
+    Returns:
+    data (bytes) : .npy file contents
+    """
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    return buffer.getvalue()
+
+def decode_array(data):
+    """
+    Definition:
+    Reads an array serialized by encode_array
+
+    Parameters:
+    data (bytes) : .npy file contents
+
+    Returns:
+    array (np.array) : the array
+    """
+    return np.load(io.BytesIO(data))
+
+def image_targets(added_objects, config):
+    """
+    Definition:
+    Grid targets of one image for config['grid_targets'], see targets.grid_targets
+
+    Parameters:
+    added_objects (dict) : dictionary with all object and bbox information
+    config (dict)        : generation config
+
+    Returns:
+    targets (np.array) : float32 array of targets.target_shape
+    """
+    return grid_targets(added_objects_array(added_objects),
+                        config['grid_rows'],
+                        config['grid_cols'],
+                        corner_coordinates=config['corner_coordinates'],
+                        anchors=config['anchors'])
+
+class DatasetWriter:
+    """
+    Definition:
+    Base class of the dataset writers. A writer is opened by a generation worker for
+    one contiguous range of image ids and receives the images of that range in order.
+    Used as a context manager, leaving the block closes the writer and an exception
+    aborts it.
+
+    Parameters:
+    output_directory (str) : directory the dataset is written to
+    id_range ((int , int)) : start and stop image id handled by this writer
+    config (dict)          : generation config
+    """
+    # Whether id ranges have to follow the shard boundaries of config['shard_size']
+    sharded = False
+    # Whether store has to be called in image id order
+    ordered = False
+
+    def __init__(self, output_directory, id_range, config):
+        self.output_directory = output_directory
+        self.id_range = id_range
+        self.config = config
+        # Bytes of the records written so far, see payload_nbytes
+        self.bytes_written = 0
+
+    @classmethod
+    def prepare(cls, output_directory, config):
+        """
+        Definition:
+        Creates the directories of the dataset layout, called once before generation.
+        """
+        os.makedirs(output_directory, exist_ok=True)
+
+    @classmethod
+    def finalize(cls, output_directory, config):
+        """
+        Definition:
+        Completes the dataset once every id range is written, called once after generation.
+        Whatever a resumed run needs to finalize again has to be kept until cleanup.
+        """
+        pass
+
+    @classmethod
+    def cleanup(cls, output_directory, config):
+        """
+        Definition:
+        Removes what finalize kept, called once the manifest marks the dataset complete
+        (and again by a resume of a complete dataset).
+        """
+        pass
+
+    @classmethod
+    def verify(cls, output_directory, id_range, config):
+        """
+        Definition:
+        Checks that the files of a committed id range are in place, run on the last
+        ranges of the manifest when resuming.
+
+        Returns:
+        complete (bool) : False when the range has to be written again
+        """
+        return True
+
+    @classmethod
+    def recover(cls, output_directory, config, ranges):
+        """
+        Definition:
+        Removes what id ranges that were not committed left behind, run once before
+        a resumed run writes again. Sweeps the temporary files of the writes an
+        interruption cut short from the whole output directory.
+
+        Parameters:
+        ranges (list) : committed (start, stop) id ranges
+        """
+        for root, _, names in os.walk(output_directory):
+            for name in names:
+                if name.endswith('.tmp'):
+                    os.remove(os.path.join(root, name))
+
+    def encode(self, image_id, image, added_objects):
+        """
+        Definition:
+        Encodes one created image and its annotation into what store writes. Does no
+        I/O and is safe to run on several threads at once.
+
+        Parameters:
+        image_id (int)       : id of the image in the dataset
+        image (np.array)     : created image
+        added_objects (dict) : dictionary with all object and bbox information
+
+        Returns:
+        payload : encoded record passed to store
+        """
+        raise NotImplementedError
+
+    def store(self, image_id, payload):
+        """
+        Definition:
+        Writes one encoded record to the dataset
+
+        Parameters:
+        image_id (int) : id of the image in the dataset
+        payload        : encoded record returned by encode
+        """
+        raise NotImplementedError
+
+    def write(self, image_id, image, added_objects):
+        """
+        Definition:
+        Encodes and writes one created image and its annotation
+
+        Parameters:
+        image_id (int)       : id of the image in the dataset
+        image (np.array)     : created image
+        added_objects (dict) : dictionary with all object and bbox information
+        """
+        self.bytes_written += self._write(image_id, image, added_objects)
+
+    def _write(self, image_id, image, added_objects):
+        # write without touching bytes_written, safe on several threads of unordered writers
+        payload = self.encode(image_id, image, added_objects)
+        self.store(image_id, payload)
+        return payload_nbytes(payload)
+
+    def close(self):
+        pass
+
+    def abort(self):
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+class YoloAnnotationWriter(DatasetWriter):
+    """
+    Definition:
+    Writes the YOLO annotation of every image as labels/%08d.txt
+    """
+    @classmethod
+    def prepare(cls, output_directory, config):
+        os.makedirs(os.path.join(output_directory, r"labels"), exist_ok=True)
+
+    def encode(self, image_id, image, added_objects):
+        return added_objects_yolo(added_objects)
+
+    @classmethod
+    def verify(cls, output_directory, id_range, config):
+        return all(os.path.exists(os.path.join(output_directory, r"labels", f"{image_id:08d}.txt"))
+                   for image_id in range(*id_range))
+
+    def store(self, image_id, payload):
+        # Write the YOLO annotation text file
+        write_file(os.path.join(self.output_directory, r"labels", f"{image_id:08d}.txt"), payload)
+
+class VocAnnotationWriter(DatasetWriter):
+    """
+    Definition:
+    Writes the Pascal VOC annotation of every image as Annotations/%08d.xml. The XML
+    is built in encode, i.e. on the threads of an AsyncWriter.
+    """
+    @classmethod
+    def prepare(cls, output_directory, config):
+        os.makedirs(os.path.join(output_directory, r"Annotations"), exist_ok=True)
+
+    def encode(self, image_id, image, added_objects):
+        height, width = image.shape[:2]
+        lines = ['<annotation>',
+                 '\t<folder>images</folder>',
+                 f'\t<filename>{image_id:08d}.jpg</filename>',
+                 f'\t<size><width>{width}</width><height>{height}</height><depth>1</depth></size>',
+                 '\t<segmented>0</segmented>']
+        for added_object in added_objects.values():
+            x_min, y_min, x_max, y_max = added_object_corners(added_object, self.config['corner_coordinates'])
+            lines += ['\t<object>',
+                      f'\t\t<name>{added_object["class"]}</name>',
+                      '\t\t<pose>Unspecified</pose>',
+                      '\t\t<truncated>0</truncated>',
+                      '\t\t<difficult>0</difficult>',
+                      f'\t\t<bndbox><xmin>{x_min:g}</xmin><ymin>{y_min:g}</ymin><xmax>{x_max:g}</xmax><ymax>{y_max:g}</ymax></bndbox>',
+                      '\t</object>']
+        lines.append('</annotation>')
+
+        return '\n'.join(lines)
+
+    @classmethod
+    def verify(cls, output_directory, id_range, config):
+        return all(os.path.exists(os.path.join(output_directory, r"Annotations", f"{image_id:08d}.xml"))
+                   for image_id in range(*id_range))
+
+    def store(self, image_id, payload):
+        write_file(os.path.join(self.output_directory, r"Annotations", f"{image_id:08d}.xml"), payload)
+
+class CocoAnnotationWriter(DatasetWriter):
+    """
+    Definition:
+    Writes one COCO annotations.json for the whole dataset in bounded memory. Every
+    id range streams its "images" and "annotations" entries as JSON lines into part
+    files; finalize concatenates the parts in id order into annotations.json and
+    cleanup removes them. Boxes are pixel [x, y, width, height] and annotation ids are
+    image_id * max_objects + object_num + 1, so the file does not depend on the
+    number of workers. Annotations carry the digit scale factor as an extra "scale".
+    The parts are kept until cleanup, so a crash before the manifest is finalized
+    leaves a resume everything it needs to build annotations.json again.
+    """
+    ordered = True
+    parts_directory = 'coco_parts'
+
+    @classmethod
+    def prepare(cls, output_directory, config):
+        os.makedirs(os.path.join(output_directory, cls.parts_directory), exist_ok=True)
+
+    @classmethod
+    def verify(cls, output_directory, id_range, config):
+        part = os.path.join(output_directory, cls.parts_directory, f"{id_range[0]:08d}")
+        return os.path.exists(part + '.images.jsonl') and os.path.exists(part + '.annotations.jsonl')
+
+    @classmethod
+    def recover(cls, output_directory, config, ranges):
+        # Parts of uncommitted ranges would duplicate the entries of the ranges written
+        # again, temporary parts are removed along with them
+        committed = {f"{start:08d}" for start, _ in ranges}
+        parts_directory = os.path.join(output_directory, cls.parts_directory)
+        os.makedirs(parts_directory, exist_ok=True)
+        for name in os.listdir(parts_directory):
+            if name.endswith('.tmp') or name.split('.')[0] not in committed:
+                os.remove(os.path.join(parts_directory, name))
+
+    def __init__(self, output_directory, id_range, config):
+        super().__init__(output_directory, id_range, config)
+        part = os.path.join(output_directory, self.parts_directory, f"{id_range[0]:08d}")
+        self.paths = [part + '.images.jsonl', part + '.annotations.jsonl']
+        self.files = [open(path + '.tmp', 'w') for path in self.paths]
+
+    def encode(self, image_id, image, added_objects):
+        height, width = image.shape[:2]
+        image_entry = json.dumps({'id' : image_id, 'file_name' : f"{image_id:08d}.jpg",
+                                  'width' : width, 'height' : height})
+        annotation_entries = []
+        for object_num, added_object in added_objects.items():
+            x_min, y_min, x_max, y_max = added_object_corners(added_object, self.config['corner_coordinates'])
+            annotation_entries.append(json.dumps({'id'          : image_id * self.config['max_objects'] + object_num + 1,
+                                                  'image_id'    : image_id,
+                                                  'category_id' : added_object['class'],
+                                                  'bbox'        : [x_min, y_min, x_max - x_min, y_max - y_min],
+                                                  'area'        : (x_max - x_min) * (y_max - y_min),
+                                                  'iscrowd'     : 0,
+                                                  'scale'       : added_object['scale']}))
+
+        return image_entry, annotation_entries
+
+    def store(self, image_id, payload):
+        image_entry, annotation_entries = payload
+        self.files[0].write(image_entry + '\n')
+        for entry in annotation_entries:
+            self.files[1].write(entry + '\n')
+
+    def close(self):
+        for f, path in zip(self.files, self.paths):
+            f.close()
+            os.replace(path + '.tmp', path)
+
+    def abort(self):
+        for f, path in zip(self.files, self.paths):
+            f.close()
+            os.remove(path + '.tmp')
+
+    @classmethod
+    def finalize(cls, output_directory, config):
+        parts_directory = os.path.join(output_directory, cls.parts_directory)
+        parts = sorted(name[:-len('.images.jsonl')] for name in os.listdir(parts_directory)
+                       if name.endswith('.images.jsonl'))
+        categories = [{'id' : digit, 'name' : str(digit)} for digit in range(10)]
+
+        with open(os.path.join(output_directory, 'annotations.json.tmp'), 'w') as f:
+            f.write('{"info": ' + json.dumps({'description' : 'MNIST object detection dataset',
+                                              'config' : config}, default=str))
+            f.write(',\n"licenses": [],\n"categories": ' + json.dumps(categories))
+            for key in ('images', 'annotations'):
+                f.write(f',\n"{key}": [')
+                first = True
+                for part in parts:
+                    with open(os.path.join(parts_directory, f"{part}.{key}.jsonl")) as part_file:
+                        for line in part_file:
+                            f.write(('\n' if first else ',\n') + line.rstrip('\n'))
+                            first = False
+                f.write('\n]')
+            f.write('}\n')
+        os.replace(os.path.join(output_directory, 'annotations.json.tmp'),
+                   os.path.join(output_directory, 'annotations.json'))
+
+    @classmethod
+    def cleanup(cls, output_directory, config):
+        parts_directory = os.path.join(output_directory, cls.parts_directory)
+        if os.path.isdir(parts_directory):
+            shutil.rmtree(parts_directory)
+
+# Annotation formats of the images/ layout, selectable with config['annotation_formats']
+ANNOTATION_WRITERS = {'yolo' : YoloAnnotationWriter,
+                      'voc'  : VocAnnotationWriter,
+                      'coco' : CocoAnnotationWriter}
+
+class YoloWriter(DatasetWriter):
+    """
+    Definition:
+    Writes every image as images/%08d.jpg together with its annotation in each of
+    config['annotation_formats'] (YOLO labels/%08d.txt by default, see
+    ANNOTATION_WRITERS). Files are written with write_file, so a crash never
+    leaves a partial image or annotation behind.
+    """
+    @classmethod
+    def prepare(cls, output_directory, config):
+        os.makedirs(os.path.join(output_directory, r"images"), exist_ok=True)
+        for annotation_format in config['annotation_formats']:
+            ANNOTATION_WRITERS[annotation_format].prepare(output_directory, config)
+
+    @classmethod
+    def finalize(cls, output_directory, config):
+        for annotation_format in config['annotation_formats']:
+            ANNOTATION_WRITERS[annotation_format].finalize(output_directory, config)
+
+    @classmethod
+    def cleanup(cls, output_directory, config):
+        for annotation_format in config['annotation_formats']:
+            ANNOTATION_WRITERS[annotation_format].cleanup(output_directory, config)
+
+    @classmethod
+    def verify(cls, output_directory, id_range, config):
+        return (all(os.path.exists(os.path.join(output_directory, r"images", f"{image_id:08d}.jpg"))
+                    for image_id in range(*id_range)) and
+                all(ANNOTATION_WRITERS[annotation_format].verify(output_directory, id_range, config)
+                    for annotation_format in config['annotation_formats']))
+
+    @classmethod
+    def recover(cls, output_directory, config, ranges):
+        # The sweep covers the temporary files of the annotations too
+        super().recover(output_directory, config, ranges)
+        if 'coco' in config['annotation_formats']:
+            CocoAnnotationWriter.recover(output_directory, config, ranges)
+
+    def __init__(self, output_directory, id_range, config):
+        super().__init__(output_directory, id_range, config)
+        self.annotation_writers = [ANNOTATION_WRITERS[annotation_format](output_directory, id_range, config)
+                                   for annotation_format in config['annotation_formats']]
+        self.ordered = any(writer.ordered for writer in self.annotation_writers)
+
+    def encode(self, image_id, image, added_objects):
+        return encode_image(image), [writer.encode(image_id, image, added_objects)
+                                     for writer in self.annotation_writers]
+
+    def store(self, image_id, payload):
+        image_data, annotations = payload
+        write_file(os.path.join(self.output_directory, r"images", f"{image_id:08d}.jpg"), image_data)
+
+        for writer, annotation in zip(self.annotation_writers, annotations):
+            writer.store(image_id, annotation)
+
+    def close(self):
+        for writer in self.annotation_writers:
+            writer.close()
+
+    def abort(self):
+        for writer in self.annotation_writers:
+            writer.abort()
+
+class ShardWriter(DatasetWriter):
+    """
+    Definition:
+    Base class of the writers packing config['shard_size'] images into one shard file.
+    A shard is written sequentially to a temporary file and renamed into place when
+    complete, so a shard file is never partial.
+    """
+    sharded = True
+    ordered = True
+    extension = None
+
+    def __init__(self, output_directory, id_range, config):
+        super().__init__(output_directory, id_range, config)
+        self.path = self.shard_path(output_directory, id_range, config)
+        self.temp_path = self.path + '.tmp'
+
+    @classmethod
+    def shard_path(cls, output_directory, id_range, config):
+        """Path of the shard holding id_range"""
+        shard_index = id_range[0] // config['shard_size']
+        return os.path.join(output_directory, f"shard-{shard_index:06d}{cls.extension}")
+
+    @classmethod
+    def verify(cls, output_directory, id_range, config):
+        return os.path.exists(cls.shard_path(output_directory, id_range, config))
+
+    def encode(self, image_id, image, added_objects):
+        targets = encode_array(image_targets(added_objects, self.config)) if self.config['grid_targets'] else None
+        return encode_image(image), added_objects_yolo(added_objects).encode(), targets
+
+    def abort(self):
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+class TarShardWriter(ShardWriter):
+    """
+    Definition:
+    Writes tar shards in the WebDataset layout, every image stored as the members
+    %08d.jpg and %08d.txt (YOLO annotation) sharing the image id as key, plus
+    %08d.targets.npy (see encode_array) with config['grid_targets'].
+    """
+    extension = '.tar'
+
+    def __init__(self, output_directory, id_range, config):
+        super().__init__(output_directory, id_range, config)
+        self.tar = tarfile.open(self.temp_path, 'w')
+
+    def _add(self, name, data):
+        # Fixed metadata keeps shards identical between runs
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mode = 0o644
+        self.tar.addfile(info, io.BytesIO(data))
+
+    def store(self, image_id, payload):
+        image_data, label_data, target_data = payload
+        self._add(f"{image_id:08d}.jpg", image_data)
+        self._add(f"{image_id:08d}.txt", label_data)
+        if target_data is not None:
+            self._add(f"{image_id:08d}.targets.npy", target_data)
+
+    def close(self):
+        self.tar.close()
+        os.replace(self.temp_path, self.path)
+
+    def abort(self):
+        self.tar.close()
+        super().abort()
+
+class PackedShardWriter(ShardWriter):
+    """
+    Definition:
+    Writes shards as one binary blob of back-to-back records (encoded JPEG followed
+    by the YOLO annotation text) plus an offset index saved as shard-%06d.idx.npy
+    with one [image id, image offset, image bytes, label offset, label bytes] row
+    per image. With config['grid_targets'] every record ends with the .npy encoded
+    grid targets and the index rows gain [targets offset, targets bytes]. See
+    read_packed_shard.
+    """
+    extension = '.bin'
+
+    def __init__(self, output_directory, id_range, config):
+        super().__init__(output_directory, id_range, config)
+        self.index_path = self.path[:-len(self.extension)] + '.idx.npy'
+        self.blob = open(self.temp_path, 'wb', buffering=2**20)
+        self.index = []
+        self.offset = 0
+
+    def store(self, image_id, payload):
+        image_data, label_data, target_data = payload
+        self.blob.write(image_data)
+        self.blob.write(label_data)
+        row = [image_id, self.offset, len(image_data),
+               self.offset + len(image_data), len(label_data)]
+        self.offset += len(image_data) + len(label_data)
+        if target_data is not None:
+            self.blob.write(target_data)
+            row += [self.offset, len(target_data)]
+            self.offset += len(target_data)
+        self.index.append(row)
+
+    def close(self):
+        self.blob.close()
+        with open(self.index_path + '.tmp', 'wb') as f:
+            np.save(f, np.array(self.index, dtype=np.int64).reshape(-1, 7 if self.config['grid_targets'] else 5))
+        os.replace(self.index_path + '.tmp', self.index_path)
+        os.replace(self.temp_path, self.path)
+
+    def abort(self):
+        self.blob.close()
+        super().abort()
+
+class RawWriter(DatasetWriter):
+    """
+    Definition:
+    Writes the dataset uncompressed into preallocated .npy files that training code
+    can memory-map and slice without decoding: images.npy (N, height, width) uint8,
+    boxes.npy (N, max_objects, 5) float32 [class, bbox_norm] rows padded with
+    PAD_CLASS, counts.npy (N,) number of boxes per image, with config['grid_targets']
+    targets.npy (N, *targets.target_shape) float32 grid targets, and header.json
+    holding the generation config. Every writer fills the rows of its own id range
+    in place. See load_raw_dataset.
+    """
+    @classmethod
+    def prepare(cls, output_directory, config):
+        os.makedirs(output_directory, exist_ok=True)
+        n = config['dataset_size']
+        height, width = config['image_size']
+
+        shapes = {'images' : ((n, height, width), np.uint8),
+                  'boxes'  : ((n, config['max_objects'], 5), np.float32),
+                  'counts' : ((n,), np.int32)}
+        if config['grid_targets']:
+            shapes['targets'] = ((n,) + target_shape(config['grid_rows'], config['grid_cols'], config['anchors']),
+                                 np.float32)
+        for key, (shape, dtype) in shapes.items():
+            array = np.lib.format.open_memmap(os.path.join(output_directory, RAW_FILES[key]),
+                                              mode='w+', dtype=dtype, shape=shape)
+            if key == 'boxes':
+                array[...] = PAD_CLASS
+            array.flush()
+            del array
+
+        header = {'config' : config,
+                  'files'  : {key : {'file' : RAW_FILES[key], 'shape' : shape, 'dtype' : np.dtype(dtype).str}
+                              for key, (shape, dtype) in shapes.items()}}
+        with open(os.path.join(output_directory, RAW_FILES['header']), 'w') as f:
+            json.dump(header, f, indent=2, default=str)
+
+    def __init__(self, output_directory, id_range, config):
+        super().__init__(output_directory, id_range, config)
+        keys = ('images', 'boxes', 'counts', 'targets') if config['grid_targets'] else ('images', 'boxes', 'counts')
+        self.arrays = {key : np.load(os.path.join(output_directory, RAW_FILES[key]), mmap_mode='r+')
+                       for key in keys}
+
+    def encode(self, image_id, image, added_objects):
+        targets = image_targets(added_objects, self.config) if self.config['grid_targets'] else None
+        return image, added_objects_array(added_objects), targets
+
+    def store(self, image_id, payload):
+        image, labels, targets = payload
+        labels = labels[:self.arrays['boxes'].shape[1]]
+        self.arrays['images'][image_id] = image
+        self.arrays['boxes'][image_id, :len(labels)] = labels
+        self.arrays['counts'][image_id] = len(labels)
+        if targets is not None:
+            self.arrays['targets'][image_id] = targets
+
+    def close(self):
+        for array in self.arrays.values():
+            array.flush()
+
+def load_raw_dataset(directory, mmap_mode = 'r'):
+    """
+    Definition:
+    Opens a dataset written by RawWriter
+
+    Parameters:
+    directory (str) : output directory of the dataset
+    mmap_mode (str) : np.load memory-map mode, None reads the arrays into memory
+
+    Returns:
+    dataset (dict) : 'images', 'boxes', 'counts' and (when written) 'targets' arrays and the
+                     'header' dict
+    """
+    with open(os.path.join(directory, RAW_FILES['header'])) as f:
+        header = json.load(f)
+
+    dataset = {key : np.load(os.path.join(directory, RAW_FILES[key]), mmap_mode=mmap_mode)
+               for key in header['files']}
+    dataset['header'] = header
+
+    return dataset
+
+class AsyncWriter(DatasetWriter):
+    """
+    Definition:
+    Pipelines a writer behind a thread pool. write() hands the image over and returns,
+    so creating the next images overlaps with encoding (cv2 releases the GIL) and disk
+    I/O. At most max_pending images are in flight; write() blocks beyond that. Records
+    of ordered writers are encoded in parallel but stored by a single thread in id
+    order. The first error of a background write is raised by the next write() or by
+    close(), which also waits for every pending write.
+
+    Parameters:
+    writer (DatasetWriter) : writer doing the encoding and storing
+    num_threads (int)      : number of encoding threads
+    max_pending (int)      : bound of images in flight, 4 * num_threads when None
+    """
+    def __init__(self, writer, num_threads = 4, max_pending = None):
+        self.writer = writer
+        self.encoders = ThreadPoolExecutor(num_threads)
+        self.storer = ThreadPoolExecutor(1) if writer.ordered else None
+        self.slots = threading.BoundedSemaphore(max_pending or 4 * num_threads)
+        self.futures = set()
+        self.lock = threading.Lock()
+        self.error = None
+        self.bytes_written = 0
+
+    def _done(self, future):
+        with self.lock:
+            self.futures.discard(future)
+            if not future.cancelled():
+                if future.exception() is None:
+                    self.bytes_written += future.result()
+                elif self.error is None:
+                    self.error = future.exception()
+        self.slots.release()
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def write(self, image_id, image, added_objects):
+        self._raise_error()
+        self.slots.acquire()
+
+        if self.writer.ordered:
+            encoded = self.encoders.submit(self.writer.encode, image_id, image, added_objects)
+            future = self.storer.submit(self._store, image_id, encoded)
+        else:
+            future = self.encoders.submit(self.writer._write, image_id, image, added_objects)
+
+        with self.lock:
+            self.futures.add(future)
+        future.add_done_callback(self._done)
+
+    def _store(self, image_id, encoded):
+        payload = encoded.result()
+        self.writer.store(image_id, payload)
+        return payload_nbytes(payload)
+
+    def _shutdown(self, cancel):
+        with self.lock:
+            futures = list(self.futures)
+        if cancel:
+            for future in futures:
+                future.cancel()
+        wait(futures)
+        self.encoders.shutdown()
+        if self.storer is not None:
+            self.storer.shutdown()
+
+    def close(self):
+        self._shutdown(cancel=False)
+        if self.error is not None:
+            self.writer.abort()
+            raise self.error
+        self.writer.close()
+
+    def abort(self):
+        self._shutdown(cancel=True)
+        self.writer.abort()
+
+def read_packed_shard(path):
+    """
+    Definition:
+    Iterates over the records of a shard written by PackedShardWriter
+
+    Parameters:
+    path (str) : path of the shard-%06d.bin file
+
+    Returns:
+    iterator of (image_id, image_data, labels) : image id, encoded JPEG bytes and YOLO annotation text,
+                                                 followed by the grid targets array for shards
+                                                 written with config['grid_targets']
+    """
+    index = np.load(path[:-len('.bin')] + '.idx.npy')
+    blob = np.memmap(path, dtype=np.uint8, mode='r') if os.path.getsize(path) else np.zeros(0, np.uint8)
+    for image_id, image_offset, image_nbytes, label_offset, label_nbytes, *target_range in index:
+        record = (int(image_id),
+                  blob[image_offset:image_offset + image_nbytes].tobytes(),
+                  blob[label_offset:label_offset + label_nbytes].tobytes().decode())
+        if target_range:
+            target_offset, target_nbytes = target_range
+            record += (decode_array(blob[target_offset:target_offset + target_nbytes].tobytes()),)
+        yield record
+
+# Dataset layouts selectable with config['output_format']
+WRITERS = {'yolo'   : YoloWriter,
+           'tar'    : TarShardWriter,
+           'packed' : PackedShardWriter,
+           'raw'    : RawWriter}